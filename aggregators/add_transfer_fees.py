@@ -1,81 +1,128 @@
+import glob
+import os
+
+import numpy as np
 import pandas as pd
 
+import metrics
+from dataset import dataset_lock, load_dataset, save_dataset
+from identity import PlayerIndex
+from rollups import refresh_rollups
+from store import Store
+
+TRANSFER_FILES = 'goalkeeper_transfers_*.csv'
+
+def transfer_season_start(seasons):
+    """Start year of Transfermarkt seasons ('25/26' -> 2025, '98/99' -> 1998); unparseable seasons become NaN"""
+    # Plain floats, since np.where cannot compare the nullable NA a missing season parses to
+    two_digit = pd.to_numeric(seasons.astype('string').str[:2], errors='coerce').astype('float64')
+    return two_digit + np.where(two_digit >= 50, 1900, 2000)
+
+# Held from loading goalkeeper_dataset to saving it, so an aggregation cannot run in between
+@dataset_lock('goalkeeper_dataset')
 def add_recent_fees():
     """
     Add Recent Fee column to goalkeeper_dataset by looking through transfer datasets
-    and finding the most recent transfer fee for each goalkeeper.
+    and finding, for each player-season row, the latest transfer fee known as of that season.
     """
     
     print("Loading goalkeeper dataset...")
-    goalkeeper_data = pd.read_csv('goalkeeper_dataset.csv')
-    print(f"Loaded {len(goalkeeper_data)} rows from goalkeeper_dataset.csv")
+    with metrics.timer('aggregate_stage_seconds', stage='load'):
+        goalkeeper_data = load_dataset('goalkeeper_dataset')
+    print(f"Loaded {len(goalkeeper_data)} rows from goalkeeper_dataset")
     
     print("\nLoading transfer datasets...")
-    # Load all three transfer datasets
-    transfers_2025_2026 = pd.read_csv('goalkeeper_transfers_2025_2026.csv')
-    transfers_2024_2025 = pd.read_csv('goalkeeper_transfers_2024_2025.csv')
-    transfers_2023_2024 = pd.read_csv('goalkeeper_transfers_2023_2024.csv')
-    
-    print(f"Loaded {len(transfers_2025_2026)} rows from 2025-2026 transfers")
-    print(f"Loaded {len(transfers_2024_2025)} rows from 2024-2025 transfers")
-    print(f"Loaded {len(transfers_2023_2024)} rows from 2023-2024 transfers")
+    # Load every transfer history file
+    transfer_frames = []
+    for filename in sorted(glob.glob(TRANSFER_FILES)):
+        with metrics.timer('aggregate_stage_seconds', stage='load'):
+            transfers = load_dataset('goalkeeper_transfers', stem=os.path.splitext(filename)[0])
+        print(f"Loaded {len(transfers)} rows from {filename}")
+        transfer_frames.append(transfers)
+    
+    if not transfer_frames:
+        print(f"No transfer files matching {TRANSFER_FILES} found")
+        return goalkeeper_data
     
     # Combine all transfer datasets
-    all_transfers = pd.concat([transfers_2025_2026, transfers_2024_2025, transfers_2023_2024], ignore_index=True)
+    with metrics.timer('aggregate_stage_seconds', stage='concat'):
+        all_transfers = pd.concat(transfer_frames, ignore_index=True)
+    metrics.record_memory(stage='concat')
     print(f"Combined transfer dataset has {len(all_transfers)} total rows")
     
-    # Create season order for sorting (newest first)
-    season_order = {
-        '25/26': 1,
-        '24/25': 2,
-        '23/24': 3
-    }
-    
-    # Add temporary sorting column
-    all_transfers['season_order'] = all_transfers['Season'].map(season_order)
-    
-    # Sort by Player name, then by season order (newest first)
-    all_transfers_sorted = all_transfers.sort_values(['Player', 'season_order'])
-    
-    # Remove the temporary sorting column
-    all_transfers_sorted = all_transfers_sorted.drop('season_order', axis=1)
-    
-    # Get the most recent transfer for each player
-    # Group by Player and take the first row (which will be the most recent due to sorting)
-    most_recent_transfers = all_transfers_sorted.groupby('Player').first().reset_index()
-    
-    print(f"Found {len(most_recent_transfers)} unique players with transfers")
-    
-    # Create a mapping of player name to most recent fee
-    player_fee_mapping = dict(zip(most_recent_transfers['Player'], most_recent_transfers['Fee']))
-    
-    # Add Recent Fee column to goalkeeper dataset
-    goalkeeper_data['Recent Fee'] = goalkeeper_data['Player'].map(player_fee_mapping)
-    
-    # Fill NaN values with empty string (for players without transfers)
-    goalkeeper_data['Recent Fee'] = goalkeeper_data['Recent Fee'].fillna('')
-    
-    # Save the updated dataset
-    goalkeeper_data.to_csv('goalkeeper_dataset.csv', index=False)
-    
-    print(f"\nUpdated goalkeeper_dataset.csv with Recent Fee column")
-    print(f"Players with recent transfers: {len(most_recent_transfers)}")
-    print(f"Players without transfers: {len(goalkeeper_data) - len(most_recent_transfers)}")
-    
-    # Show some examples
-    print(f"\nExample players with recent transfers:")
-    for _, row in most_recent_transfers.head(5).iterrows():
-        print(f"  {row['Player']}: €{row['Fee']}m ({row['Season']})")
+    # Key both sides on the season's start year: a transfer in 24/25 is known from the 2024-2025 season on
+    all_transfers['season_start'] = transfer_season_start(all_transfers['Season'])
+    unknown_seasons = all_transfers['season_start'].isna()
+    if unknown_seasons.any():
+        print(f"Skipping {unknown_seasons.sum()} transfers with an unrecognised season")
+    
+    # Resolve both sides to stable player keys (source IDs, accent-folded names, fuzzy
+    # matches within name blocks) so the join below is on keys rather than raw name strings
+    with metrics.timer('aggregate_stage_seconds', stage='identity'):
+        rows = goalkeeper_data.drop(columns=['Recent Fee', 'Recent Fee Kind'], errors='ignore')
+        # New players are saved with the index, so the store write below resolves to the same keys
+        with PlayerIndex.locked() as index:
+            rows['player_key'] = index.assign_keys(rows['Player'], fbref_ids=rows.get('fbref ID'))
+            all_transfers['player_key'] = index.assign_keys(all_transfers['Player'], transfermarkt_ids=all_transfers.get('Player ID'))
+    metrics.record_memory(stage='identity')
+    
+    # Fees were normalized to euros plus a fee kind when loaded (see fees.normalize_fees)
+    fees = all_transfers.loc[~unknown_seasons, ['player_key', 'season_start', 'Fee', 'Fee Kind']]
+    fees = fees.rename(columns={'Fee': 'Recent Fee', 'Fee Kind': 'Recent Fee Kind'})
+    fees['season_start'] = fees['season_start'].astype('int64')
+    
+    print(f"Found {fees['player_key'].nunique()} unique players with transfers")
+    
+    # As-of join: for every player-season row take the latest transfer with season_start <= the row's season.
+    # merge_asof needs both sides sorted on the join key; the original row order is restored afterwards
+    with metrics.timer('aggregate_stage_seconds', stage='join'):
+        rows['season_start'] = pd.to_numeric(rows['Season'].astype('string').str[:4], errors='coerce')
+        rows['row_order'] = np.arange(len(rows))
+        # Rows with a missing or malformed season cannot be placed in time and keep a missing fee
+        dated = rows['season_start'].notna()
+        if not dated.all():
+            print(f"Skipping {(~dated).sum()} player-season rows with an unrecognised season")
+        joined = pd.merge_asof(
+            rows[dated].astype({'season_start': 'int64'}).sort_values('season_start', kind='stable'),
+            fees.sort_values('season_start', kind='stable'),
+            on='season_start',
+            by='player_key',
+            direction='backward',
+        )
+        joined = pd.concat([joined, rows[~dated]], ignore_index=True)
+        joined = joined.sort_values('row_order').reset_index(drop=True)
+        goalkeeper_data = joined.drop(columns=['player_key', 'season_start', 'row_order'])
+    metrics.record_memory(stage='join')
+    
+    # In the store only transfers that are new or changed, and stats rows whose fee changed, are written
+    with metrics.timer('aggregate_stage_seconds', stage='store'):
+        with Store() as store:
+            store.upsert_dataset('transfers', all_transfers.drop(columns=['season_start', 'player_key']))
+            fee_columns = joined[['player_key', 'Season', 'Squad', 'Recent Fee', 'Recent Fee Kind']].rename(columns={'player_key': 'player_id'})
+            print(f"Store: {store.update('stats', fee_columns)} stats rows got a new Recent Fee")
+            # New or changed transfers change their players' career transfer totals
+            refresh_rollups(store)
+    
+    # Save the updated dataset (typed Parquet plus CSV); rows without an earlier transfer keep a missing fee
+    with metrics.timer('aggregate_stage_seconds', stage='write'):
+        goalkeeper_data = save_dataset(goalkeeper_data, 'goalkeeper_dataset')
+    metrics.record_memory(stage='write')
+    metrics.set_gauge('rows_written', len(goalkeeper_data), dataset='goalkeeper_dataset')
+    
+    rows_with_fees = goalkeeper_data[goalkeeper_data['Recent Fee'].notna()]
+    print(f"\nUpdated goalkeeper_dataset with Recent Fee column")
+    print(f"Player-season rows with a known fee: {len(rows_with_fees)}")
+    print(f"Player-season rows without a known fee: {len(goalkeeper_data) - len(rows_with_fees)}")
     
     # Show players in goalkeeper dataset who have recent transfers
-    players_with_fees = goalkeeper_data[goalkeeper_data['Recent Fee'] != '']
-    print(f"\nPlayers in goalkeeper dataset with recent transfers: {len(players_with_fees['Player'].unique())}")
+    print(f"\nPlayers in goalkeeper dataset with recent transfers: {rows_with_fees['Player'].nunique()}")
     
     # Show first few rows as preview
     print(f"\nFirst 5 rows of updated dataset:")
-    print(goalkeeper_data[['Player', 'Season', 'Squad', 'Recent Fee']].head().to_string(index=False))
+    print(goalkeeper_data[['Player', 'Season', 'Squad', 'Recent Fee', 'Recent Fee Kind']].head().to_string(index=False))
     
     return goalkeeper_data
 
 if __name__ == "__main__":
-    add_recent_fees() 
\ No newline at end of file
+    add_recent_fees()
+    metrics.write_report('add_transfer_fees')
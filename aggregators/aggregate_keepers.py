@@ -1,48 +1,180 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
 import pandas as pd
 
-def aggregate_goalkeeper_stats():
+import metrics
+from aggregators.external_sort import RunWriter, external_sort, merge_runs, rebatch, write_run
+from dataset import dataset_columns, dataset_lock, dataset_paths, iter_dataset, load_dataset, save_dataset
+from schema import apply_schema
+from rollups import refresh_rollups
+from store import STORE_FILE, Store
+
+STATS_FILES = [
+    'keepers_stats_2024_2025.csv',
+    'keepers_stats_2023_2024.csv',
+    'keepers_stats_2022_2023.csv',
+]
+
+# Records a fingerprint of each season file the current goalkeeper_dataset was built from
+MANIFEST_FILE = 'goalkeeper_dataset.manifest.json'
+
+# Every season file, for the streaming aggregation
+STATS_PATTERN = 'keepers_stats_*.csv'
+
+# Streaming aggregation: rows read and sorted per run, and rows per output partition
+CHUNK_ROWS = 100_000
+PARTITION_ROWS = 100_000
+
+# Sorts after every real name, standing in for a missing one in merge keys
+LAST_NAME = '\U0010ffff'
+
+def season_order(seasons):
+    """Sort key putting the newest season first ('2024-2025' -> -2024); unparseable seasons become NaN"""
+    start_year = seasons.astype('string').str.extract(r'^(\d{4})', expand=False)
+    return -pd.to_numeric(start_year, errors='coerce').astype('float64')
+
+def player_season_key(stats):
+    """Merge key for the streaming aggregation, ordered like sort_player_seasons (missing values last)"""
+    return pd.DataFrame({
+        'player': stats['Player'].astype('string').fillna(LAST_NAME),
+        'season_order': season_order(stats['Season']).fillna(np.inf),
+    }, index=stats.index)
+
+def sort_player_seasons(stats):
+    """Sort by Player name first, then by Season (newest to oldest)"""
+    # Add a temporary column for sorting
+    stats = stats.assign(season_order=season_order(stats['Season']))
+    
+    # Stable sort, so concatenated runs that are already sorted are merged rather than reshuffled
+    stats = stats.sort_values(['Player', 'season_order'], kind='stable')
+    
+    # Remove the temporary sorting column
+    return stats.drop('season_order', axis=1)
+
+def file_fingerprint(filename, previous=None):
+    """Content hash, mtime and size of a file; the hash is reused when mtime and size are unchanged"""
+    stat = os.stat(filename)
+    if previous and previous['mtime'] == stat.st_mtime and previous['size'] == stat.st_size:
+        return dict(previous)
+    
+    with open(filename, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return {'sha256': digest, 'mtime': stat.st_mtime, 'size': stat.st_size}
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    with open(MANIFEST_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    with open(f"{MANIFEST_FILE}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{MANIFEST_FILE}.tmp", MANIFEST_FILE)
+
+def unchanged_seasons(manifest, new_manifest):
+    """
+    Seasons whose stored rows are already current: those of files with the same content hash
+    as at the last run, unless a changed file holds rows of them too. Without a store there are none.
+    """
+    if not os.path.exists(STORE_FILE):
+        return set()
+    unchanged, changed = set(), set()
+    for filename, fingerprint in new_manifest.items():
+        previous = manifest.get(filename) or {}
+        if fingerprint['sha256'] == previous.get('sha256'):
+            unchanged.update(previous.get('seasons', []))
+        else:
+            # Before a changed file is read its seasons are not known yet; the last run's stand in
+            changed.update(fingerprint.get('seasons', previous.get('seasons', [])))
+    return unchanged - changed
+
+def store_stats(stats, replace_seasons=True, removed_seasons=()):
+    """
+    Upsert aggregated rows into the store's stats table. Only rows that changed are
+    written; with replace_seasons, stored rows of the same seasons that are not among
+    them are deleted, and removed_seasons are dropped entirely. Fees are left to
+    add_transfer_fees, so stored fees survive a reaggregation. The career rollups of
+    players whose rows changed are refreshed afterwards.
+    """
+    stats = stats.drop(columns=['Recent Fee', 'Recent Fee Kind'], errors='ignore')
+    with metrics.timer('aggregate_stage_seconds', stage='store'):
+        with Store() as store:
+            if len(stats):
+                store.upsert_dataset('stats', stats, replace_seasons=replace_seasons)
+            store.delete_seasons('stats', removed_seasons)
+            refresh_rollups(store)
+
+# The whole run holds the dataset's lock, so concurrent aggregations and fee joins never interleave
+@dataset_lock('goalkeeper_dataset')
+def aggregate_goalkeeper_stats(incremental=False):
     """
     Aggregate all three goalkeeper stats CSV files into one dataset.
     Players will be grouped together with their rows consecutive.
+    With incremental=True, only season files whose content changed since the last
+    run are reprocessed and merged into the existing dataset.
+    Returns the aggregated dataset, or just its row count after an incremental merge.
     """
     
+    if incremental:
+        parquet_path, csv_path = dataset_paths('goalkeeper_dataset')
+        if os.path.exists(MANIFEST_FILE) and (os.path.exists(parquet_path) or os.path.exists(csv_path)):
+            return aggregate_changed_seasons()
+        print("No manifest or existing dataset found, running a full aggregation")
+    
     print("Loading goalkeeper stats datasets...")
     
     # Load all three datasets
-    stats_2024_2025 = pd.read_csv('keepers_stats_2024_2025.csv')
-    stats_2023_2024 = pd.read_csv('keepers_stats_2023_2024.csv')
-    stats_2022_2023 = pd.read_csv('keepers_stats_2022_2023.csv')
+    with metrics.timer('aggregate_stage_seconds', stage='load'):
+        stats_2024_2025 = load_dataset('keepers_stats', stem='keepers_stats_2024_2025')
+        stats_2023_2024 = load_dataset('keepers_stats', stem='keepers_stats_2023_2024')
+        stats_2022_2023 = load_dataset('keepers_stats', stem='keepers_stats_2022_2023')
+    metrics.record_memory(stage='load')
     
     print(f"Loaded {len(stats_2024_2025)} rows from 2024-2025")
     print(f"Loaded {len(stats_2023_2024)} rows from 2023-2024")
     print(f"Loaded {len(stats_2022_2023)} rows from 2022-2023")
     
     # Combine all datasets
-    all_stats = pd.concat([stats_2024_2025, stats_2023_2024, stats_2022_2023], ignore_index=True)
+    with metrics.timer('aggregate_stage_seconds', stage='concat'):
+        all_stats = pd.concat([stats_2024_2025, stats_2023_2024, stats_2022_2023], ignore_index=True)
+    metrics.record_memory(stage='concat')
     
     print(f"Combined dataset has {len(all_stats)} total rows")
     
     # Sort by Player name first, then by Season (newest to oldest)
-    # Create a season order mapping for proper sorting
-    season_order = {
-        '2024-2025': 1,
-        '2023-2024': 2,
-        '2022-2023': 3
-    }
+    with metrics.timer('aggregate_stage_seconds', stage='sort'):
+        all_stats_sorted = sort_player_seasons(all_stats)
+    metrics.record_memory(stage='sort')
     
-    # Add a temporary column for sorting
-    all_stats['season_order'] = all_stats['Season'].map(season_order)
-    
-    # Sort by Player name, then by season order
-    all_stats_sorted = all_stats.sort_values(['Player', 'season_order'])
+    # Save the aggregated dataset (typed Parquet plus CSV)
+    with metrics.timer('aggregate_stage_seconds', stage='write'):
+        all_stats_sorted = save_dataset(all_stats_sorted, 'goalkeeper_dataset')
+    metrics.record_memory(stage='write')
+    metrics.set_gauge('rows_written', len(all_stats_sorted), dataset='goalkeeper_dataset')
     
-    # Remove the temporary sorting column
-    all_stats_sorted = all_stats_sorted.drop('season_order', axis=1)
+    # Record what the dataset was built from, for later incremental runs
+    manifest = load_manifest()
+    partitions = zip(STATS_FILES, [stats_2024_2025, stats_2023_2024, stats_2022_2023])
+    new_manifest = {
+        filename: {**file_fingerprint(filename, manifest.get(filename)), 'seasons': sorted(stats['Season'].astype('string').unique())}
+        for filename, stats in partitions
+    }
     
-    # Save the aggregated dataset
-    all_stats_sorted.to_csv('goalkeeper_dataset.csv', index=False)
+    # Only seasons whose file changed since the last run are upserted; seasons no file holds any more are deleted
+    skipped = unchanged_seasons(manifest, new_manifest)
+    seasons = {season for entry in new_manifest.values() for season in entry['seasons']}
+    removed = {season for entry in manifest.values() for season in entry.get('seasons', [])} - seasons
+    store_stats(all_stats_sorted[~all_stats_sorted['Season'].astype('string').isin(skipped)], removed_seasons=removed)
+    save_manifest(new_manifest)
     
-    print(f"Saved aggregated dataset with {len(all_stats_sorted)} rows to goalkeeper_dataset.csv")
+    print(f"Saved aggregated dataset with {len(all_stats_sorted)} rows to goalkeeper_dataset.parquet and goalkeeper_dataset.csv")
     
     # Show some statistics
     unique_players = all_stats_sorted['Player'].nunique()
@@ -67,5 +199,211 @@ def aggregate_goalkeeper_stats():
     
     return all_stats_sorted
 
+def aggregate_changed_seasons():
+    """
+    Incremental aggregation: compare each season file against the manifest, reload
+    only the changed ones, and merge them into the existing sorted dataset. Only the
+    reloaded rows are sorted; the existing rows are streamed through the merge. The result is
+    the same as a full aggregation, so it carries no fees until add_transfer_fees reruns.
+    Returns the number of rows in the dataset.
+    """
+    manifest = load_manifest()
+    new_manifest = {}
+    changed_files = []
+    
+    # Every season file present now, like the streaming mode, not only the ones a full aggregation reads
+    for filename in sorted(glob.glob(STATS_PATTERN), reverse=True):
+        previous = manifest.get(filename)
+        new_manifest[filename] = file_fingerprint(filename, previous)
+        if previous is None or new_manifest[filename]['sha256'] != previous['sha256']:
+            changed_files.append(filename)
+    
+    removed_files = [filename for filename in manifest if filename not in new_manifest]
+    
+    if not changed_files and not removed_files:
+        print("All season files unchanged since the last aggregation, nothing to do")
+        save_manifest(new_manifest)
+        return len(load_dataset('goalkeeper_dataset', columns=['Player']))
+    
+    # Seasons whose rows in the existing dataset are replaced (or dropped, for removed files)
+    stale_seasons = set()
+    for filename in changed_files + removed_files:
+        stale_seasons.update(manifest.get(filename, {}).get('seasons', []))
+    
+    partitions = []
+    for filename in changed_files:
+        with metrics.timer('aggregate_stage_seconds', stage='load'):
+            stats = load_dataset('keepers_stats', stem=os.path.splitext(filename)[0])
+        seasons = sorted(stats['Season'].astype('string').unique())
+        new_manifest[filename]['seasons'] = seasons
+        stale_seasons.update(seasons)
+        partitions.append(stats)
+        print(f"Reloaded {len(stats)} rows from changed file {filename}")
+    
+    updated = None
+    if partitions:
+        with metrics.timer('aggregate_stage_seconds', stage='sort'):
+            updated = apply_schema(sort_player_seasons(pd.concat(partitions, ignore_index=True)), 'keepers_stats')
+        metrics.record_memory(stage='sort')
+    
+    # Fees come from add_transfer_fees, which must rerun after any aggregation; dropping them here
+    # keeps the output identical to a full rebuild instead of mixing fee-joined and unjoined rows
+    columns = [column for column in dataset_columns('goalkeeper_dataset') if column not in ('Recent Fee', 'Recent Fee Kind')]
+    if updated is not None:
+        columns += [column for column in updated.columns if column not in columns]
+    
+    parquet_path, csv_path = dataset_paths('goalkeeper_dataset')
+    existing_rows = rows_written = 0
+    with tempfile.TemporaryDirectory(prefix='aggregate_runs_', dir='.') as run_dir:
+        # The existing dataset is already sorted, so its kept rows are streamed into a run as they are
+        runs = []
+        with metrics.timer('aggregate_stage_seconds', stage='load'):
+            with RunWriter(os.path.join(run_dir, 'kept.parquet')) as kept:
+                for chunk in iter_dataset('goalkeeper_dataset', chunk_rows=CHUNK_ROWS):
+                    existing_rows += len(chunk)
+                    chunk = chunk[~chunk['Season'].astype('string').isin(stale_seasons)]
+                    if len(chunk):
+                        kept.write(apply_schema(chunk.reindex(columns=columns), 'keepers_stats'))
+        if kept.rows:
+            runs.append(kept.path)
+        print(f"Kept {kept.rows} of {existing_rows} existing rows (replacing seasons: {', '.join(sorted(stale_seasons))})")
+        if updated is not None and len(updated):
+            runs.append(write_run(updated.reindex(columns=columns), os.path.join(run_dir, 'updated.parquet')))
+        
+        # Both sides are sorted runs, so they are merged instead of sorted again; kept rows come
+        # first among equal keys, as in a stable sort of their concatenation
+        with RunWriter(f"{parquet_path}.tmp", row_group_rows=PARTITION_ROWS) as writer:
+            with metrics.timer('aggregate_stage_seconds', stage='merge'):
+                for partition in rebatch(merge_runs(runs, player_season_key), PARTITION_ROWS):
+                    # Merging runs with different categories leaves plain strings; restore the registered dtypes
+                    partition = apply_schema(partition, 'keepers_stats')
+                    with metrics.timer('aggregate_stage_seconds', stage='write'):
+                        writer.write(partition)
+                        partition.to_csv(f"{csv_path}.tmp", mode='a' if rows_written else 'w', header=not rows_written, index=False)
+                    rows_written += len(partition)
+        metrics.record_memory(stage='merge')
+    
+    if rows_written:
+        os.replace(f"{parquet_path}.tmp", parquet_path)
+        os.replace(f"{csv_path}.tmp", csv_path)
+    else:
+        save_dataset(pd.DataFrame(columns=columns), 'goalkeeper_dataset')
+    metrics.set_gauge('rows_written', rows_written, dataset='goalkeeper_dataset')
+    
+    # Only the reloaded seasons go to the store; seasons whose file was removed are deleted
+    reloaded_seasons = set(updated['Season'].dropna().astype('string')) if updated is not None else set()
+    store_stats(updated if updated is not None else pd.DataFrame(), removed_seasons=stale_seasons - reloaded_seasons)
+    save_manifest(new_manifest)
+    
+    print(f"Saved aggregated dataset with {rows_written} rows to {parquet_path} and {csv_path}")
+    
+    return rows_written
+
+def aggregate_streaming(chunk_rows=CHUNK_ROWS, partition_rows=PARTITION_ROWS):
+    """
+    Out-of-core aggregation for stat histories too large to sort in memory.
+    Every season file is read chunk_rows rows at a time and each chunk is sorted into a
+    run on disk. The runs are external-merged on (Player, Season newest first) and the
+    result is written partition_rows rows at a time, as Parquet row groups and CSV appends,
+    so peak memory depends on the chunk and partition sizes, not on the input size.
+    Returns the number of rows written.
+    """
+    # Newest season first, like STATS_FILES, so equal keys keep the same order as a full aggregation
+    stats_files = sorted(glob.glob(STATS_PATTERN), reverse=True)
+    if not stats_files:
+        print(f"No season files matching {STATS_PATTERN}")
+        return 0
+    
+    # Every chunk gets the union of the files' columns, so all runs share one layout
+    columns = []
+    for filename in stats_files:
+        for column in dataset_columns('keepers_stats', stem=os.path.splitext(filename)[0]):
+            if column not in columns:
+                columns.append(column)
+    
+    # Rows of seasons whose files are unchanged since the last run are already stored, and are skipped there
+    previous_manifest = load_manifest()
+    fingerprints = {filename: file_fingerprint(filename, previous_manifest.get(filename)) for filename in stats_files}
+    skipped = unchanged_seasons(previous_manifest, fingerprints)
+    manifest = {}
+    
+    def chunks():
+        for filename in stats_files:
+            seasons = set()
+            rows = 0
+            for chunk in iter_dataset('keepers_stats', stem=os.path.splitext(filename)[0], chunk_rows=chunk_rows):
+                chunk = apply_schema(chunk.reindex(columns=columns), 'keepers_stats')
+                seasons.update(chunk['Season'].dropna().astype('string'))
+                rows += len(chunk)
+                yield chunk
+            manifest[filename] = {**fingerprints[filename], 'seasons': sorted(seasons)}
+            print(f"Loaded {rows} rows from {filename}")
+            metrics.record_memory(stage='runs')
+    
+    parquet_path, csv_path = dataset_paths('goalkeeper_dataset')
+    rows_written = 0
+    players = 0
+    last_player = None
+    store = Store()
+    
+    with tempfile.TemporaryDirectory(prefix='aggregate_runs_', dir='.') as run_dir:
+        # Write to temporary files and swap them in at the end, so a failed run leaves the old dataset intact
+        with RunWriter(f"{parquet_path}.tmp", row_group_rows=partition_rows) as writer:
+            with metrics.timer('aggregate_stage_seconds', stage='merge'):
+                for partition in external_sort(chunks(), player_season_key, run_dir, rows=partition_rows):
+                    # Merging runs with different categories leaves plain strings; restore the registered dtypes
+                    partition = apply_schema(partition, 'keepers_stats')
+                    with metrics.timer('aggregate_stage_seconds', stage='write'):
+                        writer.write(partition)
+                        partition.to_csv(f"{csv_path}.tmp", mode='a' if rows_written else 'w', header=not rows_written, index=False)
+                    with metrics.timer('aggregate_stage_seconds', stage='store'):
+                        # A partition holds only part of each season, so nothing stored is replaced here;
+                        # its keys are staged instead, and rows no partition held are deleted after the merge
+                        changed = partition[~partition['Season'].astype('string').isin(skipped)]
+                        if len(changed):
+                            store.upsert_dataset('stats', changed.drop(columns=['Recent Fee', 'Recent Fee Kind'], errors='ignore'),
+                                                 keep_keys=True)
+                    
+                    # The output is sorted by player, so each name change is a new player
+                    names = partition['Player'].astype('string').fillna(LAST_NAME)
+                    players += int((names != names.shift(fill_value=last_player)).sum())
+                    last_player = names.iloc[-1]
+                    rows_written += len(partition)
+            metrics.record_memory(stage='merge')
+    with metrics.timer('aggregate_stage_seconds', stage='store'):
+        if rows_written:
+            # Rows removed from the season files since the last run
+            store.delete_unkept_rows('stats', skip_seasons=skipped)
+        refresh_rollups(store)
+    store.close()
+    
+    if not rows_written:
+        print("Season files hold no rows, leaving goalkeeper_dataset unchanged")
+        if os.path.exists(f"{parquet_path}.tmp"):
+            os.remove(f"{parquet_path}.tmp")
+        return 0
+    os.replace(f"{parquet_path}.tmp", parquet_path)
+    os.replace(f"{csv_path}.tmp", csv_path)
+    metrics.set_gauge('rows_written', rows_written, dataset='goalkeeper_dataset')
+    save_manifest(manifest)
+    
+    print(f"Saved aggregated dataset with {rows_written} rows ({players} players) to {parquet_path} and {csv_path}")
+    
+    return rows_written
+
 if __name__ == "__main__":
-    aggregate_goalkeeper_stats() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Aggregate the per-season goalkeeper stats into goalkeeper_dataset")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--incremental', action='store_true',
+                      help="only reprocess season files that changed since the last run")
+    mode.add_argument('--streaming', action='store_true',
+                      help="external-sort every keepers_stats_*.csv with bounded memory instead of loading them whole")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="rows per sorted run in streaming mode")
+    parser.add_argument('--partition-rows', type=int, default=PARTITION_ROWS, help="rows per output partition in streaming mode")
+    args = parser.parse_args()
+    
+    if args.streaming:
+        aggregate_streaming(args.chunk_rows, args.partition_rows)
+    else:
+        aggregate_goalkeeper_stats(incremental=args.incremental)
+    metrics.write_report('aggregate_keepers') 
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+External merge sort for frames too large to sort in memory.
+
+Input chunks are sorted one at a time and written to disk as Parquet runs. The runs
+are then merged a block (one row group) per run at a time, in several passes when there
+are more runs than MAX_FAN_IN, so memory use depends on the block size and the fan-in
+rather than on the size of the input. Sorts are stable: rows with equal keys keep the
+order in which their chunks were read, exactly as a stable in-memory sort would.
+
+Ordering is given by a key function that returns a DataFrame of sort key columns for
+a frame (same index, no missing values), compared lexicographically.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Rows per row group in a run; the merge holds about one block per run in memory
+BLOCK_ROWS = 20_000
+
+# Most runs merged in one pass; more runs are merged in several passes
+MAX_FAN_IN = 16
+
+def arrow_schema(df):
+    """
+    Arrow schema for a frame, with categorical columns as string dictionaries with
+    fixed-width indices, so batches with different categories can share one file
+    """
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_dictionary(field.type):
+            schema = schema.set(i, pa.field(field.name, pa.dictionary(pa.int32(), pa.string())))
+    return schema
+
+def key_columns(key):
+    return [f"__key{i}" for i in range(key.shape[1])]
+
+def sort_by_key(df, sort_key):
+    """Stable in-memory sort of a frame by its key columns"""
+    key = sort_key(df)
+    order = key.set_axis(key_columns(key), axis=1).sort_values(key_columns(key), kind='stable').index
+    return df.loc[order]
+
+def rebatch(frames, rows):
+    """Regroup a stream of frames into frames of exactly `rows` rows (the last one may be shorter)"""
+    pending, pending_rows = [], 0
+    for frame in frames:
+        pending.append(frame)
+        pending_rows += len(frame)
+        while pending_rows >= rows:
+            combined = pd.concat(pending, ignore_index=True)
+            yield combined.iloc[:rows]
+            pending, pending_rows = [combined.iloc[rows:]], pending_rows - rows
+    if pending_rows:
+        yield pd.concat(pending, ignore_index=True)
+
+class RunWriter:
+    """Append frames to a Parquet file, each frame becoming row groups of at most row_group_rows rows"""
+
+    def __init__(self, path, row_group_rows=None):
+        self.path = path
+        self.row_group_rows = row_group_rows or BLOCK_ROWS
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+
+    def write(self, df):
+        if self.writer is None:
+            self.schema = arrow_schema(df)
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self.writer.write_table(table, row_group_size=self.row_group_rows)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class RunReader:
+    """Read a run back one row group at a time"""
+
+    def __init__(self, path):
+        self.file = pq.ParquetFile(path)
+        self.next_group = 0
+        self.rows_read = 0
+
+    def read_block(self):
+        """The next row group as a frame, or None once the run is exhausted"""
+        if self.next_group >= self.file.num_row_groups:
+            return None
+        block = self.file.read_row_group(self.next_group).to_pandas()
+        self.next_group += 1
+        self.rows_read += len(block)
+        return block
+
+def write_run(df, path):
+    """Write an already sorted frame as a run"""
+    with RunWriter(path) as writer:
+        writer.write(df)
+    return path
+
+def at_or_before(keys, bound):
+    """Rows whose key tuple sorts at or before `bound`"""
+    before = pd.Series(False, index=keys.index)
+    equal = pd.Series(True, index=keys.index)
+    for column, value in zip(keys.columns, bound):
+        before |= equal & (keys[column] < value)
+        equal &= keys[column] == value
+    return (before | equal).to_numpy(dtype=bool)
+
+def merge_runs(paths, sort_key):
+    """
+    Merge sorted runs into one sorted stream of frames.
+    Each run contributes one block at a time. Every row's key ends with its run and its
+    position in the run, so no two keys are equal and ties of the sort key come out in
+    input order. Every buffered row whose key is at or before the smallest of the open
+    buffers' last keys can then be emitted, since no unread row can sort before it; the
+    run that set that bound is drained and refilled next.
+    """
+    readers = [RunReader(path) for path in paths]
+    buffers = [None] * len(readers)
+    exhausted = [False] * len(readers)
+    columns = None
+
+    while True:
+        for i, reader in enumerate(readers):
+            if not exhausted[i] and (buffers[i] is None or buffers[i].empty):
+                block = reader.read_block()
+                if block is None:
+                    exhausted[i] = True
+                else:
+                    key = sort_key(block)
+                    columns = key_columns(key) + ['__run', '__row']
+                    key = key.assign(__run=i, __row=np.arange(reader.rows_read - len(block), reader.rows_read))
+                    buffers[i] = pd.concat([block, key.set_axis(columns, axis=1)], axis=1)
+
+        active = [i for i, buffer in enumerate(buffers) if buffer is not None and not buffer.empty]
+        if not active:
+            return
+
+        # Runs that still have unread blocks bound what is safe to emit
+        open_runs = [i for i in active if not exhausted[i]]
+        if open_runs:
+            bound = min(tuple(buffers[i][columns].iloc[-1]) for i in open_runs)
+        pieces = []
+        for i in active:
+            ready = at_or_before(buffers[i][columns], bound) if open_runs else slice(None)
+            pieces.append(buffers[i][ready])
+            buffers[i] = buffers[i][~ready] if open_runs else None
+
+        merged = pd.concat(pieces, ignore_index=True).sort_values(columns, kind='stable')
+        yield merged.drop(columns=columns).reset_index(drop=True)
+
+def merge_passes(paths, sort_key, directory):
+    """
+    Merge runs MAX_FAN_IN at a time into longer runs until at most MAX_FAN_IN remain,
+    deleting merged runs as it goes; returns the remaining run paths
+    """
+    merge_pass = 0
+    while len(paths) > MAX_FAN_IN:
+        merged_paths = []
+        for start in range(0, len(paths), MAX_FAN_IN):
+            group = paths[start:start + MAX_FAN_IN]
+            path = os.path.join(directory, f"pass{merge_pass}-run{len(merged_paths):05d}.parquet")
+            with RunWriter(path) as writer:
+                for block in rebatch(merge_runs(group, sort_key), BLOCK_ROWS):
+                    writer.write(block)
+            for old_path in group:
+                os.remove(old_path)
+            merged_paths.append(path)
+        print(f"Merge pass {merge_pass + 1}: {len(paths)} runs into {len(merged_paths)}")
+        paths = merged_paths
+        merge_pass += 1
+    return paths
+
+def external_sort(chunks, sort_key, directory, rows=BLOCK_ROWS):
+    """
+    Sort a stream of frames that need not fit in memory together, yielding the sorted
+    rows as frames of `rows` rows. Runs are written to (and removed from) directory.
+    """
+    paths = []
+    for chunk in chunks:
+        paths.append(write_run(sort_by_key(chunk, sort_key), os.path.join(directory, f"run{len(paths):05d}.parquet")))
+    paths = merge_passes(paths, sort_key, directory)
+    try:
+        yield from rebatch(merge_runs(paths, sort_key), rows)
+    finally:
+        for path in paths:
+            os.remove(path)
@@ -0,0 +1,213 @@
+"""
+Build or record the HTML fixtures the offline benchmarks replay.
+
+The shipped fixtures are rebuilt from goalkeeper_dataset.csv in the markup the
+scrapers parse (Transfermarkt table.items rows, fbref's stats_keeper_adv table
+with its repeated header rows), so they carry real names, clubs and numbers.
+With --record the live pages are fetched once through the scrapers' fetch
+engine instead. Run from the repository root:
+
+    python -m benchmarks.fixtures             # rebuild from goalkeeper_dataset.csv
+    python -m benchmarks.fixtures --record    # fetch the live pages
+"""
+import argparse
+import hashlib
+import html
+import os
+import re
+
+import pandas as pd
+
+from schema import STAT_COLUMNS
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Fixture file -> the live page it stands in for
+FIXTURES = {
+    'market_values.html': "https://www.transfermarkt.us/spieler-statistik/wertvollstespieler/marktwertetop/mw/spielerposition_id/1",
+    'transfers.html': "https://www.transfermarkt.us/transfers/transferrekorde/statistik/top/plus/1/galerie/0?saison_id=2024&land_id=&ausrichtung=&spielerposition_id=1&altersklasse=&jahrgang=0&leihe=&w_s=",
+    'keepers_adv.html': "https://fbref.com/en/comps/Big5/2024-2025/keepersadv/players/2024-2025-Big-5-European-Leagues-Stats",
+}
+
+# Roughly what surrounds the results table on a real page
+PAGE_PADDING = "<div class='navigation'>" + "<ul>" + "<li><a href='/x'>Link</a></li>" * 400 + "</ul></div>"
+
+# fbref's advanced goalkeeping header (Att, Launch% and AvgLen appear twice), plus the Matches link column
+KEEPER_HEADER = [
+    'Rk', 'Player', 'Nation', 'Pos', 'Squad', 'Comp', 'Age', 'Born',
+    '90s', 'GA', 'PKA', 'FK', 'CK', 'OG', 'PSxG', 'PSxG/SoT', 'PSxG+/-', '/90',
+    'Cmp', 'Att', 'Cmp%', 'Att (GK)', 'Thr', 'Launch%', 'AvgLen', 'Att', 'Launch%', 'AvgLen',
+    'Opp', 'Stp', 'Stp%', '#OPA', '#OPA/90', 'AvgDist', 'Matches',
+]
+
+def slug(name):
+    return re.sub(r'[^A-Za-z0-9]+', '-', name).strip('-').lower()
+
+def player_id(name):
+    """Deterministic stand-in for a Transfermarkt player ID"""
+    return int(hashlib.sha256(name.encode('utf-8')).hexdigest()[:6], 16)
+
+def fbref_id(name):
+    """Deterministic stand-in for an fbref player ID (8 hex digits)"""
+    return hashlib.sha256(name.encode('utf-8')).hexdigest()[:8]
+
+def player_cells(rank, name):
+    name = html.escape(name)
+    return (
+        f'<td class="zentriert">{rank}</td>'
+        f'<td class="posrela"><table class="inline-table"><tr>'
+        f'<td rowspan="2"><img title="{name}" class="bilderrahmen-fixed"/></td>'
+        f'<td class="hauptlink"><a title="{name}" href="/{slug(name)}/profil/spieler/{player_id(name)}">{name}</a></td>'
+        f'</tr><tr><td>Goalkeeper</td></tr></table></td>'
+    )
+
+def club_cells(name):
+    name = html.escape(name)
+    return (
+        f'<td><table class="inline-table"><tr>'
+        f'<td rowspan="2"><img title="{name}" class="tiny_wappen"/></td>'
+        f'<td class="hauptlink"><a title="{name}" href="/{slug(name)}/startseite/verein/{player_id(name) % 10000}">{name}</a></td>'
+        f'</tr><tr><td><a href="/league">League</a></td></tr></table></td>'
+    )
+
+def nation(code):
+    """'eng ENG' -> 'ENG'"""
+    return html.escape(str(code).split()[-1]) if pd.notna(code) else ''
+
+def items_page(rows):
+    return f"<html><body>{PAGE_PADDING}<table class='items'><thead><tr><th>#</th></tr></thead><tbody>{''.join(rows)}</tbody></table>{PAGE_PADDING}</body></html>"
+
+def market_value_page(players):
+    """One full page (25 rows) of the most valuable goalkeepers list"""
+    rows = []
+    for rank, player in enumerate(players.itertuples(index=False), start=1):
+        value = max(0.5, 60 - 2.2 * rank)
+        rows.append(
+            f'<tr class="{"odd" if rank % 2 else "even"}">'
+            + player_cells(rank, player.Player)
+            + f'<td class="zentriert">{player.Age}</td>'
+            + f'<td class="zentriert"><img title="{nation(player.Nation)}" class="flaggenrahmen"/></td>'
+            + f'<td class="zentriert"><a title="{html.escape(player.Squad)}" href="/{slug(player.Squad)}/startseite/verein/1"><img/></a></td>'
+            + f'<td class="rechts hauptlink"><a href="/{slug(player.Player)}/marktwertverlauf/spieler/{player_id(player.Player)}">€{value:.2f}m</a></td>'
+            + "</tr>"
+        )
+    return items_page(rows)
+
+def transfer_page(moves):
+    """One full page (25 rows) of a season's goalkeeper transfer records"""
+    rows = []
+    for rank, (player, team_left) in enumerate(moves, start=1):
+        fee = "loan transfer" if rank % 7 == 0 else f"€{max(0.3, 45 - 1.7 * rank):.2f}m"
+        rows.append(
+            f'<tr class="{"odd" if rank % 2 else "even"}">'
+            + player_cells(rank, player.Player)
+            + f'<td class="zentriert">{player.Age}</td>'
+            + f'<td class="rechts">€{max(0.5, 30 - rank):.2f}m</td>'
+            + '<td class="zentriert">24/25</td>'
+            + f'<td class="zentriert"><img title="{nation(player.Nation)}" class="flaggenrahmen"/></td>'
+            + club_cells(team_left)
+            + club_cells(player.Squad)
+            + f'<td class="rechts hauptlink"><a href="/fee">{fee}</a></td>'
+            + "</tr>"
+        )
+    return items_page(rows)
+
+def keeper_stats_page(stats):
+    """The Big 5 advanced goalkeeping table, header row repeated every 25 players as on fbref"""
+    header_cells = ''.join(f'<th scope="col">{html.escape(column)}</th>' for column in KEEPER_HEADER)
+    over_header = (
+        '<tr class="over_header"><th colspan="9"></th><th colspan="9">Goals</th><th colspan="3">Launched</th>'
+        '<th colspan="4">Passes</th><th colspan="3">Goal Kicks</th><th colspan="3">Crosses</th>'
+        '<th colspan="3">Sweeper</th><th></th></tr>'
+    )
+    rows = []
+    for rank, player in enumerate(stats.to_dict('records'), start=1):
+        if rank > 1 and rank % 25 == 1:
+            rows.append(f'<tr class="thead">{header_cells}</tr>')
+        name = html.escape(player['Player'])
+        cells = [
+            f'<th scope="row" data-stat="ranker">{rank}</th>',
+            f'<td data-stat="player"><a href="/en/players/{fbref_id(player["Player"])}/{slug(player["Player"])}">{name}</a></td>',
+            f'<td data-stat="nationality">{html.escape(str(player["Nation"]))}</td>',
+            f'<td data-stat="position">{html.escape(str(player["Pos"]))}</td>',
+            f'<td data-stat="team"><a href="/en/squads/{fbref_id(player["Squad"])}/">{html.escape(player["Squad"])}</a></td>',
+            f'<td data-stat="comp_level">{html.escape(str(player["Comp"]))}</td>',
+            f'<td data-stat="age">{player["Age"]}-{rank * 7 % 365:03d}</td>',
+            f'<td data-stat="birth_year">{player["Born"]}</td>',
+        ]
+        for column in STAT_COLUMNS:
+            value = player[column]
+            cells.append(f'<td>{"" if pd.isna(value) else value}</td>')
+        cells.append(f'<td data-stat="matches"><a href="/en/players/{fbref_id(player["Player"])}/matchlogs/">Matches</a></td>')
+        rows.append(f'<tr>{"".join(cells)}</tr>')
+
+    return (
+        f"<html><body>{PAGE_PADDING}"
+        f'<table class="stats_table" id="stats_keeper_adv"><thead>{over_header}<tr>{header_cells}</tr></thead>'
+        f"<tbody>{''.join(rows)}</tbody></table>{PAGE_PADDING}</body></html>"
+    )
+
+def build_fixtures(dataset_file='goalkeeper_dataset.csv'):
+    """Rebuild every fixture from the aggregated dataset; returns the files written"""
+    dataset = pd.read_csv(dataset_file)
+    latest = dataset[dataset['Season'] == dataset['Season'].max()].reset_index(drop=True)
+    # Most-played keepers first, as a stand-in for the market value ranking
+    ranked = latest.sort_values('90s', ascending=False, kind='stable')
+
+    # Transfer moves: a player's previous club is their squad in the season before
+    previous = dataset[dataset['Season'] < dataset['Season'].max()].drop_duplicates('Player').set_index('Player')['Squad']
+    movers = ranked[ranked['Player'].map(previous).fillna(ranked['Squad']) != ranked['Squad']]
+    moves = [(player, previous[player.Player]) for player in movers.head(25).itertuples(index=False)]
+    moves += [(player, 'Without Club') for player in ranked.iloc[::-1].head(25 - len(moves)).itertuples(index=False)]
+
+    pages = {
+        'market_values.html': market_value_page(ranked.head(25)),
+        'transfers.html': transfer_page(moves),
+        'keepers_adv.html': keeper_stats_page(latest),
+    }
+    return write_fixtures(pages)
+
+def record_fixtures():
+    """Fetch each fixture's live page once; returns the files written"""
+    from scrapers.fetch_engine import FetchEngine
+    from scrapers.market_value_scraper import GoalkeeperMarketValueScraper
+
+    engine = FetchEngine(GoalkeeperMarketValueScraper(cache_dir=None).headers, max_workers=1, rate=1 / 6, burst=1)
+    pages = {}
+    for filename, url in FIXTURES.items():
+        html_content = engine.fetch(url)
+        if html_content is None:
+            print(f"Failed to record {filename} from {url}")
+            continue
+        pages[filename] = html_content
+    engine.close()
+    return write_fixtures(pages)
+
+def write_fixtures(pages):
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    filenames = []
+    for filename, html_content in pages.items():
+        path = os.path.join(FIXTURES_DIR, filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        filenames.append(path)
+        print(f"Wrote {path} ({len(html_content) / 1024:.0f} KiB)")
+    return filenames
+
+def load_fixture(filename):
+    with open(os.path.join(FIXTURES_DIR, filename), encoding='utf-8') as f:
+        return f.read()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--record', action='store_true', help="fetch the live pages instead of rebuilding from the dataset")
+    parser.add_argument('--dataset', default='goalkeeper_dataset.csv', help="aggregated dataset to rebuild fixtures from")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures()
+    else:
+        build_fixtures(args.dataset)
+
+if __name__ == "__main__":
+    main()
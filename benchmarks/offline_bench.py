@@ -0,0 +1,277 @@
+"""
+Offline benchmark suite for the scrape -> aggregate path.
+
+Nothing touches the network: the scrapers fetch the recorded fixtures from a
+local replay server (optionally slowed down or throttled with 429s), and the
+aggregators run end to end on synthetic season files built by scaling
+goalkeeper_dataset.csv up 10x-1000x with renamed copies of every player.
+Reports pages/sec, parse ms/row and peak RSS. Run from the repository root:
+
+    python -m benchmarks.offline_bench
+    python -m benchmarks.offline_bench --latency 0.1 --error-rate 0.05 --scales 10 100
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fixtures import fbref_id, load_fixture, player_id
+from benchmarks.replay_server import ReplayServer
+from metrics import peak_rss_bytes
+from scrapers.market_value_scraper import GoalkeeperMarketValueScraper
+from scrapers.stat_scraper import clean_keeper_table, keeper_stats_url, parse_keeper_table
+from scrapers.transfer_scraper import TRANSFER_RECORDS_URL, MultiSeasonTransfermarktScraper, season_entries
+
+MARKET_VALUE_PATH = "/spieler-statistik/wertvollstespieler/marktwertetop/mw/spielerposition_id/1"
+
+def peak_rss_mb():
+    return peak_rss_bytes() / (1024 * 1024)
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the scrapers' and aggregators' progress output while timing them"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    with quiet():
+        result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+# --- Parsing -------------------------------------------------------------------------------
+
+def parse_market_values(html_content, fast_parse):
+    scraper = GoalkeeperMarketValueScraper(cache_dir=None, fast_parse=fast_parse)
+    rows = scraper.parse_market_value_page(html_content, 1)[1]
+    scraper.engine.close()
+    return rows
+
+def parse_transfers(html_content, fast_parse):
+    scraper = MultiSeasonTransfermarktScraper(cache_dir=None, fast_parse=fast_parse)
+    rows = scraper.parse_transfer_rows(html_content)[1]
+    scraper.engine.close()
+    return rows
+
+def parse_keeper_stats(html_content, fast_parse):
+    return clean_keeper_table(parse_keeper_table(html_content), '2024-2025', 'Big5')
+
+def bench_parsing(repeat):
+    """Parse each fixture `repeat` times per parser and report milliseconds per extracted row"""
+    cases = [
+        ('market values', 'market_values.html', parse_market_values, (False, True)),
+        ('transfers', 'transfers.html', parse_transfers, (False, True)),
+        ('keeper stats', 'keepers_adv.html', parse_keeper_stats, (None,)),
+    ]
+    results = []
+    for name, filename, parse, modes in cases:
+        html_content = load_fixture(filename)
+        for fast_parse in modes:
+            rows = len(timed(parse, html_content, fast_parse)[0])
+            start = time.perf_counter()
+            with quiet():
+                for _ in range(repeat):
+                    parse(html_content, fast_parse)
+            elapsed = time.perf_counter() - start
+            parser = {None: 'pandas.read_html', False: 'html.parser', True: 'lxml fast path'}[fast_parse]
+            results.append({
+                'fixture': name,
+                'parser': parser,
+                'rows': rows,
+                'ms_per_row': elapsed * 1000 / (rows * repeat),
+                'pages_per_sec': repeat / elapsed,
+            })
+    return results
+
+# --- Fetching through the replay server -----------------------------------------------------
+
+def bench_fetching(pages, latency, error_rate, workers, rate):
+    """Run each scraper's fetch path against the replay server and report pages/sec"""
+    results = []
+
+    def record(name, server, elapsed, rows):
+        counts = dict(server.counts)
+        results.append({
+            'scraper': name,
+            'requests': counts['requests'],
+            'throttled': counts['throttled'],
+            'rows': rows,
+            'seconds': elapsed,
+            'pages_per_sec': counts['requests'] / elapsed,
+            'mib_per_sec': counts['bytes'] / elapsed / (1024 * 1024),
+        })
+
+    # Market values: windows of pages until a short page (one list of `pages` full pages)
+    with ReplayServer(pages, latency, error_rate=error_rate) as server:
+        scraper = GoalkeeperMarketValueScraper(max_workers=workers, rate=rate, burst=workers, cache_dir=None, fast_parse=True)
+        rows, elapsed = timed(scraper.scrape_market_values, server.url + MARKET_VALUE_PATH, max_players=(pages + 1) * 25)
+        scraper.engine.close()
+        record('market values', server, elapsed, len(rows))
+
+    # Transfers: every page of five seasons scheduled on one pool
+    with ReplayServer(pages, latency, error_rate=error_rate) as server:
+        scraper = MultiSeasonTransfermarktScraper(max_workers=workers, rate=rate, burst=workers, cache_dir=None, fast_parse=True)
+        seasons = season_entries(2020, 2024)
+        for season in seasons:
+            season['url'] = season['url'].replace(TRANSFER_RECORDS_URL.split('/transfers/')[0], server.url)
+        history, elapsed = timed(scraper.scrape_transfer_history, seasons)
+        scraper.engine.close()
+        record('transfers', server, elapsed, sum(len(transfers) for transfers in history.values()))
+
+    # Keeper stats: one page per (season, competition), fetched concurrently and parsed as they arrive
+    with ReplayServer(pages, latency, error_rate=error_rate) as server:
+        scraper = GoalkeeperMarketValueScraper(max_workers=workers, rate=rate, burst=workers, cache_dir=None)
+        urls = [keeper_stats_url(f"{year}-{year + 1}", competition).replace('https://fbref.com', server.url)
+                for year in range(2020, 2025) for competition in ('Big5', 'Premier-League')]
+
+        def fetch_and_parse():
+            tables = [clean_keeper_table(parse_keeper_table(html_content), '2024-2025', 'Big5')
+                      for _, html_content in scraper.engine.fetch_many(urls) if html_content]
+            return sum(len(table) for table in tables)
+
+        rows, elapsed = timed(fetch_and_parse)
+        scraper.engine.close()
+        record('keeper stats', server, elapsed, rows)
+
+    return results
+
+# --- Aggregation on synthetic data ----------------------------------------------------------
+
+def copy_tag(i):
+    """Made-up surname for a synthetic copy, so copies spread over many small name blocks"""
+    letters = []
+    for _ in range(4):
+        i, digit = divmod(i, 26)
+        letters.append(chr(ord('a') + digit))
+    return 'Z' + ''.join(letters)
+
+def write_synthetic_inputs(directory, scale, dataset_file='goalkeeper_dataset.csv'):
+    """
+    Write keepers_stats_*.csv and goalkeeper_transfers_*.csv into directory, holding
+    `scale` copies of every player in the aggregated dataset (copy 0 keeps the real names).
+    Returns the number of stats rows written.
+    """
+    base = pd.read_csv(dataset_file).drop(columns=['Recent Fee', 'Recent Fee Kind'], errors='ignore')
+    players = base['Player'].unique()
+    player_number = pd.Series(np.arange(len(players)), index=players)
+
+    copy = np.repeat(np.arange(scale), len(base))
+    stats = pd.concat([base] * scale, ignore_index=True)
+    number = copy * len(players) + np.tile(base['Player'].map(player_number).to_numpy(), scale)
+    names = {n: f"{players[n % len(players)]} {copy_tag(n)}" if n >= len(players) else players[n]
+             for n in np.unique(number)}
+    stats['Player'] = pd.Series(number).map(names)
+    stats['fbref ID'] = stats['Player'].map(fbref_id)
+
+    for season, season_stats in stats.groupby('Season', sort=False):
+        season_stats.to_csv(os.path.join(directory, f"keepers_stats_{season.replace('-', '_')}.csv"), index=False)
+
+    # One transfer per player, into the club of their earliest season and in that season
+    first_rows = stats.sort_values('Season', kind='stable').drop_duplicates('Player')
+    start_year = first_rows['Season'].str[:4].astype(int)
+    fee_kind = np.arange(len(first_rows)) % 10
+    transfers = pd.DataFrame({
+        'Player': first_rows['Player'],
+        'Player ID': first_rows['Player'].map(player_id).astype(str),
+        'Age': first_rows['Age'],
+        'Season': (start_year % 100).map('{:02d}'.format) + '/' + ((start_year + 1) % 100).map('{:02d}'.format),
+        'Nationality': first_rows['Nation'].str.split().str[-1],
+        'Team Left': 'Without Club',
+        'Team Joined': first_rows['Squad'],
+        'Fee': np.where(fee_kind == 0, 'loan transfer', np.where(fee_kind == 1, 'free transfer',
+                        (np.arange(len(first_rows)) % 400 / 10 + 0.5).round(2).astype(str))),
+    })
+    transfers['Fee'] = np.where(fee_kind > 1, '€' + transfers['Fee'] + 'm', transfers['Fee'])
+    for year, season_transfers in transfers.groupby(start_year, sort=False):
+        season_transfers.to_csv(os.path.join(directory, f"goalkeeper_transfers_{year}_{year + 1}.csv"), index=False)
+
+    return len(stats)
+
+def run_aggregators(directory):
+    """Runs in a fresh process so its peak RSS belongs to the aggregators alone"""
+    from aggregators.add_transfer_fees import add_recent_fees
+    from aggregators.aggregate_keepers import aggregate_goalkeeper_stats
+
+    os.chdir(directory)
+    imported_rss = peak_rss_mb()
+    dataset, aggregate_seconds = timed(aggregate_goalkeeper_stats)
+    _, fees_seconds = timed(add_recent_fees)
+    return {
+        'output_rows': len(dataset),
+        'aggregate_seconds': aggregate_seconds,
+        'fees_seconds': fees_seconds,
+        'baseline_rss_mib': imported_rss,
+        'peak_rss_mib': peak_rss_mb(),
+    }
+
+def bench_aggregation(scales, dataset_file):
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory(prefix=f'gk_bench_{scale}x_') as directory:
+            rows = write_synthetic_inputs(directory, scale, dataset_file)
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                result = executor.submit(run_aggregators, directory).result()
+            results.append({'scale': scale, 'input_rows': rows, **result})
+            print_aggregation(results[-1])
+    return results
+
+# --- Reporting ------------------------------------------------------------------------------
+
+def print_parsing(results):
+    print("\nParsing (recorded fixtures)")
+    for result in results:
+        print(f"  {result['fixture']:<14} {result['parser']:<17} {result['rows']:>4} rows   "
+              f"{result['ms_per_row']:>8.3f} ms/row   {result['pages_per_sec']:>8.1f} pages/s")
+
+def print_fetching(results):
+    print("\nFetch + parse through the replay server")
+    for result in results:
+        print(f"  {result['scraper']:<14} {result['requests']:>4} requests ({result['throttled']} throttled)   "
+              f"{result['rows']:>5} rows   {result['pages_per_sec']:>7.1f} pages/s   {result['mib_per_sec']:>6.1f} MiB/s")
+
+def print_aggregation(result):
+    print(f"  {result['scale']:>5}x {result['input_rows']:>9} rows   aggregate {result['aggregate_seconds']:>7.2f}s   "
+          f"fees {result['fees_seconds']:>7.2f}s   peak RSS {result['peak_rss_mib']:>7.0f} MiB "
+          f"(after imports {result['baseline_rss_mib']:.0f} MiB)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=20, help="times each fixture is parsed")
+    parser.add_argument('--pages', type=int, default=4, help="full pages per list on the replay server")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds the replay server adds to each response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--workers', type=int, default=4, help="fetch engine worker threads")
+    parser.add_argument('--rate', type=float, default=100.0, help="requests per second allowed per host")
+    parser.add_argument('--scales', type=int, nargs='*', default=[10, 100, 1000],
+                        help="dataset multipliers for the aggregation benchmark (none to skip it)")
+    parser.add_argument('--dataset', default='goalkeeper_dataset.csv', help="dataset the synthetic inputs are scaled from")
+    parser.add_argument('--json', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = {'parsing': bench_parsing(args.repeat)}
+    print_parsing(report['parsing'])
+
+    report['fetching'] = bench_fetching(args.pages, args.latency, args.error_rate, args.workers, args.rate)
+    print_fetching(report['fetching'])
+    report['scraper_peak_rss_mib'] = peak_rss_mb()
+    print(f"  peak RSS {report['scraper_peak_rss_mib']:.0f} MiB")
+
+    if args.scales:
+        print("\nAggregation (aggregate_goalkeeper_stats, then add_recent_fees)")
+        report['aggregation'] = bench_aggregation(args.scales, args.dataset)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote results to {args.json}")
+
+if __name__ == "__main__":
+    main()
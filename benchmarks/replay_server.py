@@ -0,0 +1,146 @@
+"""
+Local HTTP server that replays the recorded fixtures in place of Transfermarkt and fbref.
+
+Requests are routed on the URL path (marktwertetop, transferrekorde, keepersadv);
+the first `pages` pages of a list are served in full and later pages come back
+with an empty table, so the scrapers' pagination ends the way it does on the
+site. Latency and 429 responses (with Retry-After) can be injected to see how
+the fetch path behaves under a slow or throttling host:
+
+    python -m benchmarks.replay_server --latency 0.2 --error-rate 0.1
+"""
+import argparse
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.fixtures import load_fixture
+
+# URL path fragment -> fixture served for it
+ROUTES = {
+    'marktwertetop': 'market_values.html',
+    'transferrekorde': 'transfers.html',
+    'keepersadv': 'keepers_adv.html',
+}
+
+def empty_page(html_content):
+    """The same page with no table rows, which is what the site serves past the last page"""
+    return re.sub(r'(<tbody>).*?(</tbody>)', r'\1\2', html_content, count=1, flags=re.S)
+
+class ReplayServer:
+    """
+    Serves the fixtures on 127.0.0.1 from a background thread.
+    latency is seconds added to every response (plus up to `jitter` more), and
+    error_rate is the fraction of requests answered with 429 Too Many Requests.
+    """
+
+    def __init__(self, pages=4, latency=0.0, jitter=0.0, error_rate=0.0, retry_after=1, port=0, seed=0):
+        self.pages = pages
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'throttled': 0, 'bytes': 0}
+
+        self.bodies = {}
+        for fragment, filename in ROUTES.items():
+            html_content = load_fixture(filename)
+            self.bodies[fragment] = (html_content.encode('utf-8'), empty_page(html_content).encode('utf-8'))
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, request):
+        """Answer one GET: a 429, a fixture page, an empty page past the last one, or a 404"""
+        with self.lock:
+            self.counts['requests'] += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            throttled = self.random.random() < self.error_rate
+        time.sleep(delay)
+
+        if throttled:
+            with self.lock:
+                self.counts['throttled'] += 1
+            request.send_response(429)
+            request.send_header('Retry-After', str(self.retry_after))
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+
+        url = urlparse(request.path)
+        fragment = next((fragment for fragment in ROUTES if fragment in url.path), None)
+        if fragment is None:
+            request.send_error(404)
+            return
+
+        page = int(parse_qs(url.query).get('page', ['1'])[0])
+        full, empty = self.bodies[fragment]
+        body = full if page <= self.pages else empty
+        with self.lock:
+            self.counts['bytes'] += len(body)
+
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/html; charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pages', type=int, default=4, help="full pages served per list before it runs out")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many extra seconds per response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with each 429")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.pages, args.latency, args.jitter, args.error_rate, args.retry_after, args.port)
+    print(f"Replaying fixtures on {server.url} (Ctrl-C to stop)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
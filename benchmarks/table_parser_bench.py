@@ -0,0 +1,107 @@
+"""
+Benchmark the lxml table.items fast path against the html.parser path.
+
+Builds synthetic Transfermarkt pages (navigation padding, nested inline tables in
+the player and club cells), checks that both paths emit identical dicts, and
+reports rows/sec for each. Run from the repository root:
+
+    python -m benchmarks.table_parser_bench
+"""
+import argparse
+import time
+
+from scrapers.market_value_scraper import GoalkeeperMarketValueScraper
+from scrapers.transfer_scraper import MultiSeasonTransfermarktScraper
+
+# Roughly what surrounds the results table on a real page
+PAGE_PADDING = "<div class='navigation'>" + "<ul>" + "<li><a href='/x'>Link</a></li>" * 400 + "</ul></div>"
+
+
+def player_cells(i):
+    position = "Goalkeeper" if i % 6 else "Centre-Back"
+    return (
+        f'<td class="zentriert">{i}</td>'
+        f'<td class="posrela"><table class="inline-table"><tr>'
+        f'<td rowspan="2"><img title="Player {i}" class="bilderrahmen-fixed"/></td>'
+        f'<td class="hauptlink"><a title="Player {i}" href="/player-{i}/profil/spieler/{10000 + i}">Player {i}</a></td>'
+        f'</tr><tr><td>{position}</td></tr></table></td>'
+    )
+
+
+def club_cells(name, club_id):
+    return (
+        f'<td><table class="inline-table"><tr>'
+        f'<td rowspan="2"><img title="{name}" class="tiny_wappen"/></td>'
+        f'<td class="hauptlink"><a title="{name}" href="/club/startseite/verein/{club_id}">{name}</a></td>'
+        f'</tr><tr><td><a href="/league">League</a></td></tr></table></td>'
+    )
+
+
+def market_value_page(rows):
+    body = "".join(
+        f'<tr class="{"odd" if i % 2 else "even"}">'
+        + player_cells(i)
+        + f'<td class="zentriert">{18 + i % 20}</td>'
+        + '<td class="zentriert"><img title="Italy" class="flaggenrahmen"/></td>'
+        + f'<td class="zentriert"><a title="Club {i % 40}" href="/club/startseite/verein/{i % 40}"><img/></a></td>'
+        + f'<td class="rechts hauptlink"><a href="/mw">€{40 - i % 35}.00m</a></td>'
+        + "</tr>"
+        for i in range(1, rows + 1)
+    )
+    return f"<html><body>{PAGE_PADDING}<table class='items'><thead><tr><th>#</th></tr></thead><tbody>{body}</tbody></table>{PAGE_PADDING}</body></html>"
+
+
+def transfer_page(rows):
+    body = "".join(
+        f'<tr class="{"odd" if i % 2 else "even"}">'
+        + player_cells(i)
+        + f'<td class="zentriert">{18 + i % 20}</td>'
+        + f'<td class="rechts">€{i % 30}.00m</td>'
+        + '<td class="zentriert">24/25</td>'
+        + '<td class="zentriert"><img title="Brazil" class="flaggenrahmen"/></td>'
+        + club_cells(f"Club {i}", i)
+        + club_cells(f"Club {i + 1}", i + 1)
+        + f'<td class="rechts hauptlink"><a href="/fee">{"€%d.50m" % i if i % 5 else "loan transfer"}</a></td>'
+        + "</tr>"
+        for i in range(1, rows + 1)
+    )
+    return f"<html><body>{PAGE_PADDING}<table class='items'><tbody>{body}</tbody></table>{PAGE_PADDING}</body></html>"
+
+
+def parse_rows(scraper, html_content):
+    table = scraper.find_items_table(html_content)
+    rows = table.find_all('tr', class_=['odd', 'even'])
+    return [scraper.extract_player_data(row) for row in rows]
+
+
+def bench(name, scraper_class, html_content, rows, repeat):
+    results = {}
+    for fast_parse in (False, True):
+        scraper = scraper_class(cache_dir=None, fast_parse=fast_parse)
+        extracted = parse_rows(scraper, html_content)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parse_rows(scraper, html_content)
+        elapsed = time.perf_counter() - start
+        scraper.engine.close()
+        results[fast_parse] = (extracted, rows * repeat / elapsed)
+
+    if results[False][0] != results[True][0]:
+        raise AssertionError(f"{name}: fast path output differs from html.parser output")
+
+    slow, fast = results[False][1], results[True][1]
+    print(f"{name:<14} html.parser {slow:>10.0f} rows/s   lxml fast path {fast:>10.0f} rows/s   speedup {fast / slow:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=25, help="rows per page (Transfermarkt serves 25)")
+    parser.add_argument("--repeat", type=int, default=50, help="pages parsed per measurement")
+    args = parser.parse_args()
+
+    bench("market values", GoalkeeperMarketValueScraper, market_value_page(args.rows), args.rows, args.repeat)
+    bench("transfers", MultiSeasonTransfermarktScraper, transfer_page(args.rows), args.rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
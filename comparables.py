@@ -0,0 +1,260 @@
+"""
+Comparable goalkeepers: nearest neighbours over standardized per-90 stat profiles.
+
+Each player-season becomes a vector of rate stats and per-90 counting stats,
+standardized to z-scores, and is indexed in a KD-tree so "who had a season like
+this one" is answered in milliseconds:
+
+    python comparables.py "Bernd Leno" 2024-2025 -k 10
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Stats that are already rates or averages
+RATE_FEATURES = ['PSxG/SoT', '/90', 'Cmp%', 'Launch%', 'AvgLen', 'Launch%.1', 'AvgLen.1', 'Stp%', '#OPA/90', 'AvgDist']
+# Counting stats, divided by 90s played
+PER_90_FEATURES = ['GA', 'PSxG', 'Att (GK)', 'Thr', 'Opp', 'Stp']
+
+FEATURES = RATE_FEATURES + [f"{column} per 90" for column in PER_90_FEATURES]
+
+# Identifying columns carried alongside every indexed row
+ID_COLUMNS = ['Player', 'Season', 'Squad', 'Comp', '90s']
+
+# Batch queries compare every query with every point directly while the distance
+# matrix stays below this many entries, and walk the tree per query above it
+BRUTE_FORCE_LIMIT = 50_000_000
+
+def per_90_frame(stats):
+    """Rate stats plus per-90 counting stats for every row; rows with no minutes get NaN per-90 values"""
+    features = stats[RATE_FEATURES].astype('float64')
+    nineties = stats['90s'].astype('float64').where(lambda nineties: nineties > 0)
+    per_90 = stats[PER_90_FEATURES].astype('float64').div(nineties, axis=0)
+    per_90.columns = [f"{column} per 90" for column in PER_90_FEATURES]
+    return pd.concat([features, per_90], axis=1)
+
+class KDTree:
+    """
+    KD-tree over the rows of a float matrix, stored as flat arrays. Internal nodes split
+    on the widest dimension at the median; leaves hold up to leaf_size points and are
+    scanned with vectorized NumPy, and subtrees are pruned by their bounding boxes.
+    """
+
+    def __init__(self, points, leaf_size=64):
+        self.points = np.ascontiguousarray(points, dtype='float64')
+        self.leaf_size = leaf_size
+        n = len(self.points)
+        self.order = np.arange(n)
+        # Per node: slice of self.order, children (-1 for leaves) and bounding box
+        self.start, self.end, self.left, self.right, self.lower, self.upper = [], [], [], [], [], []
+        if n:
+            self.build(0, n)
+        self.start = np.array(self.start)
+        self.end = np.array(self.end)
+        self.left = np.array(self.left)
+        self.right = np.array(self.right)
+        self.lower = np.array(self.lower)
+        self.upper = np.array(self.upper)
+        # Leaf points stored contiguously in tree order
+        self.sorted_points = self.points[self.order]
+
+    def build(self, start, end):
+        """Build the subtree over order[start:end] and return its node id"""
+        node = len(self.start)
+        members = self.points[self.order[start:end]]
+        self.start.append(start)
+        self.end.append(end)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.lower.append(members.min(axis=0))
+        self.upper.append(members.max(axis=0))
+
+        spread = self.upper[node] - self.lower[node]
+        if end - start <= self.leaf_size or not spread.any():
+            return node
+
+        dimension = int(np.argmax(spread))
+        middle = (end - start) // 2
+        # Median split: argpartition puts the median point at `middle` with smaller values before it
+        split = np.argpartition(members[:, dimension], middle)
+        self.order[start:end] = self.order[start:end][split]
+        self.left[node] = self.build(start, start + middle)
+        self.right[node] = self.build(start + middle, end)
+        return node
+
+    def box_distances(self, nodes, point):
+        """Squared distance from point to each node's bounding box (0 inside it)"""
+        gap = np.maximum(self.lower[nodes] - point, 0) + np.maximum(point - self.upper[nodes], 0)
+        return np.einsum('ij,ij->i', gap, gap)
+
+    def query(self, point, k=10):
+        """Return (distances, indices) of the k nearest points, nearest first"""
+        k = min(k, len(self.points))
+        if k == 0:
+            return np.empty(0), np.empty(0, dtype='int64')
+        point = np.asarray(point, dtype='float64')
+        best_distances = np.full(k, np.inf)
+        best_indices = np.full(k, -1, dtype='int64')
+        worst = np.inf
+        stack = [(0.0, 0)]
+        while stack:
+            bound, node = stack.pop()
+            if bound >= worst:
+                continue
+            if self.left[node] < 0:
+                start, end = self.start[node], self.end[node]
+                diffs = self.sorted_points[start:end] - point
+                distances = np.einsum('ij,ij->i', diffs, diffs)
+                closer = distances < worst
+                if closer.any():
+                    # Merge the leaf's closer points into the current best k
+                    candidates = np.concatenate([best_distances, distances[closer]])
+                    indices = np.concatenate([best_indices, self.order[start:end][closer]])
+                    keep = np.argpartition(candidates, k - 1)[:k]
+                    best_distances, best_indices = candidates[keep], indices[keep]
+                    worst = best_distances.max()
+                continue
+            children = [self.left[node], self.right[node]]
+            near_bound, far_bound = self.box_distances(children, point)
+            near, far = children
+            if far_bound < near_bound:
+                near, far, near_bound, far_bound = far, near, far_bound, near_bound
+            # Push the farther child first so the nearer one is searched first
+            if far_bound < worst:
+                stack.append((far_bound, far))
+            if near_bound < worst:
+                stack.append((near_bound, near))
+
+        order = np.argsort(best_distances, kind='stable')
+        return np.sqrt(best_distances[order]), best_indices[order]
+
+    def query_batch(self, queries, k=10):
+        """k nearest points for every row of queries, as (distances, indices) arrays of shape (m, k)"""
+        queries = np.asarray(queries, dtype='float64')
+        k = min(k, len(self.points))
+        if len(queries) * len(self.points) <= BRUTE_FORCE_LIMIT:
+            return brute_force_knn(self.points, queries, k)
+
+        distances = np.empty((len(queries), k))
+        indices = np.empty((len(queries), k), dtype='int64')
+        for row, query in enumerate(queries):
+            distances[row], indices[row] = self.query(query, k)
+        return distances, indices
+
+def brute_force_knn(points, queries, k, block_entries=4_000_000):
+    """Exact k-NN by blocks of the full distance matrix (|q|^2 + |x|^2 - 2 q.x through BLAS)"""
+    squared_norms = np.einsum('ij,ij->i', points, points)
+    distances = np.empty((len(queries), k))
+    indices = np.empty((len(queries), k), dtype='int64')
+    block = max(1, block_entries // max(1, len(points)))
+    for start in range(0, len(queries), block):
+        chunk = queries[start:start + block]
+        squared = squared_norms[None, :] - 2 * chunk @ points.T + np.einsum('ij,ij->i', chunk, chunk)[:, None]
+        nearest = np.argpartition(squared, k - 1, axis=1)[:, :k] if k < len(points) else np.tile(np.arange(len(points)), (len(chunk), 1))
+        nearest_squared = np.take_along_axis(squared, nearest, axis=1)
+        order = np.argsort(nearest_squared, axis=1, kind='stable')
+        indices[start:start + block] = np.take_along_axis(nearest, order, axis=1)
+        distances[start:start + block] = np.sqrt(np.maximum(np.take_along_axis(nearest_squared, order, axis=1), 0))
+    return distances, indices
+
+class ComparablesIndex:
+    """
+    Nearest-neighbour index over player-season stat profiles.
+    Seasons under min_90s are left out (per-90 numbers from a handful of games are
+    noise), missing stats are imputed with the column mean, and every feature is
+    standardized so each counts equally unless weighted.
+    """
+
+    def __init__(self, stats, features=FEATURES, min_90s=5.0, weights=None, leaf_size=64):
+        self.features = list(features)
+        profiles = per_90_frame(stats)[self.features]
+        keep = (stats['90s'].astype('float64') >= min_90s).to_numpy()
+        self.rows = stats.loc[keep, ID_COLUMNS].reset_index(drop=True)
+        self.rows['Player'] = self.rows['Player'].astype('string')
+        self.rows['Season'] = self.rows['Season'].astype('string')
+
+        matrix = profiles[keep].to_numpy(dtype='float64')
+        self.mean = np.nanmean(matrix, axis=0)
+        self.std = np.nanstd(matrix, axis=0)
+        self.std[~(self.std > 0)] = 1.0
+        self.weights = np.array([1.0 if weights is None else weights.get(f, 1.0) for f in self.features])
+        self.matrix = self.standardize(matrix)
+        self.tree = KDTree(self.matrix, leaf_size=leaf_size)
+
+        # (player, season) -> row of the index (the first, for namesakes in the same season)
+        self.positions = {}
+        for position, key in enumerate(zip(self.rows['Player'], self.rows['Season'])):
+            self.positions.setdefault(key, position)
+
+    def standardize(self, matrix):
+        """Z-scores with missing values at the mean (0), scaled by the feature weights"""
+        scaled = (matrix - self.mean) / self.std
+        return np.nan_to_num(scaled, nan=0.0) * self.weights
+
+    def position(self, player, season):
+        if (player, season) not in self.positions:
+            raise KeyError(f"{player} {season} is not in the comparables index (unknown, or under the minimum 90s)")
+        return self.positions[(player, season)]
+
+    def neighbours(self, distances, indices, query_rows, k, exclude_same_player):
+        """Long-form result frame, dropping each query's own row (and other seasons of the same player)"""
+        result = pd.DataFrame({
+            'query': np.repeat(query_rows, indices.shape[1]),
+            'index': indices.ravel(),
+            'Distance': distances.ravel(),
+        })
+        query_players = self.rows['Player'].to_numpy()[result['query']]
+        same = result['query'].to_numpy() == result['index'].to_numpy()
+        if exclude_same_player:
+            same |= query_players == self.rows['Player'].to_numpy()[result['index']]
+        result = result[~same]
+        result = result.groupby('query', sort=False).head(k)
+        result['Rank'] = result.groupby('query', sort=False).cumcount() + 1
+
+        queries = self.rows.iloc[result['query']][['Player', 'Season']].reset_index(drop=True)
+        matches = self.rows.iloc[result['index']].reset_index(drop=True).add_prefix('Comparable ')
+        return pd.concat([queries, result[['Rank', 'Distance']].reset_index(drop=True), matches], axis=1)
+
+    def search_width(self, k, exclude_same_player):
+        # Leave room for the query row itself and, if excluded, the player's other seasons
+        extra = int(self.rows['Player'].value_counts().max()) if exclude_same_player and len(self.rows) else 1
+        return k + extra
+
+    def query(self, player, season, k=10, exclude_same_player=True):
+        """The k most similar player-seasons to one player's season"""
+        row = self.position(player, season)
+        distances, indices = self.tree.query(self.matrix[row], self.search_width(k, exclude_same_player))
+        return self.neighbours(distances[None, :], indices[None, :], np.array([row]), k, exclude_same_player)
+
+    def query_profile(self, profile, k=10):
+        """The k player-seasons closest to an arbitrary stat profile ({feature: value}, missing features at the mean)"""
+        vector = np.array([[profile.get(feature, np.nan) for feature in self.features]], dtype='float64')
+        distances, indices = self.tree.query(self.standardize(vector)[0], k)
+        result = self.rows.iloc[indices].reset_index(drop=True)
+        result.insert(0, 'Distance', distances)
+        return result
+
+    def query_all(self, k=10, exclude_same_player=True):
+        """The k comparables of every indexed player-season at once, in long form"""
+        width = self.search_width(k, exclude_same_player)
+        distances, indices = self.tree.query_batch(self.matrix, width)
+        return self.neighbours(distances, indices, np.arange(len(self.rows)), k, exclude_same_player)
+
+def main():
+    parser = argparse.ArgumentParser(description="Find goalkeepers with the most similar season profiles")
+    parser.add_argument('player', help="player name as it appears in goalkeeper_dataset")
+    parser.add_argument('season', help="season, e.g. 2024-2025")
+    parser.add_argument('-k', type=int, default=10, help="number of comparables")
+    parser.add_argument('--min-90s', type=float, default=5.0, help="leave out seasons with fewer 90s played")
+    args = parser.parse_args()
+
+    from dataset import load_dataset
+    stats = load_dataset('goalkeeper_dataset', columns=ID_COLUMNS + RATE_FEATURES + PER_90_FEATURES, min_90s=args.min_90s)
+    index = ComparablesIndex(stats, min_90s=args.min_90s)
+    comparables = index.query(args.player, args.season, k=args.k)
+    print(comparables[['Rank', 'Distance', 'Comparable Player', 'Comparable Season', 'Comparable Squad', 'Comparable 90s']]
+          .to_string(index=False, float_format='{:.2f}'.format))
+
+if __name__ == "__main__":
+    main()
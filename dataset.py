@@ -0,0 +1,162 @@
+"""
+Dataset access: typed Parquet with a CSV fallback.
+
+load_dataset() reads only the requested columns and pushes season, competition
+and minimum-90s filters down into the read: Parquet filters go to pyarrow, and
+CSVs are scanned in chunks so only matching rows are kept and typed. pandas
+and the schema registry are imported on first use, so quick lookups start fast:
+
+    python dataset.py goalkeeper_dataset --columns Player Season GA --season 2024-2025 --min-90s 10
+"""
+import argparse
+import contextlib
+import fcntl
+import os
+
+# Rows per chunk when scanning a CSV with filters or streaming a dataset
+CHUNK_ROWS = 50_000
+
+def dataset_paths(stem, directory='.'):
+    """Parquet and CSV paths for a dataset file stem"""
+    return os.path.join(directory, f"{stem}.parquet"), os.path.join(directory, f"{stem}.csv")
+
+@contextlib.contextmanager
+def dataset_lock(stem, directory='.'):
+    """
+    Hold an exclusive lock on a dataset for the block. Aggregators read, modify and rewrite
+    whole datasets; holding the lock from load to save means two of them running at once
+    never overwrite each other's rows. It can also decorate a function, locking each call.
+    """
+    with open(os.path.join(directory, f"{stem}.lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def save_dataset(df, name, stem=None, directory='.', write_csv=True):
+    """
+    Write a dataset as typed, columnar Parquet using its registered schema.
+    The CSV copy is still written by default for tools and people that read it directly.
+    Both are written to temporary files and renamed, so readers never see a half-written file.
+    Returns the typed DataFrame.
+    """
+    from schema import apply_schema
+
+    parquet_path, csv_path = dataset_paths(stem or name, directory)
+    typed = apply_schema(df, name)
+    typed.to_parquet(f"{parquet_path}.tmp", index=False)
+    if write_csv:
+        df.to_csv(f"{csv_path}.tmp", index=False)
+        os.replace(f"{csv_path}.tmp", csv_path)
+    os.replace(f"{parquet_path}.tmp", parquet_path)
+    return typed
+
+def as_list(value):
+    if value is None:
+        return None
+    return [value] if isinstance(value, (str, int, float)) else list(value)
+
+def row_filters(seasons=None, competitions=None, min_90s=None):
+    """Filters as (column, op, value) tuples, in the form pyarrow's Parquet reader takes them"""
+    filters = []
+    if seasons is not None:
+        filters.append(('Season', 'in', as_list(seasons)))
+    if competitions is not None:
+        filters.append(('Comp', 'in', as_list(competitions)))
+    if min_90s is not None:
+        filters.append(('90s', '>=', float(min_90s)))
+    return filters
+
+def filter_mask(df, filters):
+    """Boolean mask of the rows of a raw CSV chunk that pass every filter"""
+    import pandas as pd
+
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        if op == 'in':
+            mask &= df[column].astype('string').isin([str(v) for v in value]).fillna(False)
+        else:
+            mask &= (pd.to_numeric(df[column], errors='coerce') >= value).fillna(False)
+    return mask
+
+def load_dataset(name, columns=None, stem=None, directory='.', seasons=None, competitions=None, min_90s=None):
+    """
+    Load a dataset with its registered dtypes, reading only the requested columns
+    and, when filters are given, only the rows that match them:
+    seasons and competitions (a value or a list) and a minimum number of 90s played.
+    Reads the Parquet file when present and falls back to the CSV otherwise.
+    """
+    import pandas as pd
+
+    parquet_path, csv_path = dataset_paths(stem or name, directory)
+    filters = row_filters(seasons, competitions, min_90s)
+    # Filter columns are read too, and dropped again if they were not asked for
+    read_columns = None if columns is None else list(dict.fromkeys(list(columns) + [column for column, _, _ in filters]))
+
+    if os.path.exists(parquet_path):
+        df = pd.read_parquet(parquet_path, columns=read_columns, filters=filters or None)
+        if filters:
+            # Categorical filter columns keep every category; drop the ones no row uses any more
+            df = df.apply(lambda column: column.cat.remove_unused_categories() if isinstance(column.dtype, pd.CategoricalDtype) else column)
+    else:
+        df = read_csv_filtered(csv_path, read_columns, filters)
+        from schema import apply_schema
+        df = apply_schema(df, name)
+
+    return df if columns is None else df[[column for column in df.columns if column in columns]]
+
+def read_csv_filtered(csv_path, columns, filters):
+    """Read a CSV's columns, scanning it in chunks and keeping only matching rows when there are filters"""
+    import pandas as pd
+
+    if not filters:
+        return pd.read_csv(csv_path, usecols=columns)
+    chunks = [chunk[filter_mask(chunk, filters)] for chunk in pd.read_csv(csv_path, usecols=columns, chunksize=CHUNK_ROWS)]
+    return pd.concat(chunks, ignore_index=True)
+
+def dataset_columns(name, stem=None, directory='.'):
+    """Column names of a dataset, read from the Parquet schema or the CSV header"""
+    import pandas as pd
+
+    parquet_path, csv_path = dataset_paths(stem or name, directory)
+    if os.path.exists(parquet_path):
+        import pyarrow.parquet as pq
+        return list(pq.ParquetFile(parquet_path).schema_arrow.names)
+    return list(pd.read_csv(csv_path, nrows=0).columns)
+
+def iter_dataset(name, stem=None, directory='.', chunk_rows=CHUNK_ROWS, columns=None):
+    """
+    Yield a dataset chunk_rows rows at a time, each chunk typed with its registered schema,
+    so files larger than memory can be streamed. Reads Parquet record batches when the
+    Parquet file is present and CSV chunks otherwise.
+    """
+    import pandas as pd
+    from schema import apply_schema
+
+    parquet_path, csv_path = dataset_paths(stem or name, directory)
+    if os.path.exists(parquet_path):
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(parquet_path).iter_batches(chunk_rows, columns=columns)
+        chunks = (batch.to_pandas() for batch in batches)
+    else:
+        chunks = pd.read_csv(csv_path, usecols=columns, chunksize=chunk_rows)
+    for chunk in chunks:
+        yield apply_schema(chunk, name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the rows of a dataset that match the given filters")
+    parser.add_argument('name', help="registered dataset name, e.g. goalkeeper_dataset")
+    parser.add_argument('--stem', help="file stem if it differs from the dataset name, e.g. keepers_stats_2024_2025")
+    parser.add_argument('--columns', nargs='+', help="columns to read (default: all)")
+    parser.add_argument('--season', nargs='+', help="keep only these seasons, e.g. 2024-2025")
+    parser.add_argument('--comp', nargs='+', help="keep only these competitions, e.g. 'eng Premier League'")
+    parser.add_argument('--min-90s', type=float, help="keep only rows with at least this many 90s played")
+    args = parser.parse_args()
+
+    df = load_dataset(args.name, args.columns, args.stem, seasons=args.season, competitions=args.comp, min_90s=args.min_90s)
+    print(df.to_string(index=False))
+    print(f"\n{len(df)} rows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Multi-season goalkeeper features, cached on disk per feature group.
+
+Every row of goalkeeper_dataset gets per-90 rates, season-over-season deltas,
+rolling 2- and 3-season minutes-weighted means and its position on the league-wide
+age curve. Everything is computed with grouped, vectorized transforms over
+player-seasons (a season split between two clubs counts as one season).
+
+Each feature group is stored in its own Parquet file, keyed by a hash of exactly the
+input columns it reads plus its version, so a repeated run loads the matrix from disk,
+a change to one stat recomputes only the groups that read it, and a new group is
+computed alone:
+
+    python features.py
+    python features.py --rebuild
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+FEATURE_STORE_DIR = 'feature_store'
+
+# Columns identifying each feature row; a player is a name plus birth year
+ID_COLUMNS = ['Player', 'Born', 'Season', 'Squad']
+
+# Counting stats turned into per-90 rates
+PER_90_COLUMNS = ['GA', 'PSxG', '#OPA']
+
+# Counting stats whose league-wide per-90 rate by age forms the age curves
+AGE_CURVE_COLUMNS = ['GA', 'PSxG+/-']
+
+ROLLING_WINDOWS = [2, 3]
+
+# Ages on either side pooled into each point of an age curve, which smooths out thinly populated ages
+AGE_CURVE_SPAN = 1
+
+def season_start(seasons):
+    return pd.to_numeric(seasons.astype('string').str[:4], errors='coerce')
+
+def player_seasons(stats, columns):
+    """
+    Sums of counting columns per player-season, oldest season first within each player,
+    plus the (player code, season start) of every input row to map season values back
+    """
+    keys = pd.DataFrame({
+        'player': stats.groupby([stats['Player'].astype('string'), stats['Born'].astype('Int64')], dropna=False, sort=False).ngroup(),
+        'season_start': season_start(stats['Season']),
+    }, index=stats.index)
+    seasons = stats[['90s'] + columns].astype('float64').groupby([keys['player'], keys['season_start']]).sum(min_count=1)
+    return seasons, pd.MultiIndex.from_frame(keys)
+
+def per_90(counts, nineties):
+    return counts.div(nineties.where(nineties > 0), axis=0)
+
+def per_90_features(stats):
+    """Per-90 rates of each row"""
+    rates = per_90(stats[PER_90_COLUMNS].astype('float64'), stats['90s'].astype('float64'))
+    return rates.add_suffix(' per 90')
+
+def career_features(stats):
+    """Career season number and the gap since the player's previous season"""
+    seasons, rows = player_seasons(stats, [])
+    starts = seasons.index.get_level_values('season_start').to_series(index=seasons.index)
+    by_player = starts.groupby(level='player')
+    career = pd.DataFrame({
+        'Career Season': by_player.cumcount() + 1,
+        'Years Since Previous Season': starts - by_player.shift(1),
+    })
+    return career.reindex(rows).set_axis(stats.index)
+
+def delta_features(stats):
+    """Change in minutes and per-90 rates since the player's previous season"""
+    seasons, rows = player_seasons(stats, PER_90_COLUMNS)
+    values = per_90(seasons[PER_90_COLUMNS], seasons['90s']).add_suffix(' per 90')
+    values.insert(0, '90s', seasons['90s'])
+    deltas = (values - values.groupby(level='player').shift(1)).add_suffix(' delta')
+    return deltas.reindex(rows).set_axis(stats.index)
+
+def rolling_features(stats):
+    """
+    Minutes-weighted per-90 rates and mean 90s over each player's last 2 and 3 seasons
+    (up to and including the row's season), from rolling sums built with cumulative sums
+    """
+    seasons, rows = player_seasons(stats, PER_90_COLUMNS)
+    totals = seasons.fillna(0.0)
+    cumulative = totals.groupby(level='player').cumsum()
+    played = pd.Series(1.0, index=seasons.index).groupby(level='player').cumsum()
+    frames = []
+    for window in ROLLING_WINDOWS:
+        window_sums = cumulative - cumulative.groupby(level='player').shift(window).fillna(0.0)
+        window_seasons = played - played.groupby(level='player').shift(window).fillna(0.0)
+        rolling = per_90(window_sums[PER_90_COLUMNS], window_sums['90s']).add_suffix(f" per 90 ({window} seasons)")
+        rolling.insert(0, f"90s ({window} season mean)", window_sums['90s'] / window_seasons)
+        frames.append(rolling)
+    return pd.concat(frames, axis=1).reindex(rows).set_axis(stats.index)
+
+def age_curve_features(stats):
+    """
+    League-wide minutes-weighted per-90 rate at the row's age (pooling neighbouring ages)
+    and how far the row's own rate sits above or below it
+    """
+    counts = stats[['90s'] + AGE_CURVE_COLUMNS].astype('float64')
+    ages = stats['Age'].astype('Int64')
+    by_age = counts.groupby(ages).sum(min_count=1)
+    if by_age.empty:
+        by_age = by_age.reindex([0])
+    by_age = by_age.reindex(range(int(by_age.index.min()), int(by_age.index.max()) + 1))
+    pooled = by_age.fillna(0.0).rolling(2 * AGE_CURVE_SPAN + 1, center=True, min_periods=1).sum()
+    curve = per_90(pooled[AGE_CURVE_COLUMNS], pooled['90s'])
+
+    features = {}
+    own = per_90(counts[AGE_CURVE_COLUMNS], counts['90s'])
+    at_age = curve.reindex(ages.to_numpy()).set_axis(stats.index)
+    for column in AGE_CURVE_COLUMNS:
+        features[f"Age Curve {column} per 90"] = at_age[column]
+        features[f"{column} per 90 vs Age Curve"] = own[column] - at_age[column]
+    return pd.DataFrame(features, index=stats.index)
+
+# Feature groups: the dataset columns each reads, its builder, and a version to bump when
+# its logic changes. A group's cache is reused only while its inputs and version match
+FEATURE_GROUPS = {
+    'per_90': {'inputs': ['90s'] + PER_90_COLUMNS, 'build': per_90_features, 'version': 1},
+    'career': {'inputs': ['Player', 'Born', 'Season', '90s'], 'build': career_features, 'version': 1},
+    'deltas': {'inputs': ['Player', 'Born', 'Season', '90s'] + PER_90_COLUMNS, 'build': delta_features, 'version': 1},
+    'rolling': {'inputs': ['Player', 'Born', 'Season', '90s'] + PER_90_COLUMNS, 'build': rolling_features, 'version': 1},
+    'age_curve': {'inputs': ['Age', '90s'] + AGE_CURVE_COLUMNS, 'build': age_curve_features, 'version': 1},
+}
+
+def input_columns(groups=FEATURE_GROUPS):
+    """Every dataset column the given feature groups (and the row IDs) read"""
+    columns = list(ID_COLUMNS)
+    for spec in groups.values():
+        columns.extend(column for column in spec['inputs'] if column not in columns)
+    return columns
+
+def group_key(stats, group):
+    """Content hash of the rows (in order) and columns a group reads, plus its version"""
+    spec = FEATURE_GROUPS[group]
+    columns = ID_COLUMNS + [column for column in spec['inputs'] if column not in ID_COLUMNS]
+    row_hashes = pd.util.hash_pandas_object(stats[columns], index=False).to_numpy()
+    digest = hashlib.sha256(row_hashes.tobytes())
+    digest.update(json.dumps({'group': group, 'columns': columns, 'version': spec['version']}).encode())
+    return digest.hexdigest()
+
+class FeatureStore:
+    """
+    Feature groups cached as Parquet files in a directory, with a manifest mapping each
+    group to the input hash it was computed from and its file
+    """
+
+    def __init__(self, directory=FEATURE_STORE_DIR):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_manifest(self):
+        # Write then rename, so a crash never leaves a half-written manifest
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def cached(self, group, key):
+        """The group's cached columns if they were computed from the same input, else None"""
+        entry = self.manifest.get(group)
+        if entry is None or entry['key'] != key or not os.path.exists(self.path(entry['file'])):
+            return None
+        return pd.read_parquet(self.path(entry['file']))
+
+    def save(self, group, key, features):
+        filename = f"{group}-{key[:16]}.parquet"
+        features.to_parquet(self.path(f"{filename}.tmp"), index=False)
+        os.replace(self.path(f"{filename}.tmp"), self.path(filename))
+        previous = self.manifest.get(group)
+        self.manifest[group] = {'key': key, 'file': filename, 'columns': list(features.columns)}
+        self.save_manifest()
+        if previous and previous['file'] != filename and os.path.exists(self.path(previous['file'])):
+            os.remove(self.path(previous['file']))
+
+    def build(self, stats, groups=None, rebuild=False):
+        """
+        Feature matrix for the stats rows: the ID columns followed by every group's
+        features, reusing each group's cache unless its input changed (or rebuild is set)
+        """
+        stats = stats.reset_index(drop=True)
+        frames = [stats[ID_COLUMNS]]
+        recomputed = []
+        for group in groups or FEATURE_GROUPS:
+            key = group_key(stats, group)
+            features = None if rebuild else self.cached(group, key)
+            if features is None:
+                features = FEATURE_GROUPS[group]['build'](stats).astype('float64').reset_index(drop=True)
+                self.save(group, key, features)
+                recomputed.append(group)
+            frames.append(features)
+        reused = [group for group in groups or FEATURE_GROUPS if group not in recomputed]
+        print(f"Features: recomputed {', '.join(recomputed) or 'nothing'}; loaded {', '.join(reused) or 'nothing'} from {self.directory}")
+        return pd.concat(frames, axis=1)
+
+def build_features(stats=None, directory=FEATURE_STORE_DIR, groups=None, rebuild=False):
+    """Feature matrix for goalkeeper_dataset (or the given stats rows), through the feature store"""
+    if stats is None:
+        from dataset import load_dataset
+        stats = load_dataset('goalkeeper_dataset', columns=input_columns())
+    return FeatureStore(directory).build(stats, groups=groups, rebuild=rebuild)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build (or load) the multi-season goalkeeper feature matrix")
+    parser.add_argument('--group', action='append', choices=list(FEATURE_GROUPS), help="only these feature groups (repeatable)")
+    parser.add_argument('--rebuild', action='store_true', help="recompute every group even if its cache is current")
+    parser.add_argument('--directory', default=FEATURE_STORE_DIR, help="feature store directory")
+    args = parser.parse_args()
+
+    features = build_features(directory=args.directory, groups=args.group, rebuild=args.rebuild)
+    print(f"{len(features)} rows x {len(features.columns) - len(ID_COLUMNS)} features")
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(features.head().to_string(index=False, float_format='{:.2f}'.format))
+
+if __name__ == "__main__":
+    main()
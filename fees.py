@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+FEE_KINDS = ['paid', 'loan', 'free', 'undisclosed', 'unknown']
+
+UNIT_MULTIPLIERS = {'bn': 1e9, 'm': 1e6, 'k': 1e3, 'th.': 1e3}
+
+# "€31.20m", "€500k", "Loan fee:€2.00m" -> amount and unit
+EURO_AMOUNT = r'€\s*(\d+(?:\.\d+)?)\s*(bn|m|k|th\.)?'
+# Older scraper output kept only the number of millions, e.g. "31.20"
+BARE_MILLIONS = r'^(\d+(?:\.\d+)?)$'
+
+def normalize_fees(values):
+    """
+    Convert a whole column of Transfermarkt fee or market value text into float euros
+    and a categorical kind (paid, loan, free, undisclosed, unknown) using vectorized
+    string operations. Returns a DataFrame with 'euros' and 'kind' columns.
+    """
+    text = values.astype('string').str.strip().str.lower()
+
+    amount = text.str.extract(EURO_AMOUNT)
+    euros = pd.to_numeric(amount[0], errors='coerce') * amount[1].map(UNIT_MULTIPLIERS).fillna(1.0).astype('float64')
+    bare_millions = pd.to_numeric(text.str.extract(BARE_MILLIONS)[0], errors='coerce') * 1e6
+    euros = euros.fillna(bare_millions).astype('float64')
+
+    is_loan = text.str.contains('loan', na=False)
+    is_free = text.str.contains('free', na=False)
+    is_undisclosed = text.str.contains(r'\?|undisclosed', na=False)
+    kind = np.select(
+        [is_loan.to_numpy(bool), is_free.to_numpy(bool), is_undisclosed.to_numpy(bool), euros.notna().to_numpy(bool)],
+        ['loan', 'free', 'undisclosed', 'paid'],
+        default='unknown',
+    )
+
+    # Free transfers cost nothing; loans only carry an amount when a loan fee is quoted
+    euros = euros.mask(is_free, 0.0)
+
+    return pd.DataFrame({
+        'euros': euros,
+        'kind': pd.Categorical(kind, categories=FEE_KINDS),
+    }, index=values.index)
@@ -0,0 +1,185 @@
+import contextlib
+import difflib
+import fcntl
+import json
+import os
+import re
+import unicodedata
+
+import pandas as pd
+
+INDEX_FILE = 'player_index.json'
+
+def normalize_name(name):
+    """Accent-fold, lowercase and strip punctuation: 'Aarón Escandell' -> 'aaron escandell'"""
+    folded = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^a-z0-9 ]', ' ', folded.lower()).split())
+
+def blocking_keys(normalized):
+    """
+    Cheap keys that a fuzzy match almost always shares with its target: the surname
+    with the first initial, and a surname prefix. Lookups only score candidates in
+    these blocks instead of scanning every player.
+    """
+    tokens = normalized.split()
+    if not tokens:
+        return []
+    surname = tokens[-1]
+    keys = [f"p:{surname[:4]}"]
+    if len(tokens) > 1:
+        keys.append(f"s:{surname}:{tokens[0][0]}")
+    return keys
+
+class PlayerIndex:
+    """
+    Stable player identities across Transfermarkt and fbref.
+    Each player gets an integer key; Transfermarkt IDs, fbref IDs and accent-folded
+    name aliases all map to keys through hash tables, and a blocking table narrows
+    fuzzy name lookups to a handful of candidates.
+    """
+
+    def __init__(self):
+        self.players = {}         # key -> {'name', 'transfermarkt_id', 'fbref_id'}
+        self.by_transfermarkt = {}
+        self.by_fbref = {}
+        self.aliases = {}         # normalized name -> set of keys (several players can share a name)
+        self.blocks = {}          # blocking key -> set of normalized names
+        self.next_key = 1
+
+    def add_alias(self, key, normalized):
+        self.aliases.setdefault(normalized, set()).add(key)
+        for block in blocking_keys(normalized):
+            self.blocks.setdefault(block, set()).add(normalized)
+
+    def fuzzy_candidates(self, normalized, threshold=0.9):
+        """Return (score, alias) pairs above the threshold from the name's blocks, best first"""
+        aliases = set()
+        for block in blocking_keys(normalized):
+            aliases.update(self.blocks.get(block, ()))
+        scored = [(difflib.SequenceMatcher(None, normalized, alias).ratio(), alias) for alias in aliases]
+        return sorted((pair for pair in scored if pair[0] >= threshold), reverse=True)
+
+    def resolve(self, name, transfermarkt_id=None, fbref_id=None, fuzzy=True):
+        """
+        Find the key for a player: by source ID, then by exact folded name, then by
+        fuzzy name within the blocks. Returns None when there is no unambiguous match.
+        """
+        if transfermarkt_id and transfermarkt_id in self.by_transfermarkt:
+            return self.by_transfermarkt[transfermarkt_id]
+        if fbref_id and fbref_id in self.by_fbref:
+            return self.by_fbref[fbref_id]
+
+        normalized = normalize_name(name)
+        keys = self.aliases.get(normalized, set())
+        if len(keys) > 1:
+            return None
+        if len(keys) == 1:
+            key = next(iter(keys))
+            return key if self.ids_agree(key, transfermarkt_id, fbref_id) else None
+
+        if fuzzy:
+            candidates = self.fuzzy_candidates(normalized)
+            # Only accept a fuzzy match that is clearly better than the runner-up and names one player
+            if candidates and (len(candidates) == 1 or candidates[0][0] - candidates[1][0] > 0.05):
+                keys = self.aliases[candidates[0][1]]
+                if len(keys) == 1:
+                    key = next(iter(keys))
+                    return key if self.ids_agree(key, transfermarkt_id, fbref_id) else None
+        return None
+
+    def ids_agree(self, key, transfermarkt_id=None, fbref_id=None):
+        """False if the player already has a different ID from the same source: a namesake, not the same player"""
+        player = self.players[key]
+        if transfermarkt_id and player['transfermarkt_id'] not in (None, transfermarkt_id):
+            return False
+        if fbref_id and player['fbref_id'] not in (None, fbref_id):
+            return False
+        return True
+
+    def add(self, name, transfermarkt_id=None, fbref_id=None):
+        """Resolve a player, creating a new identity if needed, and record its IDs and alias"""
+        key = self.resolve(name, transfermarkt_id, fbref_id)
+        if key is None:
+            key = self.next_key
+            self.next_key += 1
+            self.players[key] = {'name': name, 'transfermarkt_id': None, 'fbref_id': None}
+
+        player = self.players[key]
+        if transfermarkt_id and player['transfermarkt_id'] is None:
+            player['transfermarkt_id'] = transfermarkt_id
+            self.by_transfermarkt[transfermarkt_id] = key
+        if fbref_id and player['fbref_id'] is None:
+            player['fbref_id'] = fbref_id
+            self.by_fbref[fbref_id] = key
+        self.add_alias(key, normalize_name(name))
+        return key
+
+    def assign_keys(self, names, transfermarkt_ids=None, fbref_ids=None):
+        """
+        Return a Series of player keys for a column of names (and optional ID columns),
+        adding unseen players. Each distinct (name, IDs) combination is resolved once and
+        the result is mapped back onto the column.
+        """
+        records = pd.DataFrame({
+            'name': names.astype('string'),
+            'transfermarkt_id': transfermarkt_ids.astype('string') if transfermarkt_ids is not None else pd.NA,
+            'fbref_id': fbref_ids.astype('string') if fbref_ids is not None else pd.NA,
+        }, index=names.index)
+        records = records.fillna('')
+        distinct = records.drop_duplicates()
+        keys = {
+            (name, tm_id, fb_id): self.add(name, tm_id or None, fb_id or None)
+            for name, tm_id, fb_id in distinct.itertuples(index=False, name=None)
+        }
+        return pd.Series([keys[record] for record in records.itertuples(index=False, name=None)],
+                         index=names.index, dtype='int64')
+
+    def save(self, filename=INDEX_FILE):
+        """Write the index to JSON (aliases and blocks are rebuilt on load)"""
+        data = {
+            'next_key': self.next_key,
+            'players': {str(key): player for key, player in self.players.items()},
+            'aliases': {alias: sorted(keys) for alias, keys in self.aliases.items()},
+        }
+        # Write then rename, so a reader never sees a half-written index
+        with open(f"{filename}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(f"{filename}.tmp", filename)
+
+    @classmethod
+    def load(cls, filename=INDEX_FILE):
+        """Load a saved index, or start an empty one if the file does not exist"""
+        index = cls()
+        if not os.path.exists(filename):
+            return index
+        with open(filename, encoding='utf-8') as f:
+            data = json.load(f)
+        index.next_key = data['next_key']
+        for key, player in data['players'].items():
+            key = int(key)
+            index.players[key] = player
+            if player['transfermarkt_id']:
+                index.by_transfermarkt[player['transfermarkt_id']] = key
+            if player['fbref_id']:
+                index.by_fbref[player['fbref_id']] = key
+        for alias, keys in data['aliases'].items():
+            for key in keys:
+                index.add_alias(key, alias)
+        return index
+
+    @classmethod
+    @contextlib.contextmanager
+    def locked(cls, filename=INDEX_FILE):
+        """
+        Load the index under an exclusive lock and save it when the block ends. The pipeline runs
+        the scrapers in parallel, and each assigns keys: holding the lock from load to save means
+        no two processes hand out the same key or overwrite each other's new players.
+        """
+        with open(f"{filename}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = cls.load(filename)
+                yield index
+                index.save(filename)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,220 @@
+"""
+Append-only history of goalkeeper market values.
+
+Every scrape appends only the players whose club, value or rank changed since the
+previous one, stamped with the scrape time, to a small CSV log. Compaction moves the
+log into columnar Parquet checkpoints: the period's changes sorted by player (so
+per-player lookups skip row groups by their min/max statistics), plus the full state
+of every player at the end of the period (so "as of" lookups start from the nearest
+checkpoint instead of replaying years of changes).
+
+    python market_value_history.py as-of 2025-01-31
+    python market_value_history.py history "David Raya"
+    python market_value_history.py compact
+"""
+import argparse
+import json
+import os
+
+import pandas as pd
+
+import metrics
+from schema import apply_schema
+
+HISTORY_DIR = 'market_value_history'
+
+# Entry fields: a change in any of them records a new entry for the player
+TRACKED_COLUMNS = ['Club', 'Market Value', 'Rank']
+# The value's kind is kept too: it marks values that are already in euros when the log is read back
+COLUMNS = ['Scraped At', 'Player ID', 'Player'] + TRACKED_COLUMNS + ['Market Value Kind']
+
+# Compact automatically once the log holds this many entries
+COMPACT_ROWS = 50_000
+
+# Rows per row group in a checkpoint; smaller groups make per-player lookups read less
+ROW_GROUP_ROWS = 10_000
+
+def day_end(date):
+    """Cutoff for 'as of date': everything scraped before the end of that day (UTC)"""
+    return pd.Timestamp(date, tz='UTC').normalize() + pd.Timedelta(days=1)
+
+def latest_entries(entries):
+    """The last entry of every player"""
+    return entries.sort_values('Scraped At', kind='stable').drop_duplicates('Player ID', keep='last')
+
+class MarketValueHistory:
+    """
+    Market value snapshot log with periodic compaction into Parquet checkpoints.
+    The manifest lists the checkpoints in time order, each covering the entries
+    scraped up to its `end`; the log holds everything after the last one.
+    """
+
+    def __init__(self, directory=HISTORY_DIR):
+        self.directory = directory
+        self.log_path = os.path.join(directory, 'log.csv')
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {'checkpoints': []}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_manifest(self):
+        # Write then rename, so a crash never leaves a half-written manifest
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def typed(self, entries):
+        entries = entries.copy()
+        entries['Scraped At'] = pd.to_datetime(entries['Scraped At'], utc=True)
+        entries['Player ID'] = entries['Player ID'].astype('string')
+        return apply_schema(entries, 'goalkeeper_market_values')[COLUMNS]
+
+    def read_log(self):
+        """Entries since the last checkpoint (entries an interrupted compaction already checkpointed are skipped)"""
+        if not os.path.exists(self.log_path):
+            return self.typed(pd.DataFrame(columns=COLUMNS))
+        entries = self.typed(pd.read_csv(self.log_path, dtype={'Player ID': 'string'}))
+        if self.manifest['checkpoints']:
+            entries = entries[entries['Scraped At'] > pd.Timestamp(self.manifest['checkpoints'][-1]['end'])]
+        return entries
+
+    def read_changes(self, checkpoint, filters=None):
+        return pd.read_parquet(self.path(checkpoint['changes']), filters=filters)[COLUMNS]
+
+    def read_state(self, checkpoint):
+        return pd.read_parquet(self.path(checkpoint['state']))[COLUMNS]
+
+    def current_state(self):
+        """The latest entry of every player: the last checkpoint's state updated with the log"""
+        checkpoints = self.manifest['checkpoints']
+        state = self.read_state(checkpoints[-1]) if checkpoints else self.typed(pd.DataFrame(columns=COLUMNS))
+        return latest_entries(pd.concat([state, self.read_log()], ignore_index=True))
+
+    def append(self, market_values, scraped_at=None):
+        """
+        Record one scrape: players that are new or whose club, value or rank changed are
+        appended to the log. Players missing from the scrape are left as they were, since
+        a scrape may only cover the top of the list. Returns the number of entries written.
+        """
+        scraped_at = pd.Timestamp(scraped_at or pd.Timestamp.now(tz='UTC'))
+        scraped_at = scraped_at.tz_localize('UTC') if scraped_at.tzinfo is None else scraped_at.tz_convert('UTC')
+        scrape = self.typed(market_values.assign(**{'Scraped At': scraped_at}))
+        scrape = scrape[scrape['Player ID'].notna()].drop_duplicates('Player ID')
+
+        # Compare tracked fields with each player's latest entry, as text so missing values match each other
+        state = self.current_state().set_index('Player ID')[TRACKED_COLUMNS]
+        previous = state.reindex(scrape['Player ID']).astype('string').fillna('')
+        current = scrape.set_index('Player ID')[TRACKED_COLUMNS].astype('string').fillna('')
+        changed = ~scrape['Player ID'].isin(state.index).to_numpy() | (previous != current).any(axis=1).to_numpy()
+        entries = scrape[changed]
+
+        if len(entries):
+            header = not os.path.exists(self.log_path)
+            entries.assign(**{'Scraped At': entries['Scraped At'].map(pd.Timestamp.isoformat)}).to_csv(
+                self.log_path, mode='a', header=header, index=False)
+        metrics.count('market_value_history_entries_total', len(entries))
+        print(f"Market value history: {len(entries)} of {len(scrape)} players changed since the last scrape")
+
+        if len(self.read_log()) >= COMPACT_ROWS:
+            self.compact()
+        return len(entries)
+
+    def compact(self):
+        """
+        Move the log into a checkpoint: its entries sorted by player, and the state of
+        every player at the last entry. Returns the checkpoint, or None if the log is empty.
+        """
+        log = self.read_log()
+        if log.empty:
+            return None
+
+        checkpoints = self.manifest['checkpoints']
+        end = log['Scraped At'].max()
+        name = end.strftime('%Y%m%dT%H%M%S')
+        checkpoint = {
+            'start': log['Scraped At'].min().isoformat(),
+            'end': end.isoformat(),
+            'changes': f"changes-{name}.parquet",
+            'state': f"state-{name}.parquet",
+            'rows': len(log),
+        }
+        changes = log.sort_values(['Player ID', 'Scraped At'], kind='stable')
+        changes.to_parquet(self.path(checkpoint['changes']), index=False, row_group_size=ROW_GROUP_ROWS)
+        self.current_state().sort_values('Player ID').to_parquet(self.path(checkpoint['state']), index=False)
+
+        # The manifest commits the checkpoint; only then is the log cleared
+        checkpoints.append(checkpoint)
+        self.save_manifest()
+        os.remove(self.log_path)
+        print(f"Compacted {len(log)} market value entries into {checkpoint['changes']}")
+        return checkpoint
+
+    def as_of(self, date):
+        """
+        Every player's latest entry scraped up to the end of the given day: the state of the
+        last checkpoint before it, updated with the following checkpoint's (or the log's) entries
+        """
+        cutoff = day_end(date)
+        checkpoints = self.manifest['checkpoints']
+        before = [checkpoint for checkpoint in checkpoints if pd.Timestamp(checkpoint['end']) < cutoff]
+        frames = [self.read_state(before[-1])] if before else []
+        if len(before) < len(checkpoints):
+            frames.append(self.read_changes(checkpoints[len(before)], filters=[('Scraped At', '<', cutoff)]))
+        else:
+            log = self.read_log()
+            frames.append(log[log['Scraped At'] < cutoff])
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return self.typed(pd.DataFrame(columns=COLUMNS))
+        return latest_entries(pd.concat(frames, ignore_index=True)).sort_values('Rank').reset_index(drop=True)
+
+    def player_id(self, player):
+        """Transfermarkt ID for a player given by ID or by exact name"""
+        state = self.current_state()
+        if (state['Player ID'] == str(player)).any():
+            return str(player)
+        matches = state.loc[state['Player'] == player, 'Player ID']
+        if matches.empty:
+            raise KeyError(f"No market value history for {player}")
+        return matches.iloc[0]
+
+    def history(self, player):
+        """Every recorded entry for one player (by Transfermarkt ID or name), oldest first"""
+        player_id = self.player_id(player)
+        frames = [self.read_changes(checkpoint, filters=[('Player ID', '==', player_id)])
+                  for checkpoint in self.manifest['checkpoints']]
+        log = self.read_log()
+        frames.append(log[log['Player ID'] == player_id])
+        frames = [frame for frame in frames if len(frame)]
+        return pd.concat(frames, ignore_index=True).sort_values('Scraped At', kind='stable').reset_index(drop=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Query or compact the market value history")
+    parser.add_argument('--directory', default=HISTORY_DIR, help="history directory")
+    commands = parser.add_subparsers(dest='command', required=True)
+    as_of = commands.add_parser('as-of', help="every player's value as of the end of a day")
+    as_of.add_argument('date', help="e.g. 2025-01-31")
+    history = commands.add_parser('history', help="value history of one player")
+    history.add_argument('player', help="Transfermarkt player ID or exact name")
+    commands.add_parser('compact', help="move the log into a checkpoint")
+    args = parser.parse_args()
+
+    store = MarketValueHistory(args.directory)
+    if args.command == 'as-of':
+        print(store.as_of(args.date).to_string(index=False))
+    elif args.command == 'history':
+        print(store.history(args.player).to_string(index=False))
+    else:
+        store.compact()
+
+if __name__ == "__main__":
+    main()
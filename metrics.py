@@ -0,0 +1,190 @@
+"""
+Run metrics for the scrapers, aggregators and pipeline.
+
+Counters, gauges and timers are kept in one process-wide, thread-safe registry
+(the fetch engine records from its worker threads). At the end of a run each
+job writes metrics/<job>.json, a structured run report, and metrics/<job>.prom
+in the Prometheus text format for node_exporter's textfile collector.
+
+    import metrics
+    with metrics.timer('aggregate_stage_seconds', stage='load'):
+        ...
+    metrics.count('parse_rows_total', 25, source='transfers')
+    metrics.write_report('aggregate_keepers')
+"""
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+METRICS_DIR = 'metrics'
+
+# Every metric name is exported with this prefix
+PREFIX = 'networth_'
+
+def labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def current_rss_bytes():
+    """Resident set size right now (falls back to the peak where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return peak_rss_bytes()
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process. On Linux this is VmHWM, which starts
+    over in a freshly spawned process; ru_maxrss (KiB on Linux, bytes on macOS)
+    carries over the parent's peak across fork and exec.
+    """
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class MetricsRegistry:
+    """Counters, gauges and timers keyed by (metric name, labels)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}      # key -> {'count', 'sum', 'min', 'max'}
+        self.started_at = time.time()
+
+    def count(self, name, value=1, **labels):
+        key = (name, labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, labels_key(labels))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, labels_key(labels))
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = {'count': 1, 'sum': seconds, 'min': seconds, 'max': seconds}
+            else:
+                timer['count'] += 1
+                timer['sum'] += seconds
+                timer['min'] = min(timer['min'], seconds)
+                timer['max'] = max(timer['max'], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Time the block, recording it even if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def record_memory(self, **labels):
+        """Gauge the current and peak resident memory, e.g. after an aggregator stage"""
+        self.set_gauge('memory_rss_bytes', current_rss_bytes(), **labels)
+        self.set_gauge('memory_peak_rss_bytes', peak_rss_bytes(), **labels)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+            self.started_at = time.time()
+
+    def report(self, job):
+        """Structured run report: every metric as name, labels and value(s)"""
+        finished_at = time.time()
+        with self.lock:
+            return {
+                'job': job,
+                'started_at': self.started_at,
+                'finished_at': finished_at,
+                'duration_seconds': finished_at - self.started_at,
+                'peak_rss_bytes': peak_rss_bytes(),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in sorted(self.gauges.items())],
+                'timers': [{'name': name, 'labels': dict(labels), **timer, 'mean': timer['sum'] / timer['count']}
+                           for (name, labels), timer in sorted(self.timers.items())],
+            }
+
+    def prometheus_text(self, job):
+        """The run report in the Prometheus text exposition format, every sample labelled with the job"""
+        report = self.report(job)
+        lines = []
+
+        def family(name, kind, samples):
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{PREFIX}{name}{suffix}{format_labels({'job': job, **labels})} {float(value)!r}")
+
+        def grouped(entries):
+            groups = {}
+            for entry in entries:
+                groups.setdefault(entry['name'], []).append(entry)
+            return groups.items()
+
+        for name, entries in grouped(report['counters']):
+            family(name, 'counter', [('', entry['labels'], entry['value']) for entry in entries])
+        for name, entries in grouped(report['gauges']):
+            family(name, 'gauge', [('', entry['labels'], entry['value']) for entry in entries])
+        for name, entries in grouped(report['timers']):
+            family(name, 'summary', [sample for entry in entries for sample in (
+                ('_sum', entry['labels'], entry['sum']),
+                ('_count', entry['labels'], entry['count']),
+            )])
+            family(f"{name}_max", 'gauge', [('', entry['labels'], entry['max']) for entry in entries])
+
+        # When the job last finished and how long it took, for staleness and slowdown alerts
+        family('run_duration_seconds', 'gauge', [('', {}, report['duration_seconds'])])
+        family('run_finished_timestamp_seconds', 'gauge', [('', {}, report['finished_at'])])
+        family('run_peak_rss_bytes', 'gauge', [('', {}, report['peak_rss_bytes'])])
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, job, directory=METRICS_DIR):
+        """Write metrics/<job>.json and metrics/<job>.prom; returns both paths"""
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, f"{job}.json")
+        prom_path = os.path.join(directory, f"{job}.prom")
+        write_atomic(json_path, json.dumps(self.report(job), indent=2))
+        write_atomic(prom_path, self.prometheus_text(job))
+        print(f"Wrote run metrics to {json_path} and {prom_path}")
+        return json_path, prom_path
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in sorted(labels.items())) + '}'
+
+def write_atomic(path, text):
+    """Write via a temporary file so collectors never read a half-written file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+# The process-wide registry and shortcuts to it
+REGISTRY = MetricsRegistry()
+count = REGISTRY.count
+set_gauge = REGISTRY.set_gauge
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+record_memory = REGISTRY.record_memory
+write_report = REGISTRY.write_report
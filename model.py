@@ -1,13 +1,184 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
 import pandas as pd
 
-df = pd.read_csv('goalkeeper_dataset.csv')
+from comparables import FEATURES, PER_90_FEATURES, RATE_FEATURES, per_90_frame
+from dataset import load_dataset
+
+# Fitted model plus its feature pipeline, reused while the training data is unchanged
+MODEL_FILE = 'fee_model.npz'
+VALUATIONS_FILE = 'goalkeeper_valuations.csv'
+
+# Season stats fed to the model: age, minutes and the comparables' per-90 profile,
+# plus a one-hot league column per competition seen in training
+NUMERIC_FEATURES = ['Age', '90s'] + FEATURES
+
+# Ridge penalties tried by cross-validation
+ALPHAS = [0.01, 0.1, 1.0, 10.0, 100.0, 1000.0, 10000.0]
+
+# Bump when the features or the fit change, so older cached models are not reused
+MODEL_VERSION = 1
+
+def model_metadata(data_hash):
+    """What a saved model must match to be reused: the training data, the features and the fitting setup"""
+    return {'data_hash': data_hash, 'version': MODEL_VERSION, 'features': NUMERIC_FEATURES, 'alphas': ALPHAS}
+
+class FeeModel:
+    """
+    Ridge regression of log transfer fee on season stats, fitted in closed form.
+    Numeric features are imputed with their training mean, every column is
+    standardized with training statistics, and the intercept is not penalized.
+    """
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.competitions = []
+        self.fill = None        # training means of the raw numeric features, for imputation
+        self.center = None      # training mean and scale of every design column
+        self.scale = None
+        self.weights = None
+        self.intercept = 0.0
+
+    def design_matrix(self, stats):
+        """Raw design matrix: imputed numeric features and one-hot competitions"""
+        numeric = pd.concat([stats[['Age', '90s']].astype('float64'), per_90_frame(stats)], axis=1)[NUMERIC_FEATURES]
+        numeric = numeric.to_numpy(dtype='float64')
+        if self.fill is None:
+            self.fill = np.nan_to_num(np.nanmean(numeric, axis=0))
+        numeric = np.where(np.isnan(numeric), self.fill, numeric)
+
+        if not self.competitions:
+            self.competitions = sorted(stats['Comp'].astype('string').dropna().unique())
+        comp = pd.Categorical(stats['Comp'].astype('string'), categories=self.competitions).codes
+        one_hot = np.zeros((len(stats), len(self.competitions)))
+        known = comp >= 0
+        one_hot[np.flatnonzero(known), comp[known]] = 1.0
+        return np.hstack([numeric, one_hot])
+
+    def fit(self, stats, fees):
+        """Fit on player-season stats and their fees in euros"""
+        design = self.design_matrix(stats)
+        self.center = design.mean(axis=0)
+        self.scale = design.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        x = (design - self.center) / self.scale
+        y = np.log1p(np.asarray(fees, dtype='float64'))
+
+        # Closed-form ridge on centered data: (X'X + alpha I) w = X'(y - mean y)
+        self.intercept = y.mean()
+        gram = x.T @ x + self.alpha * np.eye(x.shape[1])
+        self.weights = np.linalg.solve(gram, x.T @ (y - self.intercept))
+        return self
+
+    def predict_log(self, stats):
+        x = (self.design_matrix(stats) - self.center) / self.scale
+        return x @ self.weights + self.intercept
+
+    def predict(self, stats):
+        """Predicted fee in euros for every row, as one matrix product"""
+        return np.expm1(self.predict_log(stats))
+
+    def save(self, path, data_hash):
+        np.savez(
+            path,
+            weights=self.weights, intercept=self.intercept, alpha=self.alpha,
+            fill=self.fill, center=self.center, scale=self.scale,
+            competitions=np.array(self.competitions, dtype=str),
+            metadata=json.dumps(model_metadata(data_hash)),
+        )
+
+    @classmethod
+    def load(cls, path, data_hash=None):
+        """Load a saved model; returns None if it is missing or was fitted on other data or features"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as saved:
+            metadata = json.loads(str(saved['metadata']))
+            if data_hash is not None and metadata != model_metadata(data_hash):
+                return None
+            model = cls(float(saved['alpha']))
+            model.weights = saved['weights']
+            model.intercept = float(saved['intercept'])
+            model.fill = saved['fill']
+            model.center = saved['center']
+            model.scale = saved['scale']
+            model.competitions = [str(comp) for comp in saved['competitions']]
+        return model
+
+def training_rows(dataset):
+    """Player-seasons with a paid transfer fee (loans, free and undisclosed fees carry no price)"""
+    if 'Recent Fee' not in dataset.columns:
+        raise SystemExit("goalkeeper_dataset has no Recent Fee column: run python -m aggregators.add_transfer_fees first")
+    paid = dataset['Recent Fee'] > 0
+    # Datasets written before fee kinds were recorded only hold paid fees as positive amounts
+    if 'Recent Fee Kind' in dataset.columns:
+        paid &= dataset['Recent Fee Kind'].astype('string') == 'paid'
+    return dataset[paid.fillna(False)].reset_index(drop=True)
+
+def data_hash(training):
+    """Content hash of the training rows and columns the model reads"""
+    columns = ['Player', 'Season', 'Comp', 'Age', '90s', 'Recent Fee'] + RATE_FEATURES + PER_90_FEATURES
+    row_hashes = pd.util.hash_pandas_object(training[columns], index=False).to_numpy()
+    return hashlib.sha256(row_hashes.tobytes()).hexdigest()
 
-print(df.head())
+def cross_validate(training, alphas=ALPHAS, folds=5, seed=0):
+    """Mean out-of-fold RMSE of log fee for each alpha"""
+    fold = np.random.default_rng(seed).permutation(len(training)) % folds
+    fees = training['Recent Fee'].to_numpy(dtype='float64')
+    errors = {}
+    for alpha in alphas:
+        squared = []
+        for k in range(folds):
+            train, test = fold != k, fold == k
+            model = FeeModel(alpha).fit(training[train], fees[train])
+            squared.append((model.predict_log(training[test]) - np.log1p(fees[test])) ** 2)
+        errors[alpha] = float(np.sqrt(np.concatenate(squared).mean()))
+    return errors
 
+def fit_or_load(dataset, path=MODEL_FILE):
+    """Reuse the saved model if it was fitted on identical training data, otherwise cross-validate and refit"""
+    training = training_rows(dataset)
+    digest = data_hash(training)
+    model = FeeModel.load(path, digest)
+    if model is not None:
+        print(f"Training data unchanged (hash {digest[:12]}), reusing {path}")
+        return model
 
+    print(f"Fitting fee model on {len(training)} player-seasons with a paid fee...")
+    errors = cross_validate(training)
+    for alpha, error in errors.items():
+        print(f"  alpha {alpha:>8g}: cross-validated RMSE {error:.3f} (log euros)")
+    best_alpha = min(errors, key=errors.get)
+    model = FeeModel(best_alpha).fit(training, training['Recent Fee'])
+    model.save(path, digest)
+    print(f"Saved model (alpha {best_alpha:g}) to {path}")
+    return model
 
+def main():
+    parser = argparse.ArgumentParser(description="Fit (or reuse) the fee model and value every player-season")
+    parser.add_argument('--retrain', action='store_true', help="refit even if the training data is unchanged")
+    parser.add_argument('--output', default=VALUATIONS_FILE, help="CSV to write predicted fees to")
+    args = parser.parse_args()
 
+    df = load_dataset('goalkeeper_dataset')
+    print(f"Loaded {len(df)} player-seasons from goalkeeper_dataset")
 
+    if args.retrain and os.path.exists(MODEL_FILE):
+        os.remove(MODEL_FILE)
+    model = fit_or_load(df)
 
+    # Score every player-season in one batch
+    valuations = df[[column for column in ['Player', 'Season', 'Squad', 'Comp', 'Age', 'Recent Fee', 'Recent Fee Kind']
+                     if column in df.columns]].copy()
+    valuations['Predicted Fee'] = model.predict(df).round(-3)
+    valuations.to_csv(args.output, index=False)
+    print(f"Saved {len(valuations)} valuations to {args.output}")
 
+    print(valuations.sort_values('Predicted Fee', ascending=False).head().to_string(index=False))
 
+if __name__ == "__main__":
+    main()
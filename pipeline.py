@@ -0,0 +1,213 @@
+"""
+End-to-end pipeline runner.
+
+Declares each step (scrapers, validation, aggregators, model) with the files it reads and
+writes, derives the dependency DAG from those files, runs independent stages in
+parallel and skips stages whose inputs have not changed since their last
+successful run. Data files are read and written in the working directory:
+
+    python pipeline.py                # run whatever is stale
+    python pipeline.py --force fees   # rerun one stage (and everything downstream)
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = '.pipeline_state.json'
+LOG_DIR = 'pipeline_logs'
+
+# Each stage's inputs and outputs are file patterns; a stage depends on every other stage
+# that outputs one of its inputs. Stages without inputs fetch from the network.
+STAGES = [
+    {
+        'name': 'stats',
+        'command': ['-m', 'scrapers.stat_scraper'],
+        'inputs': [],
+        'outputs': ['keepers_stats_*.csv'],
+    },
+    {
+        'name': 'transfers',
+        'command': ['-m', 'scrapers.transfer_scraper'],
+        'inputs': [],
+        'outputs': ['goalkeeper_transfers_*.csv'],
+    },
+    {
+        'name': 'market_values',
+        'command': ['-m', 'scrapers.market_value_scraper'],
+        'inputs': [],
+        'outputs': ['goalkeeper_market_values.csv'],
+    },
+    {
+        # Quarantines bad rows in place, so the aggregators depend on it through the files it rewrites
+        'name': 'validate',
+        'command': ['-m', 'validate'],
+        'inputs': ['keepers_stats_*.csv', 'goalkeeper_transfers_*.csv', 'goalkeeper_market_values.csv'],
+        'outputs': ['validation_report.json', 'keepers_stats_*.csv', 'goalkeeper_transfers_*.csv',
+                    'goalkeeper_market_values.csv'],
+    },
+    {
+        'name': 'aggregate',
+        'command': ['-m', 'aggregators.aggregate_keepers', '--incremental'],
+        'inputs': ['keepers_stats_*.csv'],
+        'outputs': ['goalkeeper_dataset.parquet', 'goalkeeper_dataset.csv'],
+    },
+    {
+        'name': 'fees',
+        'command': ['-m', 'aggregators.add_transfer_fees'],
+        'inputs': ['goalkeeper_dataset.parquet', 'goalkeeper_transfers_*.csv'],
+        'outputs': ['goalkeeper_dataset.parquet', 'goalkeeper_dataset.csv'],
+    },
+    {
+        'name': 'model',
+        'command': ['-m', 'model'],
+        'inputs': ['goalkeeper_dataset.parquet'],
+        'outputs': ['goalkeeper_valuations.csv'],
+    },
+]
+
+def build_dag(stages):
+    """Map each stage name to the set of stages it depends on, derived from inputs and outputs"""
+    producers = {}
+    for stage in stages:
+        for pattern in stage['outputs']:
+            producers.setdefault(pattern, []).append(stage['name'])
+
+    order = {stage['name']: i for i, stage in enumerate(stages)}
+    dependencies = {}
+    for stage in stages:
+        # Only earlier stages count, so a stage that rewrites its own input (fees) does not depend on itself
+        dependencies[stage['name']] = {
+            producer
+            for pattern in stage['inputs']
+            for producer in producers.get(pattern, [])
+            if order[producer] < order[stage['name']]
+        }
+    return dependencies
+
+def fingerprint(patterns):
+    """Content hash of every file matching the patterns (None if any pattern matches nothing)"""
+    digest = hashlib.sha256()
+    for pattern in patterns:
+        filenames = sorted(glob.glob(pattern))
+        if not filenames:
+            return None
+        for filename in filenames:
+            digest.update(filename.encode('utf-8'))
+            with open(filename, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def outputs_exist(stage):
+    return all(glob.glob(pattern) for pattern in stage['outputs'])
+
+def is_fresh(stage, state, max_age):
+    """A stage is fresh if its outputs exist and its inputs match the last successful run"""
+    previous = state.get(stage['name'])
+    if previous is None or not outputs_exist(stage):
+        return False
+    if not stage['inputs']:
+        # Scrapers read the network; rerun them once their outputs are older than max_age
+        return time.time() - previous['completed_at'] < max_age
+    return fingerprint(stage['inputs']) == previous['inputs']
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state):
+    with open(STATE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+def run_stage(stage):
+    """Run one stage as a subprocess, logging its output; returns (return code, seconds)"""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    start = time.perf_counter()
+    # Stage modules are imported from the repository root; data files live in the working directory
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    with open(os.path.join(LOG_DIR, f"{stage['name']}.log"), 'w', encoding='utf-8') as log:
+        result = subprocess.run([sys.executable] + stage['command'], stdout=log, stderr=subprocess.STDOUT, env=env)
+    return result.returncode, time.perf_counter() - start
+
+def run_pipeline(stages=STAGES, force=(), max_age=24 * 60 * 60, max_workers=3):
+    """
+    Run stale stages in dependency order, independent stages in parallel.
+    Stages downstream of a failure are skipped; everything that succeeded is recorded,
+    so the next run resumes where this one stopped. Returns True if no stage failed.
+    """
+    dependencies = build_dag(stages)
+    by_name = {stage['name']: stage for stage in stages}
+    state = load_state()
+
+    forced = set(force)
+    status = {}     # name -> 'ran', 'skipped', 'failed' or 'blocked'
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(status) < len(stages):
+            for name, stage in by_name.items():
+                if name in status or name in running.values():
+                    continue
+                upstream = [status.get(dependency) for dependency in dependencies[name]]
+                if any(result in ('failed', 'blocked') for result in upstream):
+                    status[name] = 'blocked'
+                    print(f"[{name}] blocked by an upstream failure")
+                    continue
+                if any(result is None for result in upstream):
+                    continue
+
+                # A stage is forced if asked for directly or if anything upstream actually ran
+                rerun = name in forced or any(status[dependency] == 'ran' for dependency in dependencies[name])
+                if not rerun and is_fresh(stage, state, max_age):
+                    status[name] = 'skipped'
+                    print(f"[{name}] up to date, skipping")
+                    continue
+
+                print(f"[{name}] running: {' '.join(stage['command'])}")
+                running[executor.submit(run_stage, stage)] = name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                returncode, seconds = future.result()
+                metrics.observe('pipeline_stage_seconds', seconds, stage=name, result='ran' if returncode == 0 else 'failed')
+                if returncode == 0:
+                    status[name] = 'ran'
+                    state[name] = {'completed_at': time.time(), 'inputs': fingerprint(by_name[name]['inputs'])}
+                    save_state(state)
+                    print(f"[{name}] finished in {seconds:.1f}s")
+                else:
+                    status[name] = 'failed'
+                    print(f"[{name}] failed with exit code {returncode} after {seconds:.1f}s, see {LOG_DIR}/{name}.log")
+
+    for name, result in status.items():
+        metrics.set_gauge('pipeline_stage_status', 1, stage=name, status=result)
+    return 'failed' not in status.values()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the scrape -> aggregate -> model pipeline")
+    parser.add_argument('--force', nargs='*', default=[], choices=[stage['name'] for stage in STAGES],
+                        help="stages to rerun even if they are up to date")
+    parser.add_argument('--max-age', type=float, default=24, help="hours before scraper output is refreshed")
+    parser.add_argument('--workers', type=int, default=3, help="stages to run in parallel")
+    args = parser.parse_args()
+
+    ok = run_pipeline(force=args.force, max_age=args.max_age * 60 * 60, max_workers=args.workers)
+    metrics.write_report('pipeline')
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Career rollups: per-player aggregates materialized in the local store.
+
+The rollups table holds, for every player, career totals, the same totals over their
+last three seasons, and one row per club they kept goal for. Counting stats are summed
+and rate stats are re-derived from their weights (PSxG+/- per 90 from 90s, Cmp% from
+launched attempts, Stp% from crosses faced, ...), never averaged across seasons.
+
+Triggers on the stats and transfers tables mark every player whose rows change, so a
+refresh only recomputes those players, however long the history is:
+
+    python rollups.py --refresh
+    python rollups.py --player "David Raya"
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from store import ID_BATCH, Store, quote, sql_rows
+
+# Counting stats, summed over seasons
+SUM_COLUMNS = [
+    '90s', 'GA', 'PKA', 'FK', 'CK', 'OG', 'PSxG', 'PSxG+/-', 'Cmp', 'Att',
+    'Att (GK)', 'Thr', 'Att.1', 'Opp', 'Stp', '#OPA',
+]
+
+# Rate stats and the column they are weighted by: rollup rate = sum(rate * weight) / sum(weight).
+# 'SoT' (shots on target) is not scraped and is derived as PSxG / (PSxG/SoT)
+WEIGHTED_COLUMNS = {
+    '/90': '90s',
+    '#OPA/90': '90s',
+    'PSxG/SoT': 'SoT',
+    'Cmp%': 'Att',
+    'Launch%': 'Att (GK)',
+    'AvgLen': 'Att (GK)',
+    'Launch%.1': 'Att.1',
+    'AvgLen.1': 'Att.1',
+    'Stp%': 'Opp',
+    'AvgDist': '#OPA',
+}
+
+# Rollup scopes: the whole career, the player's three most recent seasons, and each club
+SCOPES = ['career', 'last_3', 'club']
+RECENT_SEASONS = 3
+
+# Rollup row identity, then descriptive columns, then the stats
+KEY_COLUMNS = ['player_id', 'Scope', 'Squad']
+INFO_COLUMNS = ['Player', 'Seasons', 'First Season', 'Last Season', 'Latest Squad', 'Transfers', 'Paid Fees']
+ROLLUP_COLUMNS = KEY_COLUMNS + INFO_COLUMNS + SUM_COLUMNS + list(WEIGHTED_COLUMNS)
+TEXT_COLUMNS = {'Scope', 'Squad', 'Player', 'First Season', 'Last Season', 'Latest Squad'}
+INTEGER_COLUMNS = {'player_id', 'Seasons', 'Transfers'}
+
+# Columns of each store table the rollups are computed from
+TRIGGER_COLUMNS = {
+    'stats': ['player_id', 'Player', 'Season', 'Squad'] + SUM_COLUMNS + list(WEIGHTED_COLUMNS),
+    'transfers': ['player_id', 'Fee', 'Fee Kind'],
+}
+
+def season_start(seasons):
+    return pd.to_numeric(seasons.astype('string').str[:4], errors='coerce')
+
+def summarize(stats, by):
+    """Sums, weighted rates and season span of stats rows grouped by the given columns"""
+    weights = stats[SUM_COLUMNS].astype('float64')
+    weights['SoT'] = stats['PSxG'].astype('float64') / stats['PSxG/SoT'].astype('float64').where(lambda rate: rate > 0)
+    weighted = pd.DataFrame({rate: stats[rate].astype('float64') * weights[weight]
+                             for rate, weight in WEIGHTED_COLUMNS.items()}, index=stats.index)
+    # A rate only counts where both it and its weight are known
+    used_weights = pd.DataFrame({rate: weights[weight].where(weighted[rate].notna())
+                                 for rate, weight in WEIGHTED_COLUMNS.items()}, index=stats.index)
+
+    keys = [stats[column] for column in by]
+    sums = weights[SUM_COLUMNS].groupby(keys, sort=False).sum(min_count=1)
+    rates = weighted.groupby(keys, sort=False).sum(min_count=1) / used_weights.groupby(keys, sort=False).sum(min_count=1)
+
+    # Newest season first, so 'first' of the group is the latest row
+    ordered = stats.assign(season_start=season_start(stats['Season'])).sort_values('season_start', ascending=False, kind='stable')
+    grouped = ordered.groupby([ordered[column] for column in by], sort=False)
+    info = pd.DataFrame({
+        'Player': grouped['Player'].first(),
+        'Seasons': grouped['Season'].nunique(),
+        'First Season': grouped['Season'].last(),
+        'Last Season': grouped['Season'].first(),
+        'Latest Squad': grouped['Squad'].first(),
+    })
+    return pd.concat([info, sums, rates.replace([np.inf, -np.inf], np.nan).round(2)], axis=1).reset_index()
+
+def compute_rollups(stats, transfers):
+    """All rollup rows for the players in `stats`, with transfer counts and paid fees from `transfers`"""
+    if stats.empty:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    stats = stats.assign(Season=stats['Season'].astype('string'), Squad=stats['Squad'].astype('string'))
+
+    career = summarize(stats, ['player_id']).assign(Scope='career', Squad='')
+
+    # Each player's three most recent seasons (a season at two clubs counts once)
+    recency = season_start(stats['Season']).groupby(stats['player_id']).rank(method='dense', ascending=False)
+    last_3 = summarize(stats[recency <= RECENT_SEASONS], ['player_id']).assign(Scope='last_3', Squad='')
+
+    clubs = summarize(stats, ['player_id', 'Squad']).assign(Scope='club')
+
+    paid = transfers['Fee Kind'].astype('string') == 'paid'
+    transfer_totals = pd.DataFrame({
+        'Transfers': transfers.groupby('player_id').size(),
+        'Paid Fees': transfers['Fee'].where(paid.fillna(False)).groupby(transfers['player_id']).sum(min_count=1),
+    })
+    career = career.join(transfer_totals, on='player_id')
+    career['Transfers'] = career['Transfers'].fillna(0).astype('int64')
+
+    return pd.concat([career, last_3, clubs], ignore_index=True).reindex(columns=ROLLUP_COLUMNS)
+
+def ensure_tables(store):
+    """Create the rollups table, the dirty-player queue and the triggers that fill it"""
+    columns = ', '.join(f"{quote(column)} {'INTEGER' if column in INTEGER_COLUMNS else 'TEXT' if column in TEXT_COLUMNS else 'REAL'}"
+                        for column in ROLLUP_COLUMNS)
+    with store.connection:
+        store.connection.execute(f"CREATE TABLE IF NOT EXISTS rollups ({columns}, PRIMARY KEY (player_id, Scope, Squad))")
+        store.connection.execute('CREATE INDEX IF NOT EXISTS rollups_scope ON rollups (Scope, player_id)')
+        store.connection.execute('CREATE TABLE IF NOT EXISTS rollup_dirty (player_id INTEGER PRIMARY KEY)')
+        for table, columns in TRIGGER_COLUMNS.items():
+            # Updates only mark the player when a column the rollups read changes (not e.g. Recent Fee)
+            watched = ', '.join(quote(column) for column in columns)
+            for event, rows in [('INSERT', ['NEW']), (f"UPDATE OF {watched}", ['OLD', 'NEW']), ('DELETE', ['OLD'])]:
+                # Not INSERT OR IGNORE: inside a trigger SQLite applies the outer statement's conflict
+                # policy instead, so the store's upserts would fail on an already dirty player
+                marks = ' '.join(f"INSERT INTO rollup_dirty (player_id) VALUES ({row}.player_id) "
+                                 f"ON CONFLICT (player_id) DO NOTHING;" for row in rows)
+                name = f"{table}_rollup_{event.split()[0].lower()}"
+                sql = f"CREATE TRIGGER {name} AFTER {event} ON {table} BEGIN {marks} END"
+                existing = store.connection.execute(
+                    "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", [name]).fetchone()
+                # Stores made with an older trigger body get the current one
+                if existing is None or existing[0] != sql:
+                    store.connection.execute(f"DROP TRIGGER IF EXISTS {name}")
+                    store.connection.execute(sql)
+
+def batches(ids, size=ID_BATCH):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def refresh_rollups(store):
+    """
+    Recompute the rollups of every player marked dirty since the last refresh (all players
+    the first time) and clear their marks, as one transaction so no concurrent change is lost.
+    Returns the number of players refreshed.
+    """
+    ensure_tables(store)
+    connection = store.connection
+    with metrics.timer('rollup_refresh_seconds'):
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if connection.execute('SELECT COUNT(*) FROM rollups').fetchone()[0] == 0:
+                # First build: the triggers did not exist when the stats were written
+                connection.execute('INSERT OR IGNORE INTO rollup_dirty (player_id) SELECT DISTINCT player_id FROM stats')
+            dirty = [row[0] for row in connection.execute('SELECT player_id FROM rollup_dirty ORDER BY player_id')]
+            for ids in batches(dirty):
+                placeholders = ', '.join('?' for _ in ids)
+                rollups = compute_rollups(store.read('stats', player_ids=ids), store.read('transfers', player_ids=ids))
+                connection.execute(f"DELETE FROM rollups WHERE player_id IN ({placeholders})", ids)
+                connection.executemany(
+                    f"INSERT INTO rollups ({', '.join(quote(column) for column in ROLLUP_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in ROLLUP_COLUMNS)})",
+                    sql_rows(rollups, ROLLUP_COLUMNS),
+                )
+                connection.execute(f"DELETE FROM rollup_dirty WHERE player_id IN ({placeholders})", ids)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+    metrics.count('rollup_players_refreshed_total', len(dirty))
+    print(f"Refreshed rollups for {len(dirty)} players")
+    return len(dirty)
+
+def read_rollups(store, scope='career', player_ids=None):
+    """Rollup rows of one scope, optionally for some players only"""
+    query = "SELECT * FROM rollups WHERE Scope = ?"
+    params = [scope]
+    if player_ids is not None:
+        query += f" AND player_id IN ({', '.join('?' for _ in player_ids)})"
+        params.extend(int(player_id) for player_id in player_ids)
+    return pd.read_sql_query(query, store.connection, params=params)
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh or look up the materialized career rollups")
+    parser.add_argument('--refresh', action='store_true', help="recompute the rollups of players whose rows changed")
+    parser.add_argument('--player', help="show every rollup of one player (exact name)")
+    parser.add_argument('--scope', default='career', choices=SCOPES, help="scope to list when no player is given")
+    parser.add_argument('--top', type=int, default=10, help="rows to list, by 90s played")
+    args = parser.parse_args()
+
+    with Store() as store:
+        ensure_tables(store)
+        if args.refresh:
+            refresh_rollups(store)
+        if args.player:
+            rollups = pd.read_sql_query('SELECT * FROM rollups WHERE Player = ? ORDER BY Scope, "90s" DESC',
+                                        store.connection, params=[args.player])
+        else:
+            rollups = read_rollups(store, args.scope).sort_values('90s', ascending=False).head(args.top)
+        print(rollups[['Player', 'Scope', 'Squad', 'Seasons', '90s', 'GA', '/90', 'PSxG/SoT', 'Cmp%', 'Stp%']]
+              .to_string(index=False))
+
+if __name__ == "__main__":
+    main()
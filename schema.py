@@ -0,0 +1,90 @@
+import pandas as pd
+
+from fees import normalize_fees
+
+# fbref advanced goalkeeping stats: every column after Born is a per-season number
+STAT_COLUMNS = [
+    '90s', 'GA', 'PKA', 'FK', 'CK', 'OG', 'PSxG', 'PSxG/SoT', 'PSxG+/-', '/90',
+    'Cmp', 'Att', 'Cmp%', 'Att (GK)', 'Thr', 'Launch%', 'AvgLen', 'Att.1', 'Launch%.1', 'AvgLen.1',
+    'Opp', 'Stp', 'Stp%', '#OPA', '#OPA/90', 'AvgDist',
+]
+
+KEEPER_STATS_SCHEMA = {
+    'Player': 'string',
+    'Season': 'category',
+    'Nation': 'category',
+    'Pos': 'category',
+    'Squad': 'category',
+    'Comp': 'category',
+    'Age': 'Int16',
+    'Born': 'Int16',
+    **{column: 'float32' for column in STAT_COLUMNS},
+    'fbref ID': 'string',
+}
+
+# Schema registry: dataset name -> {column: dtype}
+SCHEMAS = {
+    'keepers_stats': KEEPER_STATS_SCHEMA,
+    'goalkeeper_dataset': {**KEEPER_STATS_SCHEMA, 'Recent Fee': 'float64', 'Recent Fee Kind': 'category'},
+    'goalkeeper_transfers': {
+        'Player': 'string',
+        'Player ID': 'string',
+        'Age': 'Int16',
+        'Season': 'category',
+        'Nationality': 'category',
+        'Team Left': 'category',
+        'Team Joined': 'category',
+        'Fee': 'float64',
+        'Fee Kind': 'category',
+    },
+    'goalkeeper_market_values': {
+        'Rank': 'Int16',
+        'Player': 'string',
+        'Player ID': 'string',
+        'Age': 'Int16',
+        'Nationality': 'category',
+        'Club': 'category',
+        'Market Value': 'float64',
+        'Market Value Kind': 'category',
+    },
+}
+
+# Money columns (in euros) and the kind column written next to them by normalize_fees.
+# Files without the kind column predate normalization and still hold raw text or bare millions
+MONEY_COLUMNS = {
+    'goalkeeper_dataset': {'Recent Fee': 'Recent Fee Kind'},
+    'goalkeeper_transfers': {'Fee': 'Fee Kind'},
+    'goalkeeper_market_values': {'Market Value': 'Market Value Kind'},
+}
+
+def get_schema(name):
+    """Look up a dataset's schema by name"""
+    if name not in SCHEMAS:
+        raise KeyError(f"Unknown dataset '{name}'. Known datasets: {', '.join(sorted(SCHEMAS))}")
+    return SCHEMAS[name]
+
+def apply_schema(df, name):
+    """
+    Cast a DataFrame's columns to the dtypes registered for the dataset.
+    Columns missing from the schema are left untouched; numeric columns are parsed
+    leniently so stray text becomes a missing value instead of an error, and money
+    columns from files written before fee normalization are normalized to euros.
+    """
+    schema = get_schema(name)
+    df = df.copy()
+    for column, kind_column in MONEY_COLUMNS.get(name, {}).items():
+        if column in df.columns and kind_column not in df.columns:
+            normalized = normalize_fees(df[column])
+            df[column] = normalized['euros']
+            df.insert(df.columns.get_loc(column) + 1, kind_column, normalized['kind'])
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        series = df[column]
+        if column == 'Age' and not pd.api.types.is_numeric_dtype(series):
+            # fbref gives current-season ages as "years-days", e.g. "26-123"
+            series = series.astype('string').str.split('-').str[0]
+        if dtype.startswith(('Int', 'float')):
+            series = pd.to_numeric(series, errors='coerce')
+        df[column] = series.astype(dtype)
+    return df
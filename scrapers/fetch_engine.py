@@ -0,0 +1,320 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+import metrics
+
+# Responses worth retrying: throttling, and server errors that are usually transient
+THROTTLE_STATUSES = {429, 503}
+RETRY_STATUSES = THROTTLE_STATUSES | {500, 502, 504}
+
+# AIMD: each success adds AIMD_INCREASE requests/second to a host's rate, each throttle multiplies it by AIMD_DECREASE
+AIMD_INCREASE = 0.05
+AIMD_DECREASE = 0.5
+
+# Longest a Retry-After header is honoured for, and the ceiling for timeouts that grow after a timed out attempt
+MAX_RETRY_AFTER = 600
+MAX_TIMEOUT = 60
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delay in seconds or an HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `burst` tokens"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        """Change the refill rate, crediting tokens earned at the old rate first"""
+        with self.lock:
+            self.refill()
+            self.rate = float(rate)
+
+    def acquire(self):
+        """Block until a token is available, then consume it"""
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostController:
+    """
+    Request controller for one host.
+    The token bucket's rate follows AIMD: it creeps up after every success (up to
+    max_rate) and halves on a 429/503, so throughput settles just under what the
+    host tolerates. A Retry-After pauses every request to the host, and a circuit
+    breaker holds requests back after `failure_threshold` consecutive failures
+    (throttles only slow the host down, they are not failures), letting a single
+    trial request through once `cooldown` seconds have passed.
+    """
+
+    def __init__(self, host, rate, burst, min_rate, max_rate, failure_threshold=5, cooldown=60):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.rate)
+        self.max_rate = max(float(max_rate), self.rate)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def wait_for_circuit(self):
+        """
+        Block while the circuit is open. Once the cooldown is over one trial request
+        goes through, and other requests wait for its outcome instead of failing.
+        """
+        while True:
+            with self.lock:
+                if self.opened_at is None:
+                    return
+                wait = self.opened_at + self.cooldown - time.monotonic()
+                if wait <= 0 and not self.trial_in_flight:
+                    self.trial_in_flight = True
+                    return
+            time.sleep(max(wait, 0.05))
+
+    def acquire(self):
+        """Wait out any Retry-After pause, then take a token from the bucket"""
+        while True:
+            with self.lock:
+                wait = self.paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        self.bucket.acquire()
+
+    def set_rate(self, rate):
+        self.rate = rate
+        self.bucket.set_rate(rate)
+        metrics.set_gauge('http_host_rate', rate, host=self.host)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+            if self.rate < self.max_rate:
+                self.set_rate(min(self.max_rate, self.rate + AIMD_INCREASE))
+
+    def record_failure(self, throttled=False, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            if throttled:
+                # Halve at most once per request interval, so a burst of 429s from
+                # requests already in flight counts as a single congestion signal
+                if now - self.last_decrease >= 1 / self.rate:
+                    self.set_rate(max(self.min_rate, self.rate * AIMD_DECREASE))
+                    self.last_decrease = now
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+
+                # A throttle is the host answering, and slowing down is handled above, so it is not a
+                # breaker failure; a throttled half-open trial closes the circuit again
+                if self.trial_in_flight:
+                    self.opened_at = None
+                    self.trial_in_flight = False
+                return
+
+            self.failures += 1
+            # A failed half-open trial reopens the circuit straight away
+            if self.failures >= self.failure_threshold or self.trial_in_flight:
+                if self.opened_at is None or self.trial_in_flight:
+                    print(f"Circuit open for {self.host} after {self.failures} consecutive failures, "
+                          f"pausing requests for {self.cooldown}s")
+                    metrics.count('http_circuit_opened_total', host=self.host)
+                self.opened_at = now
+                self.trial_in_flight = False
+
+
+class FetchEngine:
+    """
+    Shared fetch engine for the scrapers.
+    Requests run on a bounded thread pool, and every request first takes a token
+    from its host's bucket, so the politeness budget is spent on requests instead
+    of on a fixed sleep after each one. Throttled and transient failures are retried
+    with exponential backoff and jitter (honouring Retry-After), each host's rate
+    adapts between rate / 8 and max_rate, and a per-host circuit breaker stops
+    hammering a host that keeps failing.
+    """
+
+    def __init__(self, headers=None, max_workers=4, rate=1.0, burst=1, host_limits=None, timeout=10, cache=None,
+                 max_rate=None, retries=4, throttle_retries=20, backoff=1.0, max_backoff=60, failure_threshold=5,
+                 cooldown=60):
+        self.headers = headers or {}
+        self.max_workers = max_workers
+        self.rate = rate
+        self.burst = burst
+        # Ceiling for the adaptive rate; pass max_rate=rate to keep a fixed rate
+        self.max_rate = max_rate or rate * 4
+        # Per-host overrides, e.g. {"fbref.com": (0.5, 1)} as (requests per second, burst); these rates never increase
+        self.host_limits = host_limits or {}
+        self.timeout = timeout
+        self.retries = retries
+        self.throttle_retries = throttle_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        # Optional ResponseCache; fresh hits skip the network and the rate limit entirely
+        self.cache = cache
+        self.controllers = {}
+        self.controllers_lock = threading.Lock()
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def get_session(self):
+        """Return this thread's session (requests.Session is not safe to share across threads)"""
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self.local.session = session
+        return session
+
+    def get_controller(self, url):
+        """Return the request controller for the host of the given URL"""
+        host = urlparse(url).netloc
+        with self.controllers_lock:
+            controller = self.controllers.get(host)
+            if controller is None:
+                rate, burst = self.host_limits.get(host, (self.rate, self.burst))
+                max_rate = rate if host in self.host_limits else self.max_rate
+                controller = HostController(host, rate, burst, rate / 8, max_rate,
+                                            self.failure_threshold, self.cooldown)
+                self.controllers[host] = controller
+            return controller
+
+    def backoff_delay(self, attempt):
+        """Exponential backoff with jitter: somewhere between half and all of backoff * 2^attempt"""
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def fetch(self, url):
+        """
+        Fetch a single page under the host's rate limit, returning its text or None on error.
+        5xx responses, timeouts and connection errors are retried up to `retries` times, and
+        429/503 throttles up to `throttle_retries` times, since the host is up and only pacing us.
+        """
+        host = urlparse(url).netloc
+        entry = self.cache.lookup(url) if self.cache else None
+        cached_body = self.cache.read_body(entry) if entry else None
+        if cached_body is not None and self.cache.is_fresh(entry):
+            metrics.count('http_cache_hits_total', host=host)
+            return cached_body
+
+        # Stale entries are revalidated with a conditional request
+        headers = self.cache.conditional_headers(entry) if cached_body is not None else {}
+        controller = self.get_controller(url)
+        timeout = self.timeout
+        failures = throttles = 0
+
+        while True:
+            # An open circuit holds the request until the cooldown is over and a trial has gone through
+            controller.wait_for_circuit()
+            controller.acquire()
+            # Latency is recorded per status (the exception name when no response came back)
+            status = 'error'
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                response = self.get_session().get(url, timeout=timeout, headers=headers)
+                status = response.status_code
+                metrics.count('http_response_bytes_total', len(response.content), host=host)
+                if status in RETRY_STATUSES:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                else:
+                    # Anything else is a healthy host, even a 404 for this URL
+                    controller.record_success()
+                    if status == 304 and cached_body is not None:
+                        self.cache.touch(url)
+                        return cached_body
+                    response.raise_for_status()
+                    if self.cache:
+                        self.cache.store(url, response.text, response.headers)
+                    return response.text
+            except (requests.ConnectionError, requests.Timeout) as e:
+                status = type(e).__name__
+                if isinstance(e, requests.Timeout):
+                    timeout = min(timeout * 2, MAX_TIMEOUT)
+            except requests.RequestException as e:
+                # Not retried (redirect loops, broken bodies, bad URLs); a 4xx was already counted as a success,
+                # anything else is a failure, so a half-open trial is always settled
+                if not isinstance(e, requests.HTTPError):
+                    controller.record_failure()
+                print(f"Error fetching {url}: {e}")
+                return None
+            except BaseException:
+                # Likewise for anything unexpected: an unsettled trial would leave the host's requests waiting forever
+                controller.record_failure()
+                raise
+            finally:
+                metrics.observe('http_request_seconds', time.perf_counter() - start, host=host, status=status)
+
+            throttled = status in THROTTLE_STATUSES
+            controller.record_failure(throttled=throttled, retry_after=retry_after)
+            if throttled:
+                throttles += 1
+                attempt, budget = throttles, self.throttle_retries
+            else:
+                failures += 1
+                attempt, budget = failures, self.retries
+            if attempt > budget:
+                break
+            delay = max(retry_after or 0, self.backoff_delay(attempt - 1))
+            print(f"Retrying {url} in {delay:.1f}s after {status} (retry {attempt} of {budget})")
+            metrics.count('http_retries_total', host=host, status=status)
+            time.sleep(delay)
+
+        print(f"Error fetching {url}: giving up after {failures + throttles} attempts (last status {status})")
+        return None
+
+    def submit(self, url):
+        """Schedule a fetch on the pool and return its future"""
+        return self.executor.submit(self.fetch, url)
+
+    def fetch_many(self, urls):
+        """Fetch all URLs concurrently, yielding (url, text) pairs as pages finish"""
+        futures = {self.submit(url): url for url in urls}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def close(self):
+        """Shut down the worker pool"""
+        self.executor.shutdown(wait=True)
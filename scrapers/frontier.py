@@ -0,0 +1,500 @@
+"""
+Persistent crawl frontier: a durable work queue of scrape tasks in an SQLite file.
+
+Every task is one page of one source: (source, season, competition, position, page).
+Workers lease a task, fetch and parse its page, and complete it together with the
+parsed rows in one transaction; a full Transfermarkt page queues the next page as it
+completes. Leases expire, so the tasks of a killed worker go back to the queue, and
+failed tasks are retried with backoff up to MAX_ATTEMPTS times. The politeness budget
+of each site is shared by every worker through the same file.
+
+Workers only write to the frontier. Once a source's tasks are done, `export` writes
+the usual CSV files and store rows from the collected pages in one process (player
+IDs are assigned under the player index's lock, as by every store writer):
+
+    python -m scrapers.frontier seed --first-season 2015-2016 --last-season 2024-2025
+    python -m scrapers.frontier work --processes 4
+    python -m scrapers.frontier status
+    python -m scrapers.frontier export
+
+Workers on other hosts can share the frontier file, as long as it sits on storage
+with working file locks (SQLite over NFS is not safe) and the hosts' clocks agree.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+from io import StringIO
+
+import pandas as pd
+
+import metrics
+from market_value_history import MarketValueHistory
+from schema import apply_schema
+from scrapers.market_value_scraper import MARKET_VALUES_URL, GoalkeeperMarketValueScraper
+from scrapers.stat_scraper import (COMPETITIONS, clean_keeper_table, current_season, keeper_stats_engine,
+                                   keeper_stats_url, parse_keeper_table, save_season_stats, season_range)
+from scrapers.transfer_scraper import GOALKEEPER_POSITION, MultiSeasonTransfermarktScraper, season_entries, unique_transfers
+from store import Store
+
+FRONTIER_FILE = 'crawl_frontier.db'
+
+SOURCES = ['keeper_stats', 'transfers', 'market_values']
+
+# Seconds between requests to each site, shared by all workers
+SOURCE_INTERVALS = {'keeper_stats': 6.0, 'transfers': 1.0, 'market_values': 1.0}
+# Throttle key of each source: Transfermarkt's two lists share one budget
+SOURCE_HOSTS = {'keeper_stats': 'fbref.com', 'transfers': 'www.transfermarkt.us', 'market_values': 'www.transfermarkt.us'}
+
+# A leased task not completed within this many seconds goes back to the queue
+LEASE_SECONDS = 600
+
+# Attempts before a task is marked failed, and the backoff before the first retry (doubling after each)
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 30
+
+# How long an idle worker waits before looking for work again
+POLL_SECONDS = 5
+
+# Rows per page of the Transfermarkt lists; a full page means there may be another one
+PAGE_ROWS = 25
+
+KEY_COLUMNS = ['source', 'season', 'competition', 'position', 'page']
+BUSY_TIMEOUT = 30
+
+class Frontier:
+    """
+    SQLite work queue of page tasks. Task status goes pending -> leased -> done, or back to
+    pending when a lease expires or an attempt fails, and to failed after MAX_ATTEMPTS.
+    Every state change is one short transaction, so any number of processes can share it.
+    """
+
+    def __init__(self, path=FRONTIER_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.row_factory = sqlite3.Row
+        self.create_tables()
+
+    def create_tables(self):
+        key = ', '.join(KEY_COLUMNS)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            'source TEXT NOT NULL, season TEXT NOT NULL, competition TEXT NOT NULL, position TEXT NOT NULL, '
+            'page INTEGER NOT NULL, url TEXT NOT NULL, base_url TEXT NOT NULL, max_pages INTEGER NOT NULL, '
+            "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+            'available_at REAL NOT NULL DEFAULT 0, lease_owner TEXT, lease_expires REAL, '
+            f'error TEXT, row_count INTEGER, updated_at REAL, PRIMARY KEY ({key}))'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, available_at)')
+        # Parsed rows of each completed page, as CSV text
+        self.connection.execute(f'CREATE TABLE IF NOT EXISTS results ({key}, rows TEXT NOT NULL, PRIMARY KEY ({key}))')
+        # Earliest time of the next request to each site
+        self.connection.execute('CREATE TABLE IF NOT EXISTS throttle (host TEXT PRIMARY KEY, next_at REAL NOT NULL)')
+
+    def transaction(self):
+        """BEGIN IMMEDIATE takes the write lock up front, so two workers never lease the same task"""
+        return Transaction(self.connection)
+
+    def add(self, tasks):
+        """Queue tasks (dicts with the key columns, url, base_url and max_pages); known tasks are left alone"""
+        with self.transaction():
+            return self.insert_tasks(tasks)
+
+    def insert_tasks(self, tasks):
+        """Insert new tasks inside the caller's transaction; returns how many were new"""
+        columns = KEY_COLUMNS + ['url', 'base_url', 'max_pages']
+        before = self.connection.total_changes
+        self.connection.executemany(
+            f"INSERT OR IGNORE INTO tasks ({', '.join(columns)}, updated_at) VALUES ({', '.join('?' for _ in columns)}, ?)",
+            [[task[column] for column in columns] + [time.time()] for task in tasks],
+        )
+        return self.connection.total_changes - before
+
+    def lease(self, owner, sources=SOURCES, lease_seconds=LEASE_SECONDS):
+        """Lease the next available task of the given sources to owner, or return None"""
+        now = time.time()
+        placeholders = ', '.join('?' for _ in sources)
+        with self.transaction():
+            # Tasks whose worker died go back to the queue (or fail, if that was their last attempt)
+            self.connection.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = 'lease expired', lease_owner = NULL, updated_at = ? "
+                "WHERE status = 'leased' AND lease_expires < ?",
+                (MAX_ATTEMPTS, now, now),
+            )
+            row = self.connection.execute(
+                f"SELECT * FROM tasks WHERE status = 'pending' AND available_at <= ? AND source IN ({placeholders}) "
+                "ORDER BY available_at, page, rowid LIMIT 1",
+                (now, *sources),
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                f"UPDATE tasks SET status = 'leased', attempts = attempts + 1, lease_owner = ?, lease_expires = ?, "
+                f"updated_at = ? WHERE {' AND '.join(f'{column} = ?' for column in KEY_COLUMNS)}",
+                (owner, now + lease_seconds, now, *(row[column] for column in KEY_COLUMNS)),
+            )
+        task = dict(row)
+        task['attempts'] += 1
+        return task
+
+    def finish(self, task, owner, status, **values):
+        """Move a task leased by owner to status; False if the lease was lost to another worker meanwhile"""
+        assignments = ', '.join(f"{column} = ?" for column in values)
+        updated = self.connection.execute(
+            f"UPDATE tasks SET status = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?, {assignments} "
+            f"WHERE {' AND '.join(f'{column} = ?' for column in KEY_COLUMNS)} AND status = 'leased' AND lease_owner = ?",
+            (status, time.time(), *values.values(), *(task[column] for column in KEY_COLUMNS), owner),
+        ).rowcount
+        return updated == 1
+
+    def complete(self, task, owner, rows, row_count, next_task=None):
+        """Mark a task done, storing its parsed rows (CSV text) and queueing the next page, as one transaction"""
+        with self.transaction() as transaction:
+            if not self.finish(task, owner, 'done', error=None, row_count=row_count):
+                transaction.rollback()
+                return False
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO results ({', '.join(KEY_COLUMNS)}, rows) VALUES ({', '.join('?' for _ in KEY_COLUMNS)}, ?)",
+                (*(task[column] for column in KEY_COLUMNS), rows),
+            )
+            if next_task is not None:
+                self.insert_tasks([next_task])
+        metrics.count('frontier_tasks_total', source=task['source'], status='done')
+        return True
+
+    def fail(self, task, owner, error):
+        """Record a failed attempt: retry after a backoff, or mark the task failed after MAX_ATTEMPTS"""
+        final = task['attempts'] >= MAX_ATTEMPTS
+        retry_at = time.time() + RETRY_BACKOFF * 2 ** (task['attempts'] - 1)
+        with self.transaction():
+            self.finish(task, owner, 'failed' if final else 'pending', error=error, available_at=retry_at)
+        print(f"{describe(task)} failed (attempt {task['attempts']} of {MAX_ATTEMPTS}): {error}")
+        metrics.count('frontier_tasks_total', source=task['source'], status='failed' if final else 'retried')
+
+    def release(self, task, owner):
+        """Hand a leased task back untouched (e.g. on shutdown), without counting the attempt"""
+        with self.transaction():
+            self.finish(task, owner, 'pending', attempts=task['attempts'] - 1)
+
+    def retry_failed(self, sources=SOURCES):
+        """Queue failed tasks again with fresh attempts; returns how many"""
+        with self.transaction():
+            return self.connection.execute(
+                f"UPDATE tasks SET status = 'pending', attempts = 0, available_at = 0, updated_at = ? "
+                f"WHERE status = 'failed' AND source IN ({', '.join('?' for _ in sources)})",
+                (time.time(), *sources),
+            ).rowcount
+
+    def reserve_request(self, host, interval):
+        """Reserve the next request slot for a site, returning how many seconds to wait for it"""
+        now = time.time()
+        with self.transaction():
+            row = self.connection.execute('SELECT next_at FROM throttle WHERE host = ?', (host,)).fetchone()
+            slot = max(now, row['next_at'] if row else now)
+            self.connection.execute('INSERT OR REPLACE INTO throttle (host, next_at) VALUES (?, ?)', (host, slot + interval))
+        return slot - now
+
+    def unfinished(self, sources=SOURCES):
+        """Number of tasks of the given sources that are still pending or leased"""
+        return self.connection.execute(
+            f"SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased') AND source IN ({', '.join('?' for _ in sources)})",
+            sources,
+        ).fetchone()[0]
+
+    def status(self):
+        """Task counts per source, season and status"""
+        return pd.read_sql_query(
+            'SELECT source, season, status, COUNT(*) AS tasks, SUM(row_count) AS rows FROM tasks '
+            'GROUP BY source, season, status ORDER BY source, season DESC, status',
+            self.connection,
+        )
+
+    def seasons(self, source):
+        """{season: number of unfinished tasks} for a source"""
+        rows = self.connection.execute(
+            "SELECT season, SUM(status IN ('pending', 'leased', 'failed')) FROM tasks WHERE source = ? GROUP BY season",
+            (source,),
+        )
+        return {season: unfinished for season, unfinished in rows}
+
+    def results(self, source, season):
+        """Parsed pages of one source and season as {(competition, position, page): frame}, in key order"""
+        rows = self.connection.execute(
+            'SELECT competition, position, page, rows FROM results WHERE source = ? AND season = ? '
+            'ORDER BY competition, position, page',
+            (source, season),
+        )
+        # Read as text, as the scrapers produced it; the save functions type and normalize it
+        return {(competition, position, page): pd.read_csv(StringIO(text), dtype=str, keep_default_na=False)
+                for competition, position, page, text in rows if text}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Transaction:
+    """BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error) on an autocommit connection"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rolled_back = False
+
+    def rollback(self):
+        self.connection.execute('ROLLBACK')
+        self.rolled_back = True
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if self.rolled_back:
+            return
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+def describe(task):
+    parts = [task['source'], task['season'], task['competition'] or task['position'], f"page {task['page']}"]
+    return ' '.join(part for part in parts if part)
+
+def page_task(source, season, base_url, max_pages, competition='', position='', page=1, url=None):
+    return {
+        'source': source, 'season': season, 'competition': competition, 'position': position,
+        'page': page, 'url': url or base_url, 'base_url': base_url, 'max_pages': max_pages,
+    }
+
+def seed_tasks(sources, first_season, last_season, competitions=('Big5',), positions=(GOALKEEPER_POSITION,), max_pages=40):
+    """
+    First-page tasks of a backfill: every fbref (season, competition), every Transfermarkt
+    (season, position) transfer list, and the current market value list of every position.
+    Only the goalkeeper position is accepted: export writes every position's pages into
+    the goalkeeper files and store tables.
+    """
+    others = [position for position in positions if position != GOALKEEPER_POSITION]
+    if others:
+        raise ValueError(f"Only the goalkeeper position ({GOALKEEPER_POSITION}) can be crawled, not {', '.join(others)}")
+    seasons = season_range(first_season, last_season)
+    tasks = []
+    if 'keeper_stats' in sources:
+        tasks += [page_task('keeper_stats', season, keeper_stats_url(season, competition), 1, competition=competition)
+                  for season in seasons for competition in competitions]
+    if 'transfers' in sources:
+        for position in positions:
+            tasks += [page_task('transfers', entry['name'], entry['url'], max_pages, position=position)
+                      for entry in season_entries(int(first_season[:4]), int(last_season[:4]), position)]
+    if 'market_values' in sources:
+        # The market value list is point-in-time, so it is always the current season's
+        tasks += [page_task('market_values', current_season(), MARKET_VALUES_URL.format(position=position), max_pages,
+                            position=position) for position in positions]
+    return tasks
+
+class Worker:
+    """Runs leased tasks with the scrapers' fetch and parse code, one page at a time"""
+
+    def __init__(self, frontier, owner, cache_dir='.http_cache', fast_parse=False):
+        self.frontier = frontier
+        self.owner = owner
+        # One request at a time per worker; parallelism comes from running more workers
+        self.market_values = GoalkeeperMarketValueScraper(max_workers=1, cache_dir=cache_dir, fast_parse=fast_parse)
+        self.transfers = MultiSeasonTransfermarktScraper(max_workers=1, cache_dir=cache_dir, fast_parse=fast_parse)
+        self.keeper_stats = keeper_stats_engine(season_range('1990-1991', current_season()), max_workers=1, cache_dir=cache_dir)
+
+    def engine(self, source):
+        return {'keeper_stats': self.keeper_stats, 'transfers': self.transfers.engine,
+                'market_values': self.market_values.engine}[source]
+
+    def fetch(self, task):
+        """Fetch a task's page, waiting for the site's shared request slot unless the cache has it fresh"""
+        engine = self.engine(task['source'])
+        entry = engine.cache.lookup(task['url']) if engine.cache else None
+        if not (entry and engine.cache.is_fresh(entry)):
+            wait = self.frontier.reserve_request(SOURCE_HOSTS[task['source']], SOURCE_INTERVALS[task['source']])
+            if wait > 0:
+                time.sleep(wait)
+        return engine.fetch(task['url'])
+
+    def next_page(self, task, row_count):
+        """The task for the following page of a paged list, if this page was full"""
+        if row_count < PAGE_ROWS or task['page'] >= task['max_pages']:
+            return None
+        scraper = self.transfers if task['source'] == 'transfers' else self.market_values
+        return page_task(task['source'], task['season'], task['base_url'], task['max_pages'], competition=task['competition'],
+                         position=task['position'], page=task['page'] + 1, url=scraper.page_url(task['base_url'], task['page'] + 1))
+
+    def parse(self, task, html_content):
+        """Parse a fetched page into (rows as CSV text, row count, next page task or None)"""
+        if task['source'] == 'keeper_stats':
+            with metrics.timer('parse_seconds', source='keeper_stats'):
+                keeper_stats = clean_keeper_table(parse_keeper_table(html_content), task['season'], task['competition'])
+            return keeper_stats.to_csv(index=False), len(keeper_stats), None
+
+        if task['source'] == 'transfers':
+            row_count, transfers = self.transfers.parse_transfer_rows(html_content)
+        else:
+            parsed = self.market_values.parse_market_value_page(html_content, task['page'])
+            # No table rows: the list ended on the previous page
+            row_count, transfers = parsed if parsed is not None else (0, [])
+        rows = pd.DataFrame(transfers).to_csv(index=False) if transfers else ''
+        return rows, len(transfers), self.next_page(task, row_count)
+
+    def run_task(self, task):
+        html_content = self.fetch(task)
+        if not html_content:
+            self.frontier.fail(task, self.owner, 'fetch failed')
+            return
+        try:
+            rows, row_count, next_task = self.parse(task, html_content)
+        except Exception as e:
+            self.frontier.fail(task, self.owner, f"parse failed: {e}")
+            return
+        if self.frontier.complete(task, self.owner, rows, row_count, next_task):
+            print(f"{self.owner}: {describe(task)} done, {row_count} rows")
+        else:
+            print(f"{self.owner}: lease on {describe(task)} expired while it ran, result discarded")
+
+    def run(self, sources=SOURCES, lease_seconds=LEASE_SECONDS):
+        """Work until no task of the given sources is pending or leased; returns the tasks run"""
+        tasks_run = 0
+        while True:
+            task = self.frontier.lease(self.owner, sources, lease_seconds)
+            if task is None:
+                if not self.frontier.unfinished(sources):
+                    break
+                # Other workers hold the remaining tasks, or they are waiting out a retry backoff
+                time.sleep(POLL_SECONDS)
+                continue
+            try:
+                self.run_task(task)
+            except BaseException:
+                self.frontier.release(task, self.owner)
+                raise
+            tasks_run += 1
+        print(f"{self.owner}: no work left after {tasks_run} tasks")
+        return tasks_run
+
+    def close(self):
+        for engine in [self.keeper_stats, self.transfers.engine, self.market_values.engine]:
+            engine.close()
+
+def run_worker(path, sources, lease_seconds, cache_dir, fast_parse, number=0):
+    """Worker process entry point; number only names its metrics report"""
+    owner = f"{socket.gethostname()}-{os.getpid()}"
+    with Frontier(path) as frontier:
+        worker = Worker(frontier, owner, cache_dir=cache_dir, fast_parse=fast_parse)
+        try:
+            worker.run(sources, lease_seconds)
+        except KeyboardInterrupt:
+            print(f"{owner}: interrupted, leased task handed back")
+        finally:
+            worker.close()
+    metrics.write_report(f"frontier_worker_{number}")
+
+def export(frontier, sources=SOURCES, output_dir='.'):
+    """
+    Write the collected pages of every fully crawled season as the scrapers' usual files
+    and store rows; seasons with unfinished (or failed) tasks are skipped. Returns the files written.
+    """
+    filenames = []
+    scraper = MultiSeasonTransfermarktScraper(cache_dir=None)
+    market_value_scraper = GoalkeeperMarketValueScraper(cache_dir=None)
+    scraper.engine.close()
+    market_value_scraper.engine.close()
+    with Store() as store:
+        for source in sources:
+            for season, unfinished in sorted(frontier.seasons(source).items(), reverse=True):
+                if unfinished:
+                    print(f"Skipping {source} {season}: {unfinished} tasks not done")
+                    continue
+                pages = frontier.results(source, season)
+                if not pages:
+                    print(f"No {source} rows for {season}")
+                    continue
+
+                if source == 'keeper_stats':
+                    # Competitions in their usual order, as scrape_keeper_stats writes them
+                    order = list(COMPETITIONS)
+                    keys = sorted(pages, key=lambda key: order.index(key[0]) if key[0] in order else len(order))
+                    season_stats = pd.concat([pages[key] for key in keys], ignore_index=True)
+                    filenames.append(save_season_stats(season_stats, season, output_dir, store))
+                elif source == 'transfers':
+                    transfers = unique_transfers(pages[key].to_dict('records') for key in sorted(pages))
+                    filename = os.path.join(output_dir, f"goalkeeper_transfers_{season.replace('-', '_')}.csv")
+                    saved = scraper.save_to_csv(transfers, filename)
+                    store.upsert_dataset('transfers', apply_schema(saved, 'goalkeeper_transfers'))
+                    filenames.append(filename)
+                else:
+                    market_values = pd.concat([pages[key] for key in sorted(pages)], ignore_index=True).to_dict('records')
+                    filename = os.path.join(output_dir, 'goalkeeper_market_values.csv')
+                    market_value_scraper.save_to_csv(market_values, filename)
+                    market_value_scraper.save_to_store(market_values, store)
+                    MarketValueHistory().append(market_value_scraper.market_value_frame(market_values))
+                    filenames.append(filename)
+    return filenames
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl frontier: queue, work through and export scrape tasks")
+    parser.add_argument('--frontier', default=FRONTIER_FILE, help="frontier database file (shared by all workers)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed = commands.add_parser('seed', help="queue the first page of every season, competition and position")
+    seed.add_argument('--sources', nargs='+', default=SOURCES, choices=SOURCES)
+    seed.add_argument('--first-season', default='2022-2023', help="first season, e.g. 2015-2016")
+    seed.add_argument('--last-season', default=current_season(), help="last season (inclusive)")
+    seed.add_argument('--competitions', nargs='+', default=['Big5'], choices=sorted(COMPETITIONS))
+    seed.add_argument('--positions', nargs='+', default=[GOALKEEPER_POSITION], choices=[GOALKEEPER_POSITION],
+                      help="Transfermarkt position IDs (export only writes goalkeeper datasets)")
+    seed.add_argument('--max-pages', type=int, default=40, help="maximum pages to follow per Transfermarkt list")
+
+    work = commands.add_parser('work', help="run worker processes until the queue is empty")
+    work.add_argument('--processes', type=int, default=1, help="worker processes on this host")
+    work.add_argument('--sources', nargs='+', default=SOURCES, choices=SOURCES)
+    work.add_argument('--lease-seconds', type=int, default=LEASE_SECONDS)
+    work.add_argument('--cache-dir', default='.http_cache')
+    work.add_argument('--fast-parse', action='store_true', help="parse Transfermarkt tables with the lxml fast path")
+
+    commands.add_parser('status', help="task counts per source, season and status")
+
+    retry = commands.add_parser('retry', help="queue failed tasks again")
+    retry.add_argument('--sources', nargs='+', default=SOURCES, choices=SOURCES)
+
+    export_parser = commands.add_parser('export', help="write CSVs and store rows of fully crawled seasons")
+    export_parser.add_argument('--sources', nargs='+', default=SOURCES, choices=SOURCES)
+    export_parser.add_argument('--output-dir', default='.')
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        worker_args = (args.frontier, args.sources, args.lease_seconds, args.cache_dir, args.fast_parse)
+        if args.processes == 1:
+            run_worker(*worker_args)
+            return
+        processes = [multiprocessing.Process(target=run_worker, args=worker_args + (number,)) for number in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        return
+
+    with Frontier(args.frontier) as frontier:
+        if args.command == 'seed':
+            tasks = seed_tasks(args.sources, args.first_season, args.last_season, args.competitions, args.positions, args.max_pages)
+            print(f"Queued {frontier.add(tasks)} new tasks of {len(tasks)} in {args.frontier}")
+        elif args.command == 'status':
+            print(frontier.status().to_string(index=False))
+        elif args.command == 'retry':
+            print(f"Queued {frontier.retry_failed(args.sources)} failed tasks again")
+        else:
+            filenames = export(frontier, args.sources, args.output_dir)
+            print(f"Exported {len(filenames)} files")
+            metrics.write_report('frontier_export')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    Persistent on-disk cache for fetched pages.
+    Bodies are stored content-addressed (by SHA-256) under objects/, and an SQLite
+    index maps each URL to its body, validators and timestamps. Entries expire per
+    URL pattern, stale entries are revalidated with ETag/Last-Modified, and the
+    least recently used entries are evicted once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, path=".http_cache", max_bytes=500 * 1024 * 1024, ttl_rules=None, default_ttl=24 * 60 * 60):
+        self.path = path
+        self.objects_path = os.path.join(path, "objects")
+        self.max_bytes = max_bytes
+        # List of (regex, ttl seconds) checked in order; a ttl of None means never expire
+        self.ttl_rules = [(re.compile(pattern), ttl) for pattern, ttl in (ttl_rules or [])]
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+
+        os.makedirs(self.objects_path, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        self.db.commit()
+
+    def ttl_for(self, url):
+        """Return the TTL in seconds for a URL, or None if it never expires"""
+        for pattern, ttl in self.ttl_rules:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_path, digest[:2], digest)
+
+    def lookup(self, url):
+        """Return the cached entry for a URL as a dict, or None if the URL is not cached"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT hash, etag, last_modified, fetched_at FROM entries WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE entries SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self.db.commit()
+        digest, etag, last_modified, fetched_at = row
+        return {"url": url, "hash": digest, "etag": etag, "last_modified": last_modified, "fetched_at": fetched_at}
+
+    def is_fresh(self, entry):
+        """Check whether a cached entry is still within its URL's TTL"""
+        ttl = self.ttl_for(entry["url"])
+        return ttl is None or time.time() - entry["fetched_at"] < ttl
+
+    def conditional_headers(self, entry):
+        """Build revalidation headers from a cached entry's validators"""
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def read_body(self, entry):
+        """Read a cached body, returning None if the object file has gone missing"""
+        try:
+            with open(self.object_path(entry["hash"]), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def store(self, url, body, headers=None):
+        """Store a freshly fetched body and its validators, then enforce the size cap"""
+        headers = headers or {}
+        data = body.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so a crash never leaves a partial object
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        now = time.time()
+        with self.lock:
+            previous = self.db.execute("SELECT hash FROM entries WHERE url = ?", (url,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, digest, len(data), headers.get("ETag"), headers.get("Last-Modified"), now, now),
+            )
+            if previous and previous[0] != digest:
+                self.remove_unreferenced(previous[0])
+            self.db.commit()
+        self.evict()
+
+    def touch(self, url):
+        """Mark an entry as freshly validated (after a 304 Not Modified)"""
+        now = time.time()
+        with self.lock:
+            self.db.execute("UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+            self.db.commit()
+
+    def total_bytes(self):
+        """Total size of the distinct objects referenced by the index"""
+        row = self.db.execute("SELECT SUM(size) FROM (SELECT DISTINCT hash, size FROM entries)").fetchone()
+        return row[0] or 0
+
+    def remove_unreferenced(self, digest):
+        """Delete an object file once no URL points at it (caller holds the lock)"""
+        if self.db.execute("SELECT 1 FROM entries WHERE hash = ? LIMIT 1", (digest,)).fetchone():
+            return
+        try:
+            os.remove(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Evict least recently used entries until the cache fits in max_bytes"""
+        with self.lock:
+            total = self.total_bytes()
+            while total > self.max_bytes:
+                row = self.db.execute("SELECT url, hash FROM entries ORDER BY accessed_at LIMIT 1").fetchone()
+                if row is None:
+                    break
+                url, digest = row
+                self.db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self.remove_unreferenced(digest)
+                total = self.total_bytes()
+            self.db.commit()
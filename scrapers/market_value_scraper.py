@@ -1,11 +1,28 @@
-import requests
 from bs4 import BeautifulSoup
-import csv
-import time
+import argparse
+import json
+import math
+import os
+import pandas as pd
 import re
+import time
+
+import metrics
+from fees import normalize_fees
+from market_value_history import MarketValueHistory
+from schema import apply_schema
+from scrapers.fetch_engine import FetchEngine
+from scrapers.http_cache import ResponseCache
+from scrapers.stat_scraper import current_season
+from scrapers.table_parser import parse_items_table
+from scrapers.transfer_scraper import GOALKEEPER_POSITION
+from store import Store
+
+# Most valuable players list for one Transfermarkt position
+MARKET_VALUES_URL = "https://www.transfermarkt.us/spieler-statistik/wertvollstespieler/marktwertetop/mw/spielerposition_id/{position}"
 
 class GoalkeeperMarketValueScraper:
-    def __init__(self):
+    def __init__(self, max_workers=4, rate=1.0, burst=2, cache_dir=".http_cache", fast_parse=False):
         self.base_url = "https://www.transfermarkt.us"
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36",
@@ -15,25 +32,30 @@ class GoalkeeperMarketValueScraper:
             "Connection": "keep-alive",
             "Upgrade-Insecure-Requests": "1",
         }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        # Shared fetch engine: concurrent requests under a per-host token bucket,
+        # backed by the on-disk response cache (pass cache_dir=None to disable it)
+        cache = ResponseCache(cache_dir) if cache_dir else None
+        self.engine = FetchEngine(self.headers, max_workers=max_workers, rate=rate, burst=burst, cache=cache)
+        # Parse only the table.items subtree with lxml instead of the whole page with html.parser
+        self.fast_parse = fast_parse
     
     def get_page(self, url):
         """Fetch a page with proper error handling and rate limiting"""
-        try:
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            time.sleep(1)  # Rate limiting to be respectful
-            return response.text
-        except requests.RequestException as e:
-            print(f"Error fetching {url}: {e}")
-            return None
+        return self.engine.fetch(url)
+    
+    def find_items_table(self, html_content):
+        """Locate the table.items element, using the lxml fast path if enabled"""
+        if self.fast_parse:
+            return parse_items_table(html_content)
+        soup = BeautifulSoup(html_content, 'html.parser')
+        return soup.find('table', class_='items')
     
     def extract_player_data(self, row):
         """Extract player data from a table row"""
         try:
             cells = row.find_all('td')
             if len(cells) < 9:
+                metrics.count('parse_rows_rejected_total', source='market_values', reason='malformed')
                 return None
             
             # Extract rank (cell 1)
@@ -43,14 +65,22 @@ class GoalkeeperMarketValueScraper:
             player_cell = cells[3]  # 4th cell (0-indexed)
             player_link = player_cell.find('a')
             if not player_link:
+                metrics.count('parse_rows_rejected_total', source='market_values', reason='malformed')
                 return None
             
             player_name = player_link.get_text(strip=True)
             
+            # Transfermarkt player ID from the profile link, e.g. /name/profil/spieler/12345
+            player_id = ""
+            player_id_match = re.search(r'/spieler/(\d+)', player_link.get('href', ''))
+            if player_id_match:
+                player_id = player_id_match.group(1)
+            
             # Check if it's a goalkeeper (cell 5)
             position_cell = cells[4]
             position_text = position_cell.get_text(strip=True)
             if "Goalkeeper" not in position_text:
+                metrics.count('parse_rows_rejected_total', source='market_values', reason='not_goalkeeper')
                 return None
             
             # Extract age (cell 6)
@@ -76,19 +106,13 @@ class GoalkeeperMarketValueScraper:
             
             # Extract market value (cell 9)
             market_value_cell = cells[8]
-            market_value_text = market_value_cell.get_text(strip=True)
-            market_value = ""
-            # Extract numeric value from market value (e.g., "€40.00m" -> "40.00")
-            market_value_match = re.search(r'€([\d.]+)m', market_value_text)
-            if market_value_match:
-                market_value = market_value_match.group(1)
-            else:
-                # Handle other market value formats
-                market_value = market_value_text
+            # Raw market value text (e.g. "€40.00m"); converted to euros for the whole table in save_to_csv
+            market_value = market_value_cell.get_text(strip=True)
             
             return {
                 'Rank': rank,
                 'Player': player_name,
+                'Player ID': player_id,
                 'Age': age,
                 'Nationality': nationality,
                 'Club': club,
@@ -97,106 +121,275 @@ class GoalkeeperMarketValueScraper:
             
         except Exception as e:
             print(f"Error extracting player data: {e}")
+            metrics.count('parse_rows_rejected_total', source='market_values', reason='error')
             return None
     
+    def page_url(self, base_url, page):
+        """Construct the URL for a given page of the market value list"""
+        if page == 1:
+            return base_url
+        # Add page parameter to URL (use ? for first parameter, & for subsequent)
+        if '?' in base_url:
+            return f"{base_url}&page={page}"
+        return f"{base_url}?page={page}"
+    
+    def parse_market_value_page(self, html_content, page):
+        """Parse one fetched page, returning (row count, extracted players) or None if no table rows were found"""
+        start = time.perf_counter()
+        # Find the main table with market value data
+        table = self.find_items_table(html_content)
+        if not table:
+            print(f"Could not find market value table on page {page}")
+            return None
+        
+        rows = table.find_all('tr', class_=['odd', 'even'])
+        
+        if not rows:
+            print(f"No more rows found on page {page}")
+            return None
+        
+        print(f"Found {len(rows)} market value rows on page {page}")
+        
+        page_market_values = []
+        for row in rows:
+            player_data = self.extract_player_data(row)
+            if player_data:
+                page_market_values.append(player_data)
+                print(f"Extracted: {player_data['Player']} - {player_data['Club']} - {player_data['Market Value']}")
+        
+        metrics.observe('parse_seconds', time.perf_counter() - start, source='market_values')
+        metrics.count('parse_rows_total', len(rows), source='market_values')
+        metrics.count('parse_rows_extracted_total', len(page_market_values), source='market_values')
+        
+        return len(rows), page_market_values
+    
     def scrape_market_values(self, base_url, max_players=50):
         """Scrape market value data from multiple pages to get top goalkeepers"""
         all_market_values = []
         page = 1
         
         while len(all_market_values) < max_players:
-            # Construct URL for current page
-            if page == 1:
-                url = base_url
-            else:
-                # Add page parameter to URL (use ? for first parameter, & for subsequent)
-                if '?' in base_url:
-                    url = f"{base_url}&page={page}"
-                else:
-                    url = f"{base_url}?page={page}"
-            
-            print(f"Scraping page {page} from: {url}")
-            
-            html_content = self.get_page(url)
-            if not html_content:
-                print(f"Failed to fetch page {page}")
-                break
-            
-            soup = BeautifulSoup(html_content, 'html.parser')
+            # Submit a window of pages to the fetch engine: as many as are still needed
+            # (25 players per page), capped at the engine's worker count
+            pages_needed = math.ceil((max_players - len(all_market_values)) / 25)
+            window = range(page, page + min(pages_needed, self.engine.max_workers))
+            urls = {self.page_url(base_url, p): p for p in window}
             
-            # Find the main table with market value data
-            table = soup.find('table', class_='items')
-            if not table:
-                print(f"Could not find market value table on page {page}")
-                break
+            html_by_page = {}
+            for url, html_content in self.engine.fetch_many(urls):
+                print(f"Scraped page {urls[url]} from: {url}")
+                html_by_page[urls[url]] = html_content
             
-            rows = table.find_all('tr', class_=['odd', 'even'])
+            # Parse the window in page order so the output keeps the site's ranking
+            finished = False
+            for p in window:
+                html_content = html_by_page[p]
+                if not html_content:
+                    print(f"Failed to fetch page {p}")
+                    finished = True
+                    break
+                
+                parsed = self.parse_market_value_page(html_content, p)
+                if parsed is None:
+                    finished = True
+                    break
+                
+                row_count, page_market_values = parsed
+                all_market_values.extend(page_market_values)
+                
+                # If we got fewer than 25 players on this page, we've reached the end
+                if row_count < 25:
+                    print(f"Reached end of data (only {row_count} players on page {p})")
+                    finished = True
+                    break
             
-            if not rows:
-                print(f"No more rows found on page {page}")
+            if finished:
                 break
             
-            print(f"Found {len(rows)} market value rows on page {page}")
-            
-            page_market_values = []
-            for row in rows:
-                player_data = self.extract_player_data(row)
-                if player_data:
-                    page_market_values.append(player_data)
-                    print(f"Extracted: {player_data['Player']} - {player_data['Club']} - €{player_data['Market Value']}m")
-            
-            all_market_values.extend(page_market_values)
-            
-            # If we got fewer than 25 players on this page, we've reached the end
-            if len(rows) < 25:
-                print(f"Reached end of data (only {len(rows)} players on page {page})")
-                break
-            
-            page += 1
+            page = window.stop
         
         return all_market_values[:max_players]
     
+    def market_value_frame(self, market_values):
+        """Build the output table, normalizing the whole Market Value column at once into euros"""
+        fieldnames = ['Rank', 'Player', 'Player ID', 'Age', 'Nationality', 'Club', 'Market Value', 'Market Value Kind']
+        
+        market_values = pd.DataFrame(market_values)
+        normalized = normalize_fees(market_values['Market Value'])
+        market_values['Market Value'] = normalized['euros']
+        market_values['Market Value Kind'] = normalized['kind']
+        return market_values[fieldnames]
+    
     def save_to_csv(self, market_values, filename="goalkeeper_market_values.csv"):
         """Save market value data to CSV file"""
         if not market_values:
             print("No market values to save")
             return
         
-        fieldnames = ['Rank', 'Player', 'Age', 'Nationality', 'Club', 'Market Value']
-        
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(market_values)
+        self.market_value_frame(market_values).to_csv(filename, index=False, encoding='utf-8')
         
         print(f"Saved {len(market_values)} market values to {filename}")
+    
+    def save_to_store(self, market_values, store):
+        """Upsert market values into the store against the current season, returning the rows changed"""
+        if not market_values:
+            return 0
+        frame = apply_schema(self.market_value_frame(market_values), 'goalkeeper_market_values')
+        return store.upsert_dataset('market_values', frame.assign(Season=current_season()))
+    
+    def load_checkpoint(self, checkpoint_file, base_url, filename):
+        """Return the saved crawl position for this URL and output file, or None to start fresh"""
+        if not os.path.exists(checkpoint_file):
+            return None
+        with open(checkpoint_file, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('base_url') != base_url or checkpoint.get('filename') != filename:
+            print(f"Ignoring checkpoint {checkpoint_file}: it belongs to a different crawl")
+            return None
+        if checkpoint['file_size'] and not os.path.exists(filename):
+            print(f"Ignoring checkpoint {checkpoint_file}: {filename} with its rows is gone")
+            return None
+        return checkpoint
+    
+    def save_checkpoint(self, checkpoint_file, checkpoint):
+        # Write then rename, so a crash never leaves a half-written checkpoint
+        tmp_file = f"{checkpoint_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(tmp_file, checkpoint_file)
+    
+    def crawl_market_values(self, base_url, filename="goalkeeper_market_values.csv", max_players=None,
+                            checkpoint_file="goalkeeper_market_values.checkpoint.json", store=None):
+        """
+        Resumable crawl: rows are appended to the CSV (and upserted into the store, if given)
+        as each page finishes and a checkpoint (last page, row count, file size) is written
+        after every page. A rerun resumes after the last completed page, and a rerun after
+        a finished crawl starts a fresh one. Page N+1 is prefetched while page N is parsed.
+        Returns the total number of rows written.
+        """
+        checkpoint = self.load_checkpoint(checkpoint_file, base_url, filename)
+        if checkpoint and checkpoint['finished']:
+            # Market values change over time, so a finished crawl is only the previous snapshot
+            print(f"Previous crawl finished with {checkpoint['row_count']} rows in {filename}, starting a fresh crawl")
+            checkpoint = None
+        
+        if checkpoint:
+            # Drop anything appended after the last checkpoint (a page cut off by a crash).
+            # Pages without rows never create the file, so there may be nothing to truncate
+            if os.path.exists(filename):
+                with open(filename, 'r+b') as f:
+                    f.truncate(checkpoint['file_size'])
+            print(f"Resuming after page {checkpoint['last_page']} ({checkpoint['row_count']} rows so far)")
+        else:
+            checkpoint = {'base_url': base_url, 'filename': filename, 'last_page': 0, 'row_count': 0,
+                          'file_size': 0, 'finished': False}
+            if os.path.exists(filename):
+                os.remove(filename)
+        
+        page = checkpoint['last_page'] + 1
+        future = self.engine.submit(self.page_url(base_url, page))
+        
+        while True:
+            html_content = future.result()
+            if not html_content:
+                # Leave the checkpoint in place so the next run retries this page
+                print(f"Failed to fetch page {page}, rerun to resume")
+                break
+            
+            # Prefetch the next page while this one is parsed
+            future = self.engine.submit(self.page_url(base_url, page + 1))
+            
+            parsed = self.parse_market_value_page(html_content, page)
+            if parsed is None:
+                checkpoint['finished'] = True
+                self.save_checkpoint(checkpoint_file, checkpoint)
+                break
+            
+            row_count, page_market_values = parsed
+            if max_players is not None:
+                page_market_values = page_market_values[:max_players - checkpoint['row_count']]
+            
+            # Stream this page to disk, then record the checkpoint. A crash during the first append leaves a
+            # file that resuming truncates to nothing, so the header goes with the first bytes, not a new file
+            if page_market_values:
+                header = not os.path.exists(filename) or os.path.getsize(filename) == 0
+                self.market_value_frame(page_market_values).to_csv(
+                    filename, mode='a', header=header, index=False, encoding='utf-8')
+                if store is not None:
+                    self.save_to_store(page_market_values, store)
+            checkpoint['last_page'] = page
+            checkpoint['row_count'] += len(page_market_values)
+            checkpoint['file_size'] = os.path.getsize(filename) if os.path.exists(filename) else 0
+            
+            # If we got fewer than 25 players on this page, we've reached the end
+            reached_end = row_count < 25
+            if reached_end:
+                print(f"Reached end of data (only {row_count} players on page {page})")
+            checkpoint['finished'] = reached_end or (max_players is not None and checkpoint['row_count'] >= max_players)
+            self.save_checkpoint(checkpoint_file, checkpoint)
+            
+            if checkpoint['finished']:
+                break
+            page += 1
+        
+        future.cancel()
+        print(f"Saved {checkpoint['row_count']} market values to {filename}")
+        return checkpoint['row_count']
 
 def main():
+    parser = argparse.ArgumentParser(description="Scrape Transfermarkt goalkeeper market values")
+    parser.add_argument('--max-players', type=int, default=100, help="number of goalkeepers to scrape (0 for all, with --crawl)")
+    parser.add_argument('--crawl', action='store_true',
+                        help="stream rows to disk with a checkpoint after every page, resuming an interrupted crawl")
+    args = parser.parse_args()
+    max_players = args.max_players or None
+    
     # Initialize scraper
     scraper = GoalkeeperMarketValueScraper()
     
     # URL for goalkeeper market values
-    base_url = "https://www.transfermarkt.us/spieler-statistik/wertvollstespieler/marktwertetop/mw/spielerposition_id/1"
+    base_url = MARKET_VALUES_URL.format(position=GOALKEEPER_POSITION)
     
-    # Scrape the market values (top 100 goalkeepers)
-    market_values = scraper.scrape_market_values(base_url, max_players=100)
+    store = Store()
+    
+    if args.crawl:
+        # Deep crawls keep nothing in memory beyond the page being parsed
+        row_count = scraper.crawl_market_values(base_url, max_players=max_players, store=store)
+        scraper.engine.close()
+        store.close()
+        if row_count:
+            # The CSV holds this crawl's rows; only changed players are added to the history
+            MarketValueHistory().append(pd.read_csv("goalkeeper_market_values.csv", dtype={'Player ID': 'string'}))
+        metrics.set_gauge('rows_written', row_count, dataset='goalkeeper_market_values')
+        metrics.write_report('market_values')
+        return
+    
+    # Scrape the market values (top 100 goalkeepers by default)
+    market_values = scraper.scrape_market_values(base_url, max_players=args.max_players)
+    scraper.engine.close()
     
     if market_values:
-        # Save to CSV
+        # Save to CSV and upsert into the store
         scraper.save_to_csv(market_values)
+        scraper.save_to_store(market_values, store)
+        MarketValueHistory().append(scraper.market_value_frame(market_values))
         print(f"\nSuccessfully scraped {len(market_values)} goalkeeper market values")
         
         # Display first few entries as preview
         print("\nPreview of scraped data:")
         for i, player in enumerate(market_values[:5]):
-            print(f"{i+1}. {player['Player']}, {player['Age']}, {player['Nationality']}, {player['Club']}, €{player['Market Value']}m")
+            print(f"{i+1}. {player['Player']}, {player['Age']}, {player['Nationality']}, {player['Club']}, {player['Market Value']}")
         
         # Display last few entries as preview
         print("\nLast few entries:")
         for i, player in enumerate(market_values[-5:]):
-            print(f"{len(market_values)-4+i}. {player['Player']}, {player['Age']}, {player['Nationality']}, {player['Club']}, €{player['Market Value']}m")
+            print(f"{len(market_values)-4+i}. {player['Player']}, {player['Age']}, {player['Nationality']}, {player['Club']}, {player['Market Value']}")
     else:
         print("No market values were scraped. Please check the URL and try again.")
+    store.close()
+    
+    metrics.set_gauge('rows_written', len(market_values), dataset='goalkeeper_market_values')
+    metrics.write_report('market_values')
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -1,106 +1,161 @@
-import pandas as pd
-
-# European Top 5 Leagues Advanced Goalkeeper Stats 2024-2025
-keeper_stats_2024_2025 = pd.read_html('https://fbref.com/en/comps/Big5/keepersadv/players/Big-5-European-Leagues-Stats',
-                  attrs={"id":"stats_keeper_adv"}, header=None)[0]
-
-# Find the header row (it contains "Rk,Player,Nation,Pos,Squad,Comp,Age,Born,90s,GA,PKA,FK,CK,OG,PSxG,PSxG/SoT,PSxG+/-,/90,Cmp,Att,Cmp%,Att (GK),Thr,Launch%,AvgLen,Att,Launch%,AvgLen,Opp,Stp,Stp%,#OPA,#OPA/90,AvgDist")
-header_row = None
-for i, row in keeper_stats_2024_2025.iterrows():
-    if row.iloc[0] == 'Rk' and row.iloc[1] == 'Player':
-        header_row = i
-        break
-
-if header_row is not None:
-    # Get the header row
-    header_data = keeper_stats_2024_2025.iloc[header_row]
-    
-    # Remove the header row from the dataframe
-    keeper_stats_2024_2025 = keeper_stats_2024_2025.drop(header_row)
-    
-    # Set the column names to the header data
-    keeper_stats_2024_2025.columns = header_data
-    
-    # Now remove any remaining rows that match the header pattern (duplicate headers)
-    keeper_stats_2024_2025 = keeper_stats_2024_2025[~((keeper_stats_2024_2025.iloc[:, 0] == 'Rk') & (keeper_stats_2024_2025.iloc[:, 1] == 'Player'))]
-
-# Remove the first column (Rk) and the last column
-keeper_stats_2024_2025 = keeper_stats_2024_2025.iloc[:, 1:-1]
-
-# Add Season column after Player column
-keeper_stats_2024_2025.insert(1, 'Season', '2024-2025')
-
-keeper_stats_2024_2025.to_csv('keepers_stats_2024_2025.csv', index=False)
-
-# European Top 5 Leagues Advanced Goalkeeper Stats 2023-2024
-keeper_stats_2023_2024 = pd.read_html('https://fbref.com/en/comps/Big5/2023-2024/keepersadv/players/2023-2024-Big-5-European-Leagues-Stats',
-                  attrs={"id":"stats_keeper_adv"}, header=None)[0]
-
-header_row = None
-for i, row in keeper_stats_2023_2024.iterrows():
-    if row.iloc[0] == 'Rk' and row.iloc[1] == 'Player':
-        header_row = i
-        break
-
-if header_row is not None:
-    # Get the header row
-    header_data = keeper_stats_2023_2024.iloc[header_row]
-    
-    # Remove the header row from the dataframe
-    keeper_stats_2023_2024 = keeper_stats_2023_2024.drop(header_row)
-    
-    # Set the column names to the header data
-    keeper_stats_2023_2024.columns = header_data
-    
-    # Now remove any remaining rows that match the header pattern (duplicate headers)
-    keeper_stats_2023_2024 = keeper_stats_2023_2024[~((keeper_stats_2023_2024.iloc[:, 0] == 'Rk') & (keeper_stats_2023_2024.iloc[:, 1] == 'Player'))]
-    
-# Remove the first column (Rk) and the last column
-keeper_stats_2023_2024 = keeper_stats_2023_2024.iloc[:, 1:-1]
-
-# Add Season column after Player column
-keeper_stats_2023_2024.insert(1, 'Season', '2023-2024')
-
-keeper_stats_2023_2024.to_csv('keepers_stats_2023_2024.csv', index=False)
-
-# European Top 5 Leagues Advanced Goalkeeper Stats 2022-2023
-keeper_stats_2022_2023 = pd.read_html('https://fbref.com/en/comps/Big5/2022-2023/keepersadv/players/2022-2023-Big-5-European-Leagues-Stats',
-                  attrs={"id":"stats_keeper_adv"}, header=None)[0]
-
-header_row = None
-for i, row in keeper_stats_2022_2023.iterrows():
-    if row.iloc[0] == 'Rk' and row.iloc[1] == 'Player':
-        header_row = i
-        break
-
-if header_row is not None:
-    # Get the header row
-    header_data = keeper_stats_2022_2023.iloc[header_row]
-    
-    # Remove the header row from the dataframe
-    keeper_stats_2022_2023 = keeper_stats_2022_2023.drop(header_row)
-    
-    # Set the column names to the header data               
-    keeper_stats_2022_2023.columns = header_data
-
-    # Now remove any remaining rows that match the header pattern (duplicate headers)
-    keeper_stats_2022_2023 = keeper_stats_2022_2023[~((keeper_stats_2022_2023.iloc[:, 0] == 'Rk') & (keeper_stats_2022_2023.iloc[:, 1] == 'Player'))]
-    
-# Remove the first column (Rk) and the last column
-keeper_stats_2022_2023 = keeper_stats_2022_2023.iloc[:, 1:-1]
-
-# Add Season column after Player column
-keeper_stats_2022_2023.insert(1, 'Season', '2022-2023')
-
-keeper_stats_2022_2023.to_csv('keepers_stats_2022_2023.csv', index=False)
-
-
-
-
-
-
-
-
-
+import argparse
+import datetime
+import os
+import re
+from io import StringIO
 
+import pandas as pd
 
+import metrics
+from schema import apply_schema
+from scrapers.fetch_engine import FetchEngine
+from scrapers.http_cache import ResponseCache
+from store import Store
+
+# fbref competition ids and URL names for the advanced goalkeeping pages
+COMPETITIONS = {
+    'Big5': {'id': 'Big5', 'name': 'Big-5-European-Leagues', 'label': 'Big 5 European Leagues'},
+    'Premier-League': {'id': '9', 'name': 'Premier-League', 'label': 'eng Premier League'},
+    'La-Liga': {'id': '12', 'name': 'La-Liga', 'label': 'es La Liga'},
+    'Serie-A': {'id': '11', 'name': 'Serie-A', 'label': 'it Serie A'},
+    'Bundesliga': {'id': '20', 'name': 'Bundesliga', 'label': 'de Bundesliga'},
+    'Ligue-1': {'id': '13', 'name': 'Ligue-1', 'label': 'fr Ligue 1'},
+}
+
+def current_season(today=None):
+    """Season in progress (or most recently started) as 'YYYY-YYYY'; seasons start in July"""
+    today = today or datetime.date.today()
+    start = today.year if today.month >= 7 else today.year - 1
+    return f"{start}-{start + 1}"
+
+def season_range(first, last):
+    """All seasons from first to last inclusive, e.g. ('2022-2023', '2024-2025')"""
+    first_year, last_year = int(first[:4]), int(last[:4])
+    return [f"{year}-{year + 1}" for year in range(first_year, last_year + 1)]
+
+def keeper_stats_url(season, competition):
+    """fbref advanced goalkeeping URL for one season of one competition"""
+    comp = COMPETITIONS[competition]
+    # The Big 5 page lists players under a separate /players/ path
+    players = 'players/' if comp['id'] == 'Big5' else ''
+    return f"https://fbref.com/en/comps/{comp['id']}/{season}/keepersadv/{players}{season}-{comp['name']}-Stats"
+
+def parse_keeper_table(html_content):
+    """Parse the advanced goalkeeping table out of an fbref page"""
+    # Single-league pages ship the player table inside an HTML comment
+    html_content = html_content.replace('<!--', '').replace('-->', '')
+    # Cells come back as (text, link) pairs so the player link, which carries fbref's player ID, is kept
+    return pd.read_html(StringIO(html_content), attrs={"id":"stats_keeper_adv"}, header=None, extract_links='body')[0]
+
+def clean_keeper_table(keeper_stats, season, competition):
+    """Promote the repeated header row to column names, drop the repeats and tidy columns"""
+    # Pull fbref's player ID out of the Player links, then reduce every cell to its text
+    player_ids = keeper_stats.iloc[:, 1].map(lambda cell: cell[1] if isinstance(cell, tuple) else None)
+    player_ids = player_ids.astype('string').str.extract(r'/players/([0-9a-f]{8})/', expand=False)
+    keeper_stats = keeper_stats.apply(lambda column: column.map(lambda cell: cell[0] if isinstance(cell, tuple) else cell))
+
+    # fbref repeats the header row ("Rk,Player,Nation,Pos,Squad,Comp,Age,Born,90s,GA,...") every 25 rows.
+    # Find all of them at once with a vectorized mask instead of scanning rows
+    header_mask = (keeper_stats.iloc[:, 0] == 'Rk') & (keeper_stats.iloc[:, 1] == 'Player')
+
+    if header_mask.any():
+        # Use the first repeated header as column names, then remove every repeat
+        header_data = keeper_stats[header_mask].iloc[0]
+        keeper_stats = keeper_stats[~header_mask]
+        keeper_stats.columns = header_data
+    elif isinstance(keeper_stats.columns, pd.MultiIndex):
+        # Short tables have no repeats; fall back to the bottom level of the table header
+        keeper_stats.columns = keeper_stats.columns.get_level_values(-1)
+
+    # Remove the first column (Rk) and the last column
+    keeper_stats = keeper_stats.iloc[:, 1:-1]
+
+    # Single-league tables have no Comp column; add one so every season file has the same layout
+    if 'Comp' not in keeper_stats.columns:
+        keeper_stats.insert(list(keeper_stats.columns).index('Squad') + 1, 'Comp', COMPETITIONS[competition]['label'])
+
+    # Add Season column after Player column
+    keeper_stats.insert(1, 'Season', season)
+
+    # Keep fbref's stable player ID for cross-source joins
+    keeper_stats['fbref ID'] = player_ids
+
+    return keeper_stats
+
+def keeper_stats_engine(seasons, max_workers=4, cache_dir='.http_cache'):
+    """Fetch engine for fbref: its fixed rate limit, and a cache in which the given closed seasons never expire"""
+    # Closed seasons never change on fbref, so their pages never expire from the cache
+    closed = [season for season in seasons if season < current_season()]
+    ttl_rules = [(f"/({'|'.join(map(re.escape, closed))})/", None)] if closed else []
+    cache = ResponseCache(cache_dir, ttl_rules=ttl_rules) if cache_dir else None
+    # fbref allows roughly 10 requests per minute and blocks clients that go over, so the rate never adapts upwards
+    return FetchEngine(max_workers=max_workers, rate=1 / 6, burst=2, cache=cache, max_rate=1 / 6)
+
+def save_season_stats(season_stats, season, output_dir, store):
+    """
+    Write one season's cleaned tables as keepers_stats_YYYY_YYYY.csv and make it the
+    stored season (players who dropped out of it are removed). Returns the filename.
+    """
+    filename = os.path.join(output_dir, f"keepers_stats_{season.replace('-', '_')}.csv")
+    season_stats.to_csv(filename, index=False)
+    metrics.set_gauge('rows_written', len(season_stats), dataset='keepers_stats', season=season)
+    print(f"Saved {season} stats to {filename}")
+
+    # Read back from the CSV, which dedupes fbref's repeated column names (Att, Att.1) as the aggregator sees them
+    store.upsert_dataset('stats', apply_schema(pd.read_csv(filename), 'keepers_stats'), replace_seasons=True)
+    return filename
+
+def scrape_keeper_stats(seasons, competitions=('Big5',), output_dir='.', max_workers=4, cache_dir='.http_cache'):
+    """
+    Fetch the advanced goalkeeping tables for every (season, competition) pair
+    concurrently and write one keepers_stats_YYYY_YYYY.csv per season. Each season's
+    rows are also upserted into the stats table of the local store.
+    Returns the list of files written.
+    """
+    engine = keeper_stats_engine(seasons, max_workers, cache_dir)
+
+    jobs = {keeper_stats_url(season, competition): (season, competition)
+            for season in seasons for competition in competitions}
+    tables = {season: [] for season in seasons}
+
+    for url, html_content in engine.fetch_many(jobs):
+        season, competition = jobs[url]
+        if html_content is None:
+            print(f"Failed to fetch {competition} {season}")
+            continue
+
+        with metrics.timer('parse_seconds', source='keeper_stats'):
+            keeper_stats = clean_keeper_table(parse_keeper_table(html_content), season, competition)
+        metrics.count('parse_rows_extracted_total', len(keeper_stats), source='keeper_stats')
+        tables[season].append(keeper_stats)
+        print(f"Parsed {len(keeper_stats)} rows for {competition} {season}")
+
+    engine.close()
+
+    filenames = []
+    with Store() as store:
+        for season in seasons:
+            if not tables[season]:
+                print(f"No stats were scraped for {season}")
+                continue
+
+            season_stats = pd.concat(tables[season], ignore_index=True)
+            filenames.append(save_season_stats(season_stats, season, output_dir, store))
+
+    return filenames
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape fbref advanced goalkeeping stats, one CSV per season")
+    parser.add_argument('--first-season', default='2022-2023', help="first season to scrape, e.g. 2022-2023")
+    parser.add_argument('--last-season', default='2024-2025', help="last season to scrape (inclusive)")
+    parser.add_argument('--competitions', nargs='+', default=['Big5'], choices=sorted(COMPETITIONS),
+                        help="fbref competitions to include in each season file")
+    parser.add_argument('--output-dir', default='.', help="directory for the keepers_stats_*.csv files")
+    args = parser.parse_args()
+
+    seasons = season_range(args.first_season, args.last_season)
+    scrape_keeper_stats(seasons, args.competitions, args.output_dir)
+    metrics.write_report('keeper_stats')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import re
+
+from lxml import etree
+
+# Opening tag of a table whose class list contains "items" (what soup.find('table', class_='items') matches)
+ITEMS_TABLE_RE = re.compile(r"""<table\b[^>]*\bclass\s*=\s*["'](?:[^"']*\s)?items(?:\s[^"']*)?["'][^>]*>""", re.IGNORECASE)
+TABLE_TAG_RE = re.compile(r"<(/?)table\b", re.IGNORECASE)
+
+
+class FastElement:
+    """
+    Thin wrapper around an lxml element exposing the small part of the BeautifulSoup
+    API that extract_player_data uses (find_all, find, get_text, get), so the same
+    column-index extraction runs unchanged on either parser.
+    """
+
+    __slots__ = ('element',)
+
+    def __init__(self, element):
+        self.element = element
+
+    def find_all(self, tag, class_=None):
+        """Return all descendants with the given tag, optionally filtered by any of the given classes"""
+        elements = self.element.iterdescendants(tag)
+        if class_ is not None:
+            wanted = {class_} if isinstance(class_, str) else set(class_)
+            elements = (e for e in elements if wanted.intersection(e.get('class', '').split()))
+        return [FastElement(e) for e in elements]
+
+    def find(self, tag):
+        """Return the first descendant with the given tag, or None"""
+        element = next(self.element.iterdescendants(tag), None)
+        return FastElement(element) if element is not None else None
+
+    def get_text(self, strip=False):
+        """Concatenate descendant text, stripping each piece like BeautifulSoup's get_text(strip=True)"""
+        if strip:
+            return ''.join(piece.strip() for piece in self.element.itertext() if piece.strip())
+        return ''.join(self.element.itertext())
+
+    def get(self, key, default=None):
+        return self.element.get(key, default)
+
+
+def slice_items_table(html_content):
+    """Return the source of the first table.items (including nested tables), or None if absent"""
+    match = ITEMS_TABLE_RE.search(html_content)
+    if not match:
+        return None
+
+    # Walk table open/close tags to find the one closing the items table
+    depth = 0
+    for tag in TABLE_TAG_RE.finditer(html_content, match.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            end = html_content.find('>', tag.end())
+            return html_content[match.start():end + 1 if end != -1 else len(html_content)]
+    return html_content[match.start():]
+
+
+def parse_items_table(html_content):
+    """
+    Fast path for Transfermarkt pages: parse only the table.items subtree with lxml
+    instead of building a BeautifulSoup tree of the whole page.
+    Returns a FastElement for the table, or None if the page has no items table.
+    """
+    fragment = slice_items_table(html_content)
+    if fragment is None:
+        return None
+
+    # etree.HTML uses lxml's per-thread default parser, so this is safe on the fetch pool
+    root = etree.HTML(fragment)
+    if root is None:
+        return None
+    table = root.find('.//table')
+    return FastElement(table) if table is not None else None
@@ -1,12 +1,53 @@
-import requests
 from bs4 import BeautifulSoup
-import csv
-import time
+import argparse
+import datetime
+import pandas as pd
 import re
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
 from urllib.parse import urljoin
 
+import metrics
+from fees import normalize_fees
+from schema import apply_schema
+from scrapers.fetch_engine import FetchEngine
+from scrapers.http_cache import ResponseCache
+from scrapers.table_parser import parse_items_table
+from store import Store
+
+# Transfermarkt position ID for goalkeepers (spielerposition_id)
+GOALKEEPER_POSITION = '1'
+
+# Transfer record list for one position in one season
+TRANSFER_RECORDS_URL = "https://www.transfermarkt.us/transfers/transferrekorde/statistik/top/plus/1/galerie/0?saison_id={year}&land_id=&ausrichtung=&spielerposition_id={position}&altersklasse=&jahrgang=0&leihe=&w_s="
+
+def season_entries(first_year, last_year, position=GOALKEEPER_POSITION):
+    """Season definitions (url, name, filename) for every season from first_year to last_year, newest first"""
+    return [
+        {
+            'url': TRANSFER_RECORDS_URL.format(year=year, position=position),
+            'name': f"{year}-{year + 1}",
+            'filename': f"goalkeeper_transfers_{year}_{year + 1}.csv"
+        }
+        for year in range(last_year, first_year - 1, -1)
+    ]
+
+def unique_transfers(season_pages):
+    """One season's transfers from its pages (in page order), deduplicated on (player, season, from, to)"""
+    seen = set()
+    transfers = []
+    for page_transfers in season_pages:
+        for transfer in page_transfers:
+            # Pages can shift while being crawled, so the same transfer may show up twice
+            key = (transfer['Player ID'] or transfer['Player'], transfer['Season'],
+                   transfer['Team Left'], transfer['Team Joined'])
+            if key not in seen:
+                seen.add(key)
+                transfers.append(transfer)
+    return transfers
+
 class MultiSeasonTransfermarktScraper:
-    def __init__(self):
+    def __init__(self, max_workers=4, rate=1.0, burst=2, cache_dir=".http_cache", fast_parse=False):
         self.base_url = "https://www.transfermarkt.us"
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36",
@@ -16,39 +57,56 @@ class MultiSeasonTransfermarktScraper:
             "Connection": "keep-alive",
             "Upgrade-Insecure-Requests": "1",
         }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        # Shared fetch engine: concurrent requests under a per-host token bucket,
+        # backed by the on-disk response cache (pass cache_dir=None to disable it)
+        cache = None
+        if cache_dir:
+            # Transfer lists of seasons that ended before last summer will not change again
+            closed_seasons = "|".join(str(year) for year in range(1990, datetime.date.today().year - 1))
+            cache = ResponseCache(cache_dir, ttl_rules=[(rf"saison_id=(?:{closed_seasons})(?:&|$)", None)])
+        self.engine = FetchEngine(self.headers, max_workers=max_workers, rate=rate, burst=burst, cache=cache)
+        # Parse only the table.items subtree with lxml instead of the whole page with html.parser
+        self.fast_parse = fast_parse
     
     def get_page(self, url):
         """Fetch a page with proper error handling and rate limiting"""
-        try:
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            time.sleep(1)  # Rate limiting to be respectful
-            return response.text
-        except requests.RequestException as e:
-            print(f"Error fetching {url}: {e}")
-            return None
+        return self.engine.fetch(url)
+    
+    def find_items_table(self, html_content):
+        """Locate the table.items element, using the lxml fast path if enabled"""
+        if self.fast_parse:
+            return parse_items_table(html_content)
+        soup = BeautifulSoup(html_content, 'html.parser')
+        return soup.find('table', class_='items')
     
     def extract_player_data(self, row):
         """Extract player data from a table row"""
         try:
             cells = row.find_all('td')
             if len(cells) < 18:
+                metrics.count('parse_rows_rejected_total', source='transfers', reason='malformed')
                 return None
             
             # Extract player name (cell 4)
             player_cell = cells[3]  # 4th cell (0-indexed)
             player_link = player_cell.find('a')
             if not player_link:
+                metrics.count('parse_rows_rejected_total', source='transfers', reason='malformed')
                 return None
             
             player_name = player_link.get_text(strip=True)
             
+            # Transfermarkt player ID from the profile link, e.g. /name/profil/spieler/12345
+            player_id = ""
+            player_id_match = re.search(r'/spieler/(\d+)', player_link.get('href', ''))
+            if player_id_match:
+                player_id = player_id_match.group(1)
+            
             # Extract position (cell 5)
             position_cell = cells[4]
             position_text = position_cell.get_text(strip=True)
             if "Goalkeeper" not in position_text:
+                metrics.count('parse_rows_rejected_total', source='transfers', reason='not_goalkeeper')
                 return None
             
             # Extract age (cell 6)
@@ -83,18 +141,12 @@ class MultiSeasonTransfermarktScraper:
             
             # Extract fee (cell 18)
             fee_cell = cells[17]
-            fee_text = fee_cell.get_text(strip=True)
-            fee = ""
-            # Extract numeric value from fee (e.g., "€31.20m" -> "31.20")
-            fee_match = re.search(r'€([\d.]+)m', fee_text)
-            if fee_match:
-                fee = fee_match.group(1)
-            else:
-                # Handle other fee formats
-                fee = fee_text
+            # Raw fee text (e.g. "€31.20m", "loan transfer"); converted to euros for the whole table in save_to_csv
+            fee = fee_cell.get_text(strip=True)
             
             return {
                 'Player': player_name,
+                'Player ID': player_id,
                 'Age': age,
                 'Season': season,
                 'Nationality': nationality,
@@ -105,6 +157,7 @@ class MultiSeasonTransfermarktScraper:
             
         except Exception as e:
             print(f"Error extracting player data: {e}")
+            metrics.count('parse_rows_rejected_total', source='transfers', reason='error')
             return None
     
     def scrape_transfers(self, url, season_name):
@@ -112,16 +165,69 @@ class MultiSeasonTransfermarktScraper:
         print(f"Scraping {season_name} transfers from: {url}")
         
         html_content = self.get_page(url)
-        if not html_content:
-            return []
+        return self.parse_transfer_page(html_content)
+    
+    def page_url(self, url, page):
+        """Construct the URL for a given page of a transfer list"""
+        if page == 1:
+            return url
+        # Add page parameter to URL (use ? for first parameter, & for subsequent)
+        if '?' in url:
+            return f"{url}&page={page}"
+        return f"{url}?page={page}"
+    
+    def scrape_transfer_history(self, seasons, max_pages=40):
+        """
+        Scrape every page of every season's transfer list. All (season, page) fetches share
+        the engine's worker pool: page 1 of every season is scheduled up front, and each full
+        page schedules the next one as soon as it finishes.
+        Returns {season name: transfers}, deduplicated on (player, season, from, to).
+        """
+        pending = {}
+        pages = {season['name']: {} for season in seasons}
+        for season in seasons:
+            print(f"Scraping {season['name']} transfers from: {season['url']}")
+            pending[self.engine.submit(season['url'])] = (season, 1)
         
-        soup = BeautifulSoup(html_content, 'html.parser')
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                season, page = pending.pop(future)
+                html_content = future.result()
+                if not html_content:
+                    print(f"Failed to fetch {season['name']} page {page}")
+                    continue
+                
+                row_count, transfers = self.parse_transfer_rows(html_content)
+                pages[season['name']][page] = transfers
+                
+                # A full page (25 rows) means there may be another one
+                if row_count >= 25 and page < max_pages:
+                    pending[self.engine.submit(self.page_url(season['url'], page + 1))] = (season, page + 1)
         
+        history = {}
+        for season in seasons:
+            season_pages = pages[season['name']]
+            history[season['name']] = unique_transfers(season_pages[page] for page in sorted(season_pages))
+            print(f"Scraped {len(history[season['name']])} {season['name']} transfers from {len(season_pages)} pages")
+        
+        return history
+    
+    def parse_transfer_page(self, html_content):
+        """Parse the transfer table out of a fetched page"""
+        return self.parse_transfer_rows(html_content)[1]
+    
+    def parse_transfer_rows(self, html_content):
+        """Parse a fetched page, returning (table row count, extracted goalkeeper transfers)"""
+        if not html_content:
+            return 0, []
+        
+        start = time.perf_counter()
         # Find the main table with transfer data
-        table = soup.find('table', class_='items')
+        table = self.find_items_table(html_content)
         if not table:
             print("Could not find transfer table")
-            return []
+            return 0, []
         
         transfers = []
         rows = table.find_all('tr', class_=['odd', 'even'])
@@ -134,59 +240,62 @@ class MultiSeasonTransfermarktScraper:
                 transfers.append(player_data)
                 print(f"Extracted: {player_data['Player']} - {player_data['Team Left']} -> {player_data['Team Joined']}")
         
-        return transfers
+        metrics.observe('parse_seconds', time.perf_counter() - start, source='transfers')
+        metrics.count('parse_rows_total', len(rows), source='transfers')
+        metrics.count('parse_rows_extracted_total', len(transfers), source='transfers')
+        
+        return len(rows), transfers
     
     def save_to_csv(self, transfers, filename):
-        """Save transfer data to CSV file"""
+        """Save transfer data to CSV file, returning the normalized table"""
         if not transfers:
             print("No transfers to save")
-            return
+            return None
         
-        fieldnames = ['Player', 'Age', 'Season', 'Nationality', 'Team Left', 'Team Joined', 'Fee']
+        fieldnames = ['Player', 'Player ID', 'Age', 'Season', 'Nationality', 'Team Left', 'Team Joined', 'Fee', 'Fee Kind']
         
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(transfers)
+        # Normalize the whole Fee column at once into euros plus a fee kind
+        transfers = pd.DataFrame(transfers)
+        normalized = normalize_fees(transfers['Fee'])
+        transfers['Fee'] = normalized['euros']
+        transfers['Fee Kind'] = normalized['kind']
+        transfers.to_csv(filename, columns=fieldnames, index=False, encoding='utf-8')
         
         print(f"Saved {len(transfers)} transfers to {filename}")
+        return transfers[fieldnames]
 
 def main():
+    parser = argparse.ArgumentParser(description="Scrape Transfermarkt goalkeeper transfer records, one CSV per season")
+    parser.add_argument('--first-season', type=int, default=2023, help="start year of the first season, e.g. 2023 for 2023-2024")
+    parser.add_argument('--last-season', type=int, default=2025, help="start year of the last season (inclusive)")
+    parser.add_argument('--max-pages', type=int, default=40, help="maximum pages to follow per season")
+    args = parser.parse_args()
+    
     # Initialize scraper
     scraper = MultiSeasonTransfermarktScraper()
     
     # Define URLs and season names
-    seasons = [
-        {
-            'url': "https://www.transfermarkt.us/transfers/transferrekorde/statistik/top/plus/1/galerie/0?saison_id=2025&land_id=&ausrichtung=&spielerposition_id=1&altersklasse=&jahrgang=0&leihe=&w_s=",
-            'name': '2025-2026',
-            'filename': 'goalkeeper_transfers_2025_2026.csv'
-        },
-        {
-            'url': "https://www.transfermarkt.us/transfers/transferrekorde/statistik/top/plus/1/galerie/0?saison_id=2024&land_id=&ausrichtung=&spielerposition_id=1&altersklasse=&jahrgang=0&leihe=&w_s=",
-            'name': '2024-2025',
-            'filename': 'goalkeeper_transfers_2024_2025.csv'
-        },
-        {
-            'url': "https://www.transfermarkt.us/transfers/transferrekorde/statistik/top/plus/1/galerie/0?saison_id=2023&land_id=&ausrichtung=&spielerposition_id=1&altersklasse=&jahrgang=0&leihe=&w_s=",
-            'name': '2023-2024',
-            'filename': 'goalkeeper_transfers_2023_2024.csv'
-        }
-    ]
+    seasons = season_entries(args.first_season, args.last_season)
     
     total_transfers = 0
     
+    # Schedule every (season, page) on the fetch engine's worker pool
+    history = scraper.scrape_transfer_history(seasons, max_pages=args.max_pages)
+    scraper.engine.close()
+    
+    store = Store()
+    
     for season in seasons:
+        transfers = history[season['name']]
         print(f"\n{'='*50}")
         print(f"Processing {season['name']} season...")
         print(f"{'='*50}")
         
-        # Scrape the transfers
-        transfers = scraper.scrape_transfers(season['url'], season['name'])
-        
+        metrics.set_gauge('rows_written', len(transfers), dataset='goalkeeper_transfers', season=season['name'])
         if transfers:
-            # Save to CSV
-            scraper.save_to_csv(transfers, season['filename'])
+            # Save to CSV, and upsert into the store (transfers already stored are left alone)
+            saved = scraper.save_to_csv(transfers, season['filename'])
+            store.upsert_dataset('transfers', apply_schema(saved, 'goalkeeper_transfers'))
             total_transfers += len(transfers)
             
             # Display first few entries as preview
@@ -196,6 +305,8 @@ def main():
         else:
             print(f"No transfers were scraped for {season['name']}. Please check the URL and try again.")
     
+    store.close()
+    
     print(f"\n{'='*50}")
     print(f"SCRAPING COMPLETE!")
     print(f"Total transfers scraped across all seasons: {total_transfers}")
@@ -203,6 +314,8 @@ def main():
     for season in seasons:
         print(f"  - {season['filename']}")
     print(f"{'='*50}")
+    
+    metrics.write_report('transfers')
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,354 @@
+"""
+Local SQLite store: player stats, transfers, market values and player identities.
+
+Scrapers and aggregators upsert just the rows they produced instead of rewriting
+whole files. Every write is one transaction, so a crash never leaves a half-written
+table, and the database runs in WAL mode so readers are never blocked by a writer.
+Rows are keyed by the stable player IDs from identity.PlayerIndex, assigned under the
+index's lock so parallel scrapers never give two players the same ID:
+
+    with Store() as store:
+        store.upsert_dataset('transfers', transfers)
+        recent = store.read('stats', seasons=['2024-2025'])
+"""
+import sqlite3
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+import metrics
+from identity import PlayerIndex
+from schema import apply_schema, get_schema
+
+STORE_FILE = 'networth.db'
+
+# Store tables: the registered dataset whose columns they hold, the columns that
+# identify a row, and the source ID column used to resolve each row's player
+TABLES = {
+    'stats': {
+        'dataset': 'goalkeeper_dataset',
+        'key': ['player_id', 'Season', 'Squad'],
+        'source_id': ('fbref_ids', 'fbref ID'),
+    },
+    'transfers': {
+        'dataset': 'goalkeeper_transfers',
+        'key': ['player_id', 'Season', 'Team Left', 'Team Joined'],
+        'source_id': ('transfermarkt_ids', 'Player ID'),
+    },
+    'market_values': {
+        'dataset': 'goalkeeper_market_values',
+        # Market values are point-in-time, so each is stored against the season it was scraped in
+        'key': ['player_id', 'Season'],
+        'source_id': ('transfermarkt_ids', 'Player ID'),
+    },
+}
+
+# Player IDs per IN (...) query, well under SQLite's bound-parameter limit
+ID_BATCH = 5_000
+
+# How long a writer waits for another process's transaction before giving up
+BUSY_TIMEOUT = 30
+
+def quote(name):
+    """Quote a column name for SQL (dataset columns include names like '#OPA/90')"""
+    return '"' + name.replace('"', '""') + '"'
+
+def sql_type(dtype):
+    if dtype.startswith('Int'):
+        return 'INTEGER'
+    if dtype.startswith('float'):
+        return 'REAL'
+    return 'TEXT'
+
+def table_columns(table):
+    """{column: SQL type} for a store table: player_id, any key columns the dataset lacks, then the dataset's columns"""
+    spec = TABLES[table]
+    schema = get_schema(spec['dataset'])
+    columns = {'player_id': 'INTEGER'}
+    columns.update({column: 'TEXT' for column in spec['key'] if column not in schema and column != 'player_id'})
+    columns.update({column: sql_type(dtype) for column, dtype in schema.items()})
+    return columns
+
+def sql_values(series):
+    """Column values as a list of Python objects sqlite3 can bind, with missing values as None"""
+    if series.dtype == 'float32':
+        # Go through the shortest decimal repr, so 0.7 is stored as 0.7 rather than 0.699999988;
+        # pyarrow formats and parses the whole column at once
+        return pa.array(series.to_numpy(), from_pandas=True).cast(pa.string()).cast(pa.float64()).to_pylist()
+    if pd.api.types.is_integer_dtype(series.dtype) or pd.api.types.is_float_dtype(series.dtype):
+        return series.to_numpy(object, na_value=None).tolist()
+    return series.astype('string').to_numpy(object, na_value=None).tolist()
+
+def sql_rows(df, columns):
+    return list(zip(*(sql_values(df[column]) for column in columns)))
+
+class Store:
+    """
+    SQLite store with one table per dataset plus a players table.
+    Writes are bulk upserts keyed on each table's key columns; a row is only
+    rewritten when one of its values actually changed.
+    """
+
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # With WAL, NORMAL only syncs at checkpoints; a power cut can lose the last commits but never corrupts
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.create_tables()
+
+    def create_tables(self):
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS players ('
+                'player_id INTEGER PRIMARY KEY, name TEXT, transfermarkt_id TEXT, fbref_id TEXT)'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS players_transfermarkt_id ON players (transfermarkt_id)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS players_fbref_id ON players (fbref_id)')
+            for table, spec in TABLES.items():
+                columns = ', '.join(f"{quote(column)} {kind}" for column, kind in table_columns(table).items())
+                key = ', '.join(quote(column) for column in spec['key'])
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns}, PRIMARY KEY ({key}))")
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_player_season ON {table} (player_id, Season)")
+
+    def write_rows(self, table, df, replace_seasons=False, keep_keys=False):
+        """
+        Upsert a frame's rows (inside the caller's transaction); returns the number of rows
+        inserted, changed or deleted. Columns the frame lacks are left as they are, and with
+        replace_seasons rows of the frame's seasons that are not in the frame are deleted.
+        With keep_keys the frame's keys are staged for a later delete_unkept instead.
+        """
+        spec = TABLES[table]
+        known = table_columns(table)
+        columns = [column for column in known if column in df.columns]
+        missing_keys = [column for column in spec['key'] if column not in columns]
+        if missing_keys:
+            raise KeyError(f"Rows for the {table} table need the key columns {', '.join(missing_keys)}")
+
+        # SQLite treats NULLs in a key as distinct from each other, so missing key text is stored as ''
+        text_keys = [column for column in spec['key'] if known[column] == 'TEXT']
+        df = df.assign(**{column: df[column].astype('string').fillna('') for column in text_keys})
+
+        updates = [column for column in columns if column not in spec['key']]
+        names = ', '.join(quote(column) for column in columns)
+        placeholders = ', '.join('?' for _ in columns)
+        key = ', '.join(quote(column) for column in spec['key'])
+        sql = f"INSERT INTO {table} ({names}) VALUES ({placeholders}) ON CONFLICT ({key}) DO "
+        if updates:
+            assignments = ', '.join(f"{quote(column)} = excluded.{quote(column)}" for column in updates)
+            changed = ' OR '.join(f"{table}.{quote(column)} IS NOT excluded.{quote(column)}" for column in updates)
+            sql += f"UPDATE SET {assignments} WHERE {changed}"
+        else:
+            sql += 'NOTHING'
+
+        # rowcount, unlike total_changes, leaves out rows that triggers (the rollups' dirty marks) write
+        changed = self.connection.executemany(sql, sql_rows(df, columns)).rowcount
+
+        if replace_seasons and len(df):
+            # Stage the frame's keys, then delete rows of its seasons whose keys are not among them
+            self.keep_keys(table, df)
+            changed += self.delete_unkept(table, seasons=sql_values(df['Season'].drop_duplicates()))
+        elif keep_keys:
+            self.keep_keys(table, df)
+
+        return changed
+
+    def keep_keys(self, table, df):
+        """Stage a frame's keys (with text keys already filled) in a temp table, for delete_unkept"""
+        key = ', '.join(quote(column) for column in TABLES[table]['key'])
+        self.connection.execute(f"CREATE TEMP TABLE IF NOT EXISTS kept_{table} AS SELECT {key} FROM {table} WHERE 0")
+        self.connection.execute(f"CREATE INDEX IF NOT EXISTS temp.kept_{table}_key ON kept_{table} ({key})")
+        self.connection.executemany(
+            f"INSERT INTO temp.kept_{table} VALUES ({', '.join('?' for _ in TABLES[table]['key'])})",
+            sql_rows(df, TABLES[table]['key']),
+        )
+
+    def delete_unkept(self, table, seasons=None, skip_seasons=()):
+        """
+        Delete the rows (of the given seasons, or of every season but skip_seasons) whose keys
+        keep_keys did not stage, then drop the staged keys (inside the caller's transaction);
+        returns the rows deleted
+        """
+        key = ', '.join(quote(column) for column in TABLES[table]['key'])
+        self.connection.execute(f"CREATE TEMP TABLE IF NOT EXISTS kept_{table} AS SELECT {key} FROM {table} WHERE 0")
+        matches = ' AND '.join(f"k.{quote(column)} = {table}.{quote(column)}" for column in TABLES[table]['key'])
+        where, params = '', []
+        if seasons is not None:
+            where, params = f"Season IN ({', '.join('?' for _ in seasons)}) AND ", list(seasons)
+        elif skip_seasons:
+            where, params = f"Season NOT IN ({', '.join('?' for _ in skip_seasons)}) AND ", list(skip_seasons)
+        deleted = self.connection.execute(
+            f"DELETE FROM {table} WHERE {where}NOT EXISTS (SELECT 1 FROM temp.kept_{table} k WHERE {matches})",
+            params,
+        ).rowcount
+        self.connection.execute(f"DROP TABLE temp.kept_{table}")
+        return deleted
+
+    def write_players(self, index, keys):
+        """
+        Upsert the identities behind the given player keys from a PlayerIndex (inside the
+        caller's transaction). A stored player whose Transfermarkt or fbref ID differs from
+        the index's is another player under the same key, so that raises instead of being overwritten.
+        """
+        rows = [(int(key), index.players[key]['name'], index.players[key]['transfermarkt_id'], index.players[key]['fbref_id'])
+                for key in sorted(set(int(key) for key in keys))]
+        for start in range(0, len(rows), ID_BATCH):
+            batch = {row[0]: row for row in rows[start:start + ID_BATCH]}
+            stored = self.connection.execute(
+                f"SELECT player_id, transfermarkt_id, fbref_id FROM players WHERE player_id IN ({', '.join('?' for _ in batch)})",
+                list(batch),
+            )
+            for player_id, transfermarkt_id, fbref_id in stored:
+                _, name, new_transfermarkt_id, new_fbref_id = batch[player_id]
+                if transfermarkt_id not in (None, new_transfermarkt_id) or fbref_id not in (None, new_fbref_id):
+                    raise ValueError(
+                        f"Player {player_id} is stored with IDs ({transfermarkt_id}, {fbref_id}) but the "
+                        f"player index has {name} ({new_transfermarkt_id}, {new_fbref_id}) under that key")
+        self.connection.executemany(
+            'INSERT INTO players (player_id, name, transfermarkt_id, fbref_id) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (player_id) DO UPDATE SET name = excluded.name, '
+            'transfermarkt_id = excluded.transfermarkt_id, fbref_id = excluded.fbref_id '
+            'WHERE players.transfermarkt_id IS NOT excluded.transfermarkt_id OR players.fbref_id IS NOT excluded.fbref_id',
+            rows,
+        )
+
+    def upsert(self, table, df, replace_seasons=False):
+        """Upsert rows that already carry a player_id column, as one transaction"""
+        start = time.perf_counter()
+        with self.connection:
+            changed = self.write_rows(table, df, replace_seasons)
+        metrics.observe('store_write_seconds', time.perf_counter() - start, table=table)
+        metrics.count('store_rows_changed_total', changed, table=table)
+        return changed
+
+    def upsert_dataset(self, table, df, index=None, replace_seasons=False, keep_keys=False):
+        """
+        Resolve every row's player with the PlayerIndex (by the table's source ID and name),
+        then upsert the players and the rows together as one transaction.
+        Without an index, the saved one is loaded, updated and saved under its lock; callers
+        passing their own must hold it through PlayerIndex.locked(). With keep_keys the rows'
+        keys are staged, so a later delete_unkept_rows removes every row not upserted since.
+        Returns the number of rows inserted, changed or deleted.
+        """
+        if index is None:
+            with PlayerIndex.locked() as index:
+                return self.upsert_dataset(table, df, index, replace_seasons, keep_keys)
+
+        # A lost index file restarts its keys at 1; new players must not take stored players' IDs
+        stored_max = self.connection.execute('SELECT MAX(player_id) FROM players').fetchone()[0]
+        index.next_key = max(index.next_key, (stored_max or 0) + 1)
+        id_argument, id_column = TABLES[table]['source_id']
+        keys = index.assign_keys(df['Player'], **{id_argument: df.get(id_column)})
+        start = time.perf_counter()
+        with self.connection:
+            self.write_players(index, keys.unique())
+            changed = self.write_rows(table, df.assign(player_id=keys), replace_seasons, keep_keys)
+        metrics.observe('store_write_seconds', time.perf_counter() - start, table=table)
+        metrics.count('store_rows_changed_total', changed, table=table)
+        print(f"Store: {changed} of {len(df)} {table} rows inserted or changed in {self.path}")
+        return changed
+
+    def resolve_players(self, table, df, index):
+        """
+        player_id of each row of a frame, resolved like upsert_dataset resolves them but never
+        added (missing for players the index does not know, whose rows were never stored)
+        """
+        id_argument, id_column = TABLES[table]['source_id']
+        ids = df[id_column].astype('string').fillna('') if id_column in df.columns else pd.Series('', index=df.index)
+        # resolve takes one ID (transfermarkt_id), where assign_keys takes a column of them (transfermarkt_ids)
+        player_ids = [index.resolve(name, fuzzy=False, **{id_argument[:-1]: source_id or None})
+                      for name, source_id in zip(df['Player'].astype('string').fillna(''), ids)]
+        return pd.Series(player_ids, index=df.index, dtype='Int64')
+
+    def delete_dataset_rows(self, table, df, index):
+        """Delete the stored rows with the keys of a frame's rows, as one transaction; returns the rows deleted"""
+        key = TABLES[table]['key']
+        known = table_columns(table)
+        keys = df.assign(player_id=self.resolve_players(table, df, index))
+        keys = keys.assign(**{column: keys[column].astype('string').fillna('') for column in key if known[column] == 'TEXT'})
+        keys = keys[keys['player_id'].notna()]
+        matches = ' AND '.join(f"{quote(column)} = ?" for column in key)
+        with self.connection:
+            deleted = self.connection.executemany(f"DELETE FROM {table} WHERE {matches}", sql_rows(keys, key)).rowcount
+        metrics.count('store_rows_changed_total', deleted, table=table)
+        return deleted
+
+    def update(self, table, df):
+        """
+        Update existing rows' values for the frame's non-key columns, as one transaction.
+        Rows missing from the table are skipped, and unchanged rows are not rewritten.
+        """
+        key = TABLES[table]['key']
+        known = table_columns(table)
+        df = df.assign(**{column: df[column].astype('string').fillna('') for column in key if known[column] == 'TEXT'})
+        updates = [column for column in known if column in df.columns and column not in key]
+        assignments = ', '.join(f"{quote(column)} = ?" for column in updates)
+        matches = ' AND '.join(f"{quote(column)} = ?" for column in key)
+        changed = ' OR '.join(f"{quote(column)} IS NOT ?" for column in updates)
+        values = sql_rows(df, updates)
+        keys = sql_rows(df, key)
+
+        start = time.perf_counter()
+        with self.connection:
+            changed_rows = self.connection.executemany(
+                f"UPDATE {table} SET {assignments} WHERE {matches} AND ({changed})",
+                [row + key_values + row for row, key_values in zip(values, keys)],
+            ).rowcount
+        metrics.observe('store_write_seconds', time.perf_counter() - start, table=table)
+        metrics.count('store_rows_changed_total', changed_rows, table=table)
+        return changed_rows
+
+    def delete_unkept_rows(self, table, skip_seasons=()):
+        """
+        Delete every row (except rows of skip_seasons) whose key no upsert_dataset(keep_keys=True)
+        staged, as one transaction; returns the rows deleted
+        """
+        with self.connection:
+            deleted = self.delete_unkept(table, skip_seasons=list(skip_seasons))
+        metrics.count('store_rows_changed_total', deleted, table=table)
+        print(f"Store: {deleted} {table} rows no longer in the dataset deleted from {self.path}")
+        return deleted
+
+    def delete_seasons(self, table, seasons):
+        """Delete every row of the given seasons, as one transaction; returns the rows deleted"""
+        seasons = list(seasons)
+        if not seasons:
+            return 0
+        with self.connection:
+            deleted = self.connection.execute(
+                f"DELETE FROM {table} WHERE Season IN ({', '.join('?' for _ in seasons)})", seasons).rowcount
+        metrics.count('store_rows_changed_total', deleted, table=table)
+        return deleted
+
+    def read(self, table, seasons=None, player_ids=None):
+        """Read a table (optionally only some seasons or players) with its dataset's registered dtypes"""
+        clauses, params = [], []
+        if seasons is not None:
+            clauses.append(f"Season IN ({', '.join('?' for _ in seasons)})")
+            params.extend(seasons)
+        if player_ids is not None:
+            clauses.append(f"player_id IN ({', '.join('?' for _ in player_ids)})")
+            params.extend(int(player_id) for player_id in player_ids)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        df = pd.read_sql_query(f"SELECT * FROM {table}{where}", self.connection, params=params)
+        return apply_schema(df, TABLES[table]['dataset'])
+
+    def counts(self):
+        """Row count of every table"""
+        return {table: self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ['players', *TABLES]}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == "__main__":
+    with Store() as store:
+        for table, rows in store.counts().items():
+            print(f"{table}: {rows} rows")
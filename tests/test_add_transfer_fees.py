@@ -0,0 +1,42 @@
+import os
+
+import pandas as pd
+
+from aggregators.add_transfer_fees import add_recent_fees, transfer_season_start
+
+DATASET_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'goalkeeper_dataset.csv')
+
+def test_transfer_season_start():
+    seasons = pd.Series(['24/25', '98/99', '00/01', 'n/a', None])
+    assert transfer_season_start(seasons).tolist()[:3] == [2024, 1998, 2000]
+    assert transfer_season_start(seasons).isna().tolist()[3:] == [True, True]
+
+def test_fee_is_the_latest_known_as_of_each_season(tmp_path, monkeypatch):
+    stats = pd.read_csv(DATASET_FILE).drop(columns=['Recent Fee'])
+    player = stats[stats['Player'] == 'Benjamin Lecomte'].head(3)
+    other = stats[stats['Player'] != 'Benjamin Lecomte'].head(2)
+    # One row with a season the join cannot place in time
+    undated = player.head(1).assign(Season='unknown', Squad='Elsewhere')
+    rows = pd.concat([player, undated, other], ignore_index=True)
+    monkeypatch.chdir(tmp_path)
+    rows.to_csv('goalkeeper_dataset.csv', index=False)
+    pd.DataFrame({
+        'Player': ['Benjamin Lecomte'] * 3,
+        'Player ID': ['1', '1', '1'],
+        'Season': ['21/22', '23/24', '25/26'],
+        'Team Left': ['A', 'B', 'C'],
+        'Team Joined': ['B', 'C', 'D'],
+        'Fee': ['€1.00m', 'Loan fee:€2.00m', '€9.00m'],
+    }).to_csv('goalkeeper_transfers_2023_2024.csv', index=False)
+
+    result = add_recent_fees()
+
+    # Row order is kept; the 2025/26 transfer must not leak into any earlier season
+    assert result['Player'].tolist() == rows['Player'].tolist()
+    assert result['Season'].astype('string').tolist() == rows['Season'].tolist()
+    fees = result['Recent Fee'].tolist()
+    assert fees[:3] == [2e6, 2e6, 1e6]
+    assert result['Recent Fee Kind'].astype('string').tolist()[:3] == ['loan', 'loan', 'paid']
+    # The undated row is kept, without a fee, and players without transfers get none either
+    assert result['Squad'].astype('string').tolist()[3] == 'Elsewhere'
+    assert result['Recent Fee'].iloc[3:].isna().all()
@@ -0,0 +1,40 @@
+import os
+
+import pandas as pd
+
+from aggregators import aggregate_keepers
+
+DATASET_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'goalkeeper_dataset.csv')
+
+def write_season_files(directory, stats):
+    for season, rows in stats.groupby('Season'):
+        rows.to_csv(directory / f"keepers_stats_{season.replace('-', '_')}.csv", index=False)
+
+def test_incremental_merge_matches_a_full_rebuild(tmp_path, monkeypatch):
+    stats = pd.read_csv(DATASET_FILE).drop(columns=['Recent Fee', 'Recent Fee Kind'], errors='ignore')
+    # Shuffle the rows, so the aggregation really has to sort them
+    stats = stats.sample(frac=1, random_state=0)
+    incremental, full = tmp_path / 'incremental', tmp_path / 'full'
+    incremental.mkdir()
+    full.mkdir()
+
+    write_season_files(incremental, stats)
+    monkeypatch.chdir(incremental)
+    aggregate_keepers.aggregate_streaming()
+
+    # One season loses players, gains new ones (sorting before and after the others) and changes a value
+    season = stats['Season'] == '2023-2024'
+    changed = stats[~(season & stats['Player'].isin(stats.loc[season, 'Player'].iloc[:10]))].copy()
+    changed.loc[changed.index[changed['Season'] == '2023-2024'][:3], 'GA'] += 1
+    new_players = changed[changed['Season'] == '2023-2024'].head(2).assign(Player=['Aaron New', 'Zoltan New'])
+    changed = pd.concat([changed, new_players])
+    write_season_files(incremental, changed)
+    rows = aggregate_keepers.aggregate_goalkeeper_stats(incremental=True)
+
+    write_season_files(full, changed)
+    monkeypatch.chdir(full)
+    assert aggregate_keepers.aggregate_streaming() == rows == len(changed)
+
+    for read, extension in [(pd.read_parquet, 'parquet'), (pd.read_csv, 'csv')]:
+        pd.testing.assert_frame_equal(read(incremental / f"goalkeeper_dataset.{extension}"),
+                                      read(full / f"goalkeeper_dataset.{extension}"))
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from aggregators import external_sort
+
+def player_season_key(df):
+    return pd.DataFrame({'player': df['Player'], 'season': df['Season']}, index=df.index)
+
+def test_merge_keeps_ties_in_input_order(tmp_path, monkeypatch):
+    # Runs of several row groups each, and more runs than one merge pass takes
+    monkeypatch.setattr(external_sort, 'BLOCK_ROWS', 40)
+    monkeypatch.setattr(external_sort, 'MAX_FAN_IN', 3)
+    rng = np.random.default_rng(0)
+    rows = 2_000
+    # Few distinct keys, so almost every row ties with rows of other runs
+    frame = pd.DataFrame({
+        'Player': rng.choice(['Alisson', 'Ederson', 'Oblak', 'Raya'], rows),
+        'Season': rng.choice(['2023-2024', '2024-2025'], rows),
+        'order': np.arange(rows),
+    })
+    chunks = (frame.iloc[start:start + 150] for start in range(0, rows, 150))
+
+    merged = pd.concat(external_sort.external_sort(chunks, player_season_key, str(tmp_path), rows=100), ignore_index=True)
+
+    expected = frame.sort_values(['Player', 'Season'], kind='stable').reset_index(drop=True)
+    pd.testing.assert_frame_equal(merged, expected)
+    assert not list(tmp_path.iterdir())
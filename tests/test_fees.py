@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+
+from fees import FEE_KINDS, normalize_fees
+
+def test_normalize_fees():
+    values = pd.Series(['€31.20m', '€500k', '€1.5bn', '€850Th.', 'Loan fee:€2.00m', 'loan transfer',
+                        'free transfer', '?', 'Undisclosed', '31.20', '-', None], index=range(10, 22))
+    normalized = normalize_fees(values)
+
+    assert normalized.index.equals(values.index)
+    np.testing.assert_array_equal(normalized['euros'].to_numpy(), [
+        31.2e6, 500e3, 1.5e9, 850e3, 2e6, np.nan, 0.0, np.nan, np.nan, 31.2e6, np.nan, np.nan])
+    assert normalized['kind'].tolist() == [
+        'paid', 'paid', 'paid', 'paid', 'loan', 'loan', 'free', 'undisclosed', 'undisclosed', 'paid', 'unknown', 'unknown']
+    assert normalized['kind'].cat.categories.tolist() == FEE_KINDS
+
+def test_normalize_fees_of_an_empty_column():
+    normalized = normalize_fees(pd.Series([], dtype='object'))
+    assert normalized.empty and list(normalized.columns) == ['euros', 'kind']
@@ -0,0 +1,89 @@
+import threading
+import time
+
+from benchmarks.replay_server import ReplayServer
+from scrapers.fetch_engine import AIMD_DECREASE, AIMD_INCREASE, FetchEngine, HostController
+
+def test_throttles_are_retried_without_opening_the_circuit():
+    # Retry-After 0 means no pause, so the test only waits for the backoff
+    with ReplayServer(pages=20, error_rate=0.5, retry_after=0, seed=1) as server:
+        # Throttles have their own retry budget, so none of them use up `retries`
+        engine = FetchEngine(max_workers=4, rate=50, burst=4, retries=0, backoff=0.01, failure_threshold=2, cooldown=60)
+        urls = [f"{server.url}/marktwertetop?page={page}" for page in range(1, 21)]
+        pages = dict(engine.fetch_many(urls))
+        engine.close()
+    assert server.counts['throttled'] >= engine.failure_threshold
+    assert all(pages[url] for url in urls)
+    controller = next(iter(engine.controllers.values()))
+    assert controller.opened_at is None and controller.failures == 0
+    assert controller.rate < 50
+
+def test_gives_up_after_the_throttle_retries():
+    with ReplayServer(error_rate=1.0, retry_after=0) as server:
+        engine = FetchEngine(rate=50, retries=0, throttle_retries=2, backoff=0.01)
+        assert engine.fetch(f"{server.url}/marktwertetop") is None
+        engine.close()
+    assert server.counts['requests'] == 3
+
+def test_not_found_is_not_retried():
+    with ReplayServer() as server:
+        engine = FetchEngine(rate=50, retries=2, backoff=0.01)
+        assert engine.fetch(f"{server.url}/missing") is None
+        engine.close()
+    assert server.counts['requests'] == 1
+    assert next(iter(engine.controllers.values())).failures == 0
+
+def test_aimd_rate():
+    controller = HostController('host', rate=1.0, burst=1, min_rate=0.3, max_rate=1.1)
+    controller.record_success()
+    assert controller.rate == 1.0 + AIMD_INCREASE
+    controller.record_success()
+    controller.record_success()
+    assert controller.rate == 1.1
+
+    controller.record_failure(throttled=True)
+    assert controller.rate == 1.1 * AIMD_DECREASE
+    # A second throttle within the same request interval is the same congestion signal
+    controller.record_failure(throttled=True)
+    assert controller.rate == 1.1 * AIMD_DECREASE
+    controller.last_decrease = 0.0
+    controller.record_failure(throttled=True)
+    assert controller.rate == 0.3
+
+def test_circuit_breaker_trial():
+    controller = HostController('host', rate=1.0, burst=1, min_rate=1.0, max_rate=1.0, failure_threshold=2, cooldown=0.2)
+    controller.record_failure()
+    controller.wait_for_circuit()
+    assert controller.opened_at is None
+    controller.record_failure()
+    assert controller.opened_at is not None
+
+    # Requests wait out the cooldown, then one goes through as the trial
+    start = time.monotonic()
+    controller.wait_for_circuit()
+    assert time.monotonic() - start >= 0.15
+    assert controller.trial_in_flight
+
+    # The others wait for the trial's outcome; a failed trial reopens the circuit
+    waiter = threading.Thread(target=controller.wait_for_circuit)
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+    controller.record_failure()
+    assert controller.opened_at is not None and not controller.trial_in_flight
+
+    # The waiter becomes the next trial; a success closes the circuit
+    waiter.join(1)
+    assert not waiter.is_alive() and controller.trial_in_flight
+    controller.record_success()
+    assert controller.opened_at is None and controller.failures == 0
+    controller.wait_for_circuit()
+
+def test_throttled_trial_closes_the_circuit():
+    controller = HostController('host', rate=1.0, burst=1, min_rate=0.5, max_rate=1.0, failure_threshold=1, cooldown=0.05)
+    controller.record_failure()
+    controller.wait_for_circuit()
+    assert controller.trial_in_flight
+    controller.record_failure(throttled=True)
+    assert controller.opened_at is None and not controller.trial_in_flight
+    assert controller.failures == 1
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from benchmarks.replay_server import ReplayServer
+from scrapers.market_value_scraper import GoalkeeperMarketValueScraper
+
+def crawl(tmp_path, server, **kwargs):
+    scraper = GoalkeeperMarketValueScraper(cache_dir=None, rate=50)
+    try:
+        return scraper.crawl_market_values(f"{server.url}/marktwertetop", filename=str(tmp_path / 'values.csv'),
+                                           checkpoint_file=str(tmp_path / 'values.checkpoint.json'), **kwargs)
+    finally:
+        scraper.engine.close()
+
+def test_crawl_after_a_finished_crawl_starts_fresh(tmp_path):
+    with ReplayServer(pages=2) as server:
+        assert crawl(tmp_path, server) == 50
+        requests = server.counts['requests']
+        assert crawl(tmp_path, server) == 50
+        assert server.counts['requests'] > requests
+    assert len(pd.read_csv(tmp_path / 'values.csv')) == 50
+
+def test_resume_after_a_crash_in_the_first_append(tmp_path):
+    with ReplayServer(pages=2) as server:
+        # A crawl that crashed while appending its first rows: the checkpoint still has no file size
+        (tmp_path / 'values.checkpoint.json').write_text(
+            f'{{"base_url": "{server.url}/marktwertetop", "filename": "{tmp_path / "values.csv"}", '
+            '"last_page": 0, "row_count": 0, "file_size": 0, "finished": false}')
+        (tmp_path / 'values.csv').write_text('Rank,Player,Player ID,Age\n1,Half a ro')
+        assert crawl(tmp_path, server) == 50
+    values = pd.read_csv(tmp_path / 'values.csv')
+    assert len(values) == 50 and 'Player' in values.columns
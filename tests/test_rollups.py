@@ -0,0 +1,28 @@
+import os
+
+import pandas as pd
+
+import rollups
+from identity import PlayerIndex
+from store import Store
+
+DATASET_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'goalkeeper_dataset.csv')
+
+def test_changed_rows_upsert_after_refresh(tmp_path):
+    stats = pd.read_csv(DATASET_FILE).head(20)
+    index = PlayerIndex()
+    with Store(str(tmp_path / 'networth.db')) as store:
+        store.upsert_dataset('stats', stats, index)
+        players = rollups.refresh_rollups(store)
+
+        # The update trigger marks the changed row's player dirty again
+        changed = stats.copy()
+        changed.loc[0, 'GA'] += 1
+        assert store.upsert_dataset('stats', changed, index) == 1
+        # Rows of a player that is still dirty must upsert too
+        changed['GA'] += 1
+        assert store.upsert_dataset('stats', changed, index) == len(stats)
+
+        assert rollups.refresh_rollups(store) == players
+        career = rollups.read_rollups(store, 'career')
+        assert career['GA'].sum() == changed['GA'].sum()
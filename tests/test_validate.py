@@ -0,0 +1,69 @@
+import os
+
+import pandas as pd
+
+import validate
+from store import Store
+
+DATASET_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'goalkeeper_dataset.csv')
+
+def test_quarantine_moves_bad_rows_out_of_the_files_and_the_store(tmp_path, monkeypatch):
+    stats = pd.read_csv(DATASET_FILE).drop(columns=['Recent Fee'])
+    stats = stats[stats['Season'] == '2023-2024'].reset_index(drop=True)
+    # A repeated fbref header row, a negative goal count and an impossible age
+    stats.loc[3, ['Player', 'Season', 'Squad']] = ['Player', 'Season', 'Squad']
+    stats.loc[5, 'GA'] = -1
+    stats.loc[7, 'Age'] = 99
+    bad_players = stats.loc[[5, 7], 'Player'].tolist()
+    monkeypatch.chdir(tmp_path)
+    stats.to_csv('keepers_stats_2023_2024.csv', index=False)
+    # The scraper has already upserted every row, bad ones included
+    with Store() as store:
+        store.upsert_dataset('stats', stats)
+
+    report = validate.validate(datasets=['keepers_stats'])
+
+    assert report['ok'] and report['quarantined'] == {'keepers_stats': 3}
+    checks = {(check['check'], check['column']) for check in report['datasets']['keepers_stats']['checks']}
+    assert {('header_row', 'Player'), ('range', 'GA'), ('range', 'Age')} <= checks
+
+    clean = pd.read_csv('keepers_stats_2023_2024.csv')
+    assert len(clean) == len(stats) - 3 and list(clean.columns) == list(stats.columns)
+    assert not clean['Player'].isin(bad_players + ['Player']).any()
+    quarantined = pd.read_csv(os.path.join('quarantine', 'keepers_stats_2023_2024.csv'))
+    assert sorted(quarantined['Player']) == sorted(bad_players + ['Player'])
+    assert quarantined['Failed Checks'].notna().all()
+
+    with Store() as store:
+        stored = store.read('stats')
+    assert len(stored) == len(clean)
+    assert not stored['Player'].isin(bad_players + ['Player']).any()
+
+    # Validating the cleaned files again finds nothing to quarantine
+    assert validate.validate(datasets=['keepers_stats'])['quarantined'] == {'keepers_stats': 0}
+
+def test_report_only_rewrites_nothing(tmp_path, monkeypatch):
+    stats = pd.read_csv(DATASET_FILE).drop(columns=['Recent Fee'])
+    stats = stats[stats['Season'] == '2024-2025'].reset_index(drop=True)
+    stats.loc[2, 'Cmp%'] = 140
+    monkeypatch.chdir(tmp_path)
+    stats.to_csv('keepers_stats_2024_2025.csv', index=False)
+    before = open('keepers_stats_2024_2025.csv', 'rb').read()
+
+    report = validate.validate(datasets=['keepers_stats'], report_only=True)
+
+    assert report['datasets']['keepers_stats']['bad_rows'] == 1 and report['quarantined'] == {}
+    assert open('keepers_stats_2024_2025.csv', 'rb').read() == before
+    assert not os.path.exists('quarantine')
+
+def test_too_many_bad_rows_fail_without_quarantining(tmp_path, monkeypatch):
+    stats = pd.read_csv(DATASET_FILE).drop(columns=['Recent Fee'])
+    stats = stats[stats['Season'] == '2024-2025'].reset_index(drop=True)
+    stats.loc[:20, 'GA'] = -1
+    monkeypatch.chdir(tmp_path)
+    stats.to_csv('keepers_stats_2024_2025.csv', index=False)
+
+    report = validate.validate(datasets=['keepers_stats'])
+
+    assert not report['ok'] and report['quarantined'] == {}
+    assert len(pd.read_csv('keepers_stats_2024_2025.csv')) == len(stats)
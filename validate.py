@@ -0,0 +1,463 @@
+"""
+Data-quality validation of scraped files, run between the scrapers and the aggregators.
+
+Each dataset declares its checks in RULES: required columns, missing values, leftover
+header rows, numeric types, value ranges, season formats, categories, unique keys,
+the season a file is named for, and IDs that must mean the same player across files.
+Every check is one vectorized pass over a column of all the dataset's files at once.
+
+Rows failing an error check are moved to quarantine/ (with the checks they failed), the
+source files are rewritten without them and, since the scrapers have already upserted
+them, they are taken back out of the store; warnings are only reported. If a dataset
+has more bad rows than --max-bad-fraction, or a file lacks a required column, nothing is
+rewritten and the run fails, so the pipeline stops before aggregating a bad scrape:
+
+    python validate.py
+    python validate.py --report-only
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+import metrics
+from fees import FEE_KINDS, normalize_fees
+from identity import PlayerIndex
+from schema import MONEY_COLUMNS, apply_schema
+from scrapers.stat_scraper import current_season
+from store import STORE_FILE, TABLES, Store
+
+REPORT_FILE = 'validation_report.json'
+QUARANTINE_DIR = 'quarantine'
+
+# Largest share of a dataset's rows that may be quarantined before the whole run counts as bad
+MAX_BAD_FRACTION = 0.05
+
+# Failing rows listed per check in the report
+EXAMPLE_ROWS = 5
+
+# Store table each dataset's scraper upserts its rows into before validation runs
+STORE_TABLES = {'keepers_stats': 'stats', 'goalkeeper_transfers': 'transfers', 'goalkeeper_market_values': 'market_values'}
+
+PERCENT_COLUMNS = ['Cmp%', 'Launch%', 'Launch%.1', 'Stp%']
+# Stats that can never be negative (PSxG+/- and its per-90 rate can)
+NON_NEGATIVE_STATS = [
+    '90s', 'GA', 'PKA', 'FK', 'CK', 'OG', 'PSxG', 'PSxG/SoT', 'Cmp', 'Att', 'Att (GK)', 'Thr',
+    'AvgLen', 'Att.1', 'AvgLen.1', 'Opp', 'Stp', '#OPA', '#OPA/90', 'AvgDist',
+]
+AGE_RANGE = (14, 50)
+
+# Checks per dataset. Failures of every check are errors (the row is quarantined) unless
+# the check is listed under 'warn'. 'file_season' maps the filename's season digits to the
+# Season every row of that file must have; 'consistent' keys must map to a single value
+# across all files of the dataset and of the listed datasets
+RULES = {
+    'keepers_stats': {
+        'files': 'keepers_stats_*.csv',
+        'required': ['Player', 'Season', 'Squad', '90s'],
+        'not_null': ['Player', 'Season', 'Squad'],
+        # fbref repeats its header row every 25 rows
+        'forbidden': {'Player': ['Player'], 'Season': ['Season'], 'Squad': ['Squad']},
+        'numeric': ['Age', 'Born', '90s', 'GA', 'PKA', 'FK', 'CK', 'OG', 'PSxG', 'PSxG/SoT', 'PSxG+/-', '/90',
+                    'Cmp', 'Att', 'Cmp%', 'Att (GK)', 'Thr', 'Launch%', 'AvgLen', 'Att.1', 'Launch%.1', 'AvgLen.1',
+                    'Opp', 'Stp', 'Stp%', '#OPA', '#OPA/90', 'AvgDist'],
+        'ranges': {
+            **{column: (0, None) for column in NON_NEGATIVE_STATS},
+            **{column: (0, 100) for column in PERCENT_COLUMNS},
+            'Age': AGE_RANGE,
+            'Born': (1940, None),
+        },
+        'patterns': {'Season': r'\d{4}-\d{4}'},
+        'unique': [['Player', 'Season', 'Squad']],
+        'file_season': (r'keepers_stats_(\d{2})(\d{2})_(\d{2})(\d{2})', '{0}{1}-{2}{3}'),
+        'consistent': [{'key': 'fbref ID', 'value': 'Born'}],
+        'warn': ['consistent'],
+    },
+    'goalkeeper_transfers': {
+        'files': 'goalkeeper_transfers_*.csv',
+        'required': ['Player', 'Season', 'Team Left', 'Team Joined', 'Fee'],
+        'not_null': ['Player', 'Season'],
+        'forbidden': {'Player': ['Player']},
+        'numeric': ['Age', 'Fee'],
+        'ranges': {'Age': AGE_RANGE, 'Fee': (0, None)},
+        'patterns': {'Season': r'\d{2}/\d{2}'},
+        'categories': {'Fee Kind': FEE_KINDS},
+        'unique': [['Player', 'Season', 'Team Left', 'Team Joined']],
+        'file_season': (r'goalkeeper_transfers_(\d{2})(\d{2})_(\d{2})(\d{2})', '{1}/{3}'),
+        'consistent': [{'key': 'Player ID', 'value': 'Player', 'datasets': ['goalkeeper_market_values']}],
+        # A list can include a deal registered in a neighbouring season, and players get renamed
+        'warn': ['file_season', 'consistent'],
+    },
+    'goalkeeper_market_values': {
+        'files': 'goalkeeper_market_values.csv',
+        'required': ['Player', 'Market Value'],
+        'not_null': ['Player'],
+        'forbidden': {'Player': ['Player']},
+        'numeric': ['Rank', 'Age', 'Market Value'],
+        'ranges': {'Rank': (1, None), 'Age': AGE_RANGE, 'Market Value': (0, None)},
+        'categories': {'Market Value Kind': FEE_KINDS},
+        'unique': [['Player ID']],
+    },
+}
+
+# Numbers as the scrapers write them, and fbref's current-season ages ("years-days", e.g. "26-123")
+NUMBER_PATTERN = r'^-?(\d+(\.\d+)?|\.\d+)([eE][-+]?\d+)?$'
+AGE_PATTERN = r'^\d+(-\d+)?$'
+
+def unique_names(names):
+    """Column names made unique the way pandas reads them, so a repeated 'Att' is 'Att.1' as the aggregator sees it"""
+    counts = {}
+    unique = []
+    for name in names:
+        candidate = name
+        while candidate in unique:
+            counts[name] = counts.get(name, 0) + 1
+            candidate = f"{name}.{counts[name]}"
+        unique.append(candidate)
+    return unique
+
+def read_file(filename):
+    """One CSV file's header and its cells as text exactly as written, with empty cells as ''"""
+    with open(filename, newline='', encoding='utf-8') as f:
+        header = next(csv.reader(f), [])
+    if not header:
+        return header, pa.table({})
+    options = pv.ConvertOptions(column_types={name: pa.string() for name in header}, strings_can_be_null=False)
+    return header, pv.read_csv(filename, convert_options=options).rename_columns(unique_names(header))
+
+def to_mask(array):
+    """Arrow boolean result as a NumPy mask, with nulls as False"""
+    return pc.fill_null(array, False).to_numpy(zero_copy_only=False)
+
+def parse_numbers(text, column):
+    """A text column's numbers (null where empty or unparseable) and the mask of non-empty cells that are not numbers"""
+    text = pc.utf8_trim_whitespace(text)
+    empty = pc.equal(text, '')
+    if column != 'Age':
+        try:
+            # A clean column casts in one pass; only a column holding a bad cell pays for the regex
+            return pc.cast(pc.if_else(empty, pa.scalar(None, pa.string()), text), pa.float64()), np.zeros(len(text), dtype=bool)
+        except pa.ArrowInvalid:
+            pass
+    valid = pc.match_substring_regex(text, AGE_PATTERN if column == 'Age' else NUMBER_PATTERN)
+    if column == 'Age':
+        text = pc.replace_substring_regex(text, r'-\d+$', '')
+    values = pc.cast(pc.if_else(valid, text, pa.scalar(None, pa.string())), pa.float64())
+    return values, to_mask(pc.and_(pc.invert(valid), pc.invert(empty)))
+
+def row_numbers(rows):
+    return pa.array(np.arange(rows))
+
+def duplicated(table, keys):
+    """Rows repeating the keys of an earlier row; rows with an empty key part are never duplicates"""
+    complete = np.logical_and.reduce([to_mask(pc.not_equal(table[key], '')) for key in keys])
+    rows = pa.table({**{key: table[key] for key in keys}, '__row': row_numbers(table.num_rows)}).filter(pa.array(complete))
+    groups = rows.group_by(keys, use_threads=False).aggregate([('__row', 'min'), ('__row', 'count')])
+    # Only rows of repeated keys are joined back to their group's first row
+    repeated = groups.filter(pc.greater(groups['__row_count'], 1))
+    mask = np.zeros(table.num_rows, dtype=bool)
+    if repeated.num_rows:
+        joined = rows.join(repeated.select(keys + ['__row_min']), keys, join_type='inner')
+        row, first_row = joined['__row'].to_numpy(), joined['__row_min'].to_numpy()
+        mask[row[row != first_row]] = True
+    return mask
+
+class Dataset:
+    """A dataset's files read as one table of text columns, with every row's file and CSV line number"""
+
+    def __init__(self, pattern):
+        self.files = sorted(glob.glob(pattern))
+        read = [read_file(filename) for filename in self.files]
+        self.headers = [header for header, _ in read]
+        tables = [table for _, table in read]
+        self.file_index = np.concatenate([np.full(table.num_rows, i) for i, table in enumerate(tables)] or [np.zeros(0, dtype=int)])
+        self.lines = np.concatenate([np.arange(table.num_rows) + 2 for table in tables] or [np.zeros(0, dtype=int)])
+        table = pa.concat_tables([table for table in tables if table.num_columns], promote_options='default') \
+            if any(table.num_columns for table in tables) else pa.table({})
+        # Columns some files lack are empty text, like any other missing value
+        self.table = pa.table({name: pc.fill_null(table[name], '') for name in table.column_names})
+        self.columns = self.table.column_names
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def file_rows(self, i):
+        """Slice of the table holding file i's rows"""
+        offset = int(np.searchsorted(self.file_index, i))
+        return offset, int(np.searchsorted(self.file_index, i, side='right')) - offset
+
+class Validation:
+    """Runs one dataset's rules over its files, collecting a failure mask per check"""
+
+    def __init__(self, name, dataset, datasets):
+        self.name = name
+        self.rules = RULES[name]
+        self.dataset = dataset
+        self.table = dataset.table
+        self.datasets = datasets
+        self.failures = {}      # 'check:column' -> boolean mask over the rows
+        self.severity = {}
+        self.file_errors = []
+        # Leftover header rows fail every other check too; they are reported once, as header rows
+        self.header_rows = np.zeros(len(dataset), dtype=bool)
+
+    def fail(self, check, column, mask):
+        label = f"{check}:{column}"
+        mask = np.asarray(mask, dtype=bool)
+        self.failures[label] = mask if check == 'header_row' else mask & ~self.header_rows
+        self.severity[label] = 'warning' if check in self.rules.get('warn', []) else 'error'
+
+    def raw_money(self, column):
+        """Money columns from before fee normalization hold Transfermarkt text (no kind column next to them)"""
+        money = MONEY_COLUMNS.get(self.name, {})
+        return column in money and money[column] not in self.dataset.columns
+
+    def run(self):
+        table, rules, columns = self.table, self.rules, self.dataset.columns
+        # A file without a required column cannot be checked (or aggregated) at all
+        for i, filename in enumerate(self.dataset.files):
+            header = unique_names(self.dataset.headers[i])
+            absent = [column for column in rules.get('required', []) if column not in header]
+            if absent:
+                self.file_errors.append({'file': filename, 'missing_columns': absent})
+
+        text = {column: table[column] for column in columns}
+        for column in rules.get('not_null', []):
+            if column in text:
+                self.fail('not_null', column, to_mask(pc.equal(pc.utf8_trim_whitespace(text[column]), '')))
+        for column, values in rules.get('forbidden', {}).items():
+            if column in text:
+                self.fail('header_row', column, to_mask(pc.is_in(text[column], value_set=pa.array(values))))
+                self.header_rows |= self.failures[f"header_row:{column}"]
+
+        numbers = {}
+        for column in rules.get('numeric', []):
+            if column not in text:
+                continue
+            if self.raw_money(column):
+                # Read the text as the schema would; amounts it cannot read are its 'unknown' kind, not type errors
+                numbers[column] = pa.array(normalize_fees(text[column].to_pandas())['euros'], from_pandas=True)
+                continue
+            numbers[column], invalid = parse_numbers(text[column], column)
+            self.fail('type', column, invalid)
+        for column, (low, high) in rules.get('ranges', {}).items():
+            if column in numbers:
+                out = np.zeros(len(self.dataset), dtype=bool)
+                if low is not None:
+                    out |= to_mask(pc.less(numbers[column], low))
+                if high is not None:
+                    out |= to_mask(pc.greater(numbers[column], high))
+                self.fail('range', column, out)
+
+        for column, pattern in rules.get('patterns', {}).items():
+            if column in text:
+                matches = pc.match_substring_regex(text[column], f"^(?:{pattern})$")
+                self.fail('format', column, to_mask(pc.and_(pc.invert(matches), pc.not_equal(text[column], ''))))
+        for column, values in rules.get('categories', {}).items():
+            if column in text:
+                known = pc.is_in(text[column], value_set=pa.array(values))
+                self.fail('category', column, to_mask(pc.and_(pc.invert(known), pc.not_equal(text[column], ''))))
+
+        for keys in rules.get('unique', []):
+            if all(key in text for key in keys):
+                # The first of each set of duplicates is kept
+                self.fail('duplicate', '+'.join(keys), duplicated(table, keys))
+
+        if 'file_season' in rules and 'Season' in text:
+            pattern, template = rules['file_season']
+            expected = []
+            for filename in self.dataset.files:
+                match = re.search(pattern, os.path.basename(filename))
+                expected.append(template.format(*match.groups()) if match else None)
+            season = pc.take(pa.array(expected, type=pa.string()), pa.array(self.dataset.file_index))
+            mismatch = pc.and_(pc.not_equal(text['Season'], season), pc.not_equal(text['Season'], ''))
+            self.fail('file_season', 'Season', to_mask(mismatch))
+
+        for rule in rules.get('consistent', []):
+            key, value = rule['key'], rule['value']
+            if key not in text or value not in text:
+                continue
+            others = [self.datasets[other].table for other in rule.get('datasets', [])
+                      if other in self.datasets and {key, value} <= set(self.datasets[other].columns)]
+            pairs = pa.concat_tables([source.select([key, value]) for source in [table] + others])
+            pairs = pairs.filter(pc.and_(pc.not_equal(pairs[key], ''), pc.not_equal(pairs[value], '')))
+            values_per_key = pairs.group_by(key, use_threads=False).aggregate([(value, 'count_distinct')])
+            conflicting = values_per_key.filter(pc.greater(values_per_key[f"{value}_count_distinct"], 1))[key].combine_chunks()
+            mask = to_mask(pc.is_in(table[key], value_set=conflicting))
+            self.fail('consistent', f"{key}->{value}", mask)
+        return self
+
+    def bad_rows(self):
+        """Mask of rows failing any error check"""
+        errors = [mask for label, mask in self.failures.items() if self.severity[label] == 'error']
+        return np.logical_or.reduce(errors) if errors else np.zeros(len(self.dataset), dtype=bool)
+
+    def reasons(self, mask):
+        """'check:column; ...' of the error checks each selected row failed"""
+        labels = [label for label in self.failures if self.severity[label] == 'error']
+        if not labels:
+            return np.full(int(mask.sum()), '', dtype=object)
+        failed = np.column_stack([self.failures[label][mask] for label in labels])
+        # bool * str is the label or '' for every cell, summed across the checks
+        text = (failed * np.array([f"{label}; " for label in labels], dtype=object)).sum(axis=1)
+        return np.array([reasons.rstrip('; ') for reasons in text], dtype=object)
+
+    def report(self, max_bad_fraction):
+        bad = self.bad_rows()
+        rows = len(self.dataset)
+        checks = []
+        for label, mask in self.failures.items():
+            count = int(mask.sum())
+            if not count:
+                continue
+            check, column = label.split(':', 1)
+            examples = np.flatnonzero(mask)[:EXAMPLE_ROWS]
+            checks.append({
+                'check': check,
+                'column': column,
+                'severity': self.severity[label],
+                'failures': count,
+                'examples': [{'file': self.dataset.files[self.dataset.file_index[row]], 'line': int(self.dataset.lines[row])}
+                             for row in examples],
+            })
+            metrics.count('validation_failures_total', count, dataset=self.name, check=check, severity=self.severity[label])
+        bad_fraction = float(bad.sum()) / rows if rows else 0.0
+        return {
+            'files': self.dataset.files,
+            'rows': rows,
+            'bad_rows': int(bad.sum()),
+            'bad_fraction': round(bad_fraction, 6),
+            'file_errors': self.file_errors,
+            'checks': checks,
+            'ok': not self.file_errors and bad_fraction <= max_bad_fraction,
+        }
+
+    def quarantine(self, directory=QUARANTINE_DIR):
+        """Append bad rows (with their failed checks) to quarantine/<file> and rewrite each source file without them"""
+        bad = self.bad_rows()
+        if not bad.any():
+            return 0
+        os.makedirs(directory, exist_ok=True)
+        validated_at = pd.Timestamp.now(tz='UTC').isoformat()
+        for i, filename in enumerate(self.dataset.files):
+            offset, length = self.dataset.file_rows(i)
+            file_bad = bad[offset:offset + length]
+            if not file_bad.any():
+                continue
+            # The file's own columns, written back under its original header
+            header = self.dataset.headers[i]
+            rows = self.table.slice(offset, length).select(unique_names(header)).to_pandas().set_axis(header, axis=1)
+            # Reasons come in row order over all files; this file's are the slice between the bad rows before and after it
+            reasons = self.reasons(bad)[np.count_nonzero(bad[:offset]):np.count_nonzero(bad[:offset + length])]
+            quarantined = rows[file_bad].assign(**{'Failed Checks': reasons, 'Validated At': validated_at})
+            quarantine_path = os.path.join(directory, os.path.basename(filename))
+            quarantined.to_csv(quarantine_path, mode='a', header=not os.path.exists(quarantine_path), index=False)
+            # Write then rename, so a crash never leaves a half-written input file
+            rows[~file_bad].to_csv(f"{filename}.tmp", index=False)
+            os.replace(f"{filename}.tmp", filename)
+            print(f"Quarantined {int(file_bad.sum())} rows of {filename} in {quarantine_path}")
+        return int(bad.sum())
+
+    def sync_store(self, store, index):
+        """
+        Take quarantined rows back out of the store, which the scrapers wrote before validation:
+        delete their keys, except keys a clean row also has, which are rewritten from that clean
+        row. Returns the number of stored rows deleted or changed.
+        """
+        bad = self.bad_rows()
+        if not bad.any():
+            return 0
+        table = STORE_TABLES[self.name]
+        _, id_column = TABLES[table]['source_id']
+        # A stored row's key is its player (name and source ID) plus the table's other key columns
+        columns = [column for column in ['Player', id_column] + TABLES[table]['key'] if column in self.dataset.columns]
+        keys = pc.binary_join_element_wise(*[self.table[column] for column in columns], '\x1f')
+        bad_array = pa.array(bad)
+        shared = to_mask(pc.is_in(keys, value_set=pc.unique(keys.filter(bad_array)))) & ~bad
+        removed = bad & ~to_mask(pc.is_in(keys, value_set=pc.unique(keys.filter(pc.invert(bad_array)))))
+
+        def rows(mask):
+            frame = self.table.filter(pa.array(mask)).to_pandas()
+            frame = frame.mask(frame == '')
+            # Market values are stored against the season they were scraped in, as the scraper does
+            return frame if 'Season' in frame.columns else frame.assign(Season=current_season())
+
+        deleted = store.delete_dataset_rows(table, rows(removed), index) if removed.any() else 0
+        restored = 0
+        if shared.any():
+            clean = apply_schema(rows(shared), self.name)
+            clean = clean.assign(player_id=store.resolve_players(table, clean, index)).dropna(subset=['player_id'])
+            restored = store.update(table, clean)
+        print(f"Store: deleted {deleted} quarantined {self.name} rows, restored {restored} from clean rows")
+        return deleted + restored
+
+def validate(datasets=tuple(RULES), report_only=False, max_bad_fraction=MAX_BAD_FRACTION, report_file=REPORT_FILE):
+    """
+    Validate every dataset's files, write the JSON report and, unless report_only or a
+    dataset is too broken to trust, quarantine bad rows. Returns the report.
+    """
+    start = time.perf_counter()
+    loaded = {name: Dataset(RULES[name]['files']) for name in RULES}
+    with metrics.timer('validation_seconds'):
+        validations = {name: Validation(name, loaded[name], loaded).run() for name in datasets}
+    results = {name: validation.report(max_bad_fraction) for name, validation in validations.items()}
+    ok = all(result['ok'] for result in results.values())
+
+    quarantined = {}
+    store_changes = {}
+    if ok and not report_only:
+        quarantined = {name: validation.quarantine() for name, validation in validations.items()}
+        # Without a store (the scrapers have not written one yet) there is nothing to take back
+        if any(quarantined.values()) and os.path.exists(STORE_FILE):
+            with Store() as store, PlayerIndex.locked() as index:
+                store_changes = {name: validation.sync_store(store, index)
+                                 for name, validation in validations.items() if quarantined[name]}
+    report = {
+        'validated_at': pd.Timestamp.now(tz='UTC').isoformat(),
+        'seconds': round(time.perf_counter() - start, 3),
+        'ok': ok,
+        'max_bad_fraction': max_bad_fraction,
+        'quarantined': quarantined,
+        'store_rows_changed': store_changes,
+        'datasets': results,
+    }
+    tmp_path = f"{report_file}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, report_file)
+
+    for name, result in results.items():
+        status = 'ok' if result['ok'] else 'FAILED'
+        print(f"{name}: {result['rows']} rows in {len(result['files'])} files, {result['bad_rows']} bad ({status})")
+        for check in result['checks']:
+            print(f"  {check['severity']}: {check['check']} {check['column']} x{check['failures']}")
+        for error in result['file_errors']:
+            print(f"  error: {error['file']} lacks {', '.join(error['missing_columns'])}")
+    print(f"Wrote validation report to {report_file}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate scraped files before aggregation, quarantining bad rows")
+    parser.add_argument('--datasets', nargs='+', default=list(RULES), choices=list(RULES))
+    parser.add_argument('--report-only', action='store_true', help="report problems without quarantining rows")
+    parser.add_argument('--max-bad-fraction', type=float, default=MAX_BAD_FRACTION,
+                        help="fail (and quarantine nothing) when more of a dataset's rows than this are bad")
+    parser.add_argument('--report', default=REPORT_FILE, help="JSON report path")
+    args = parser.parse_args()
+
+    report = validate(args.datasets, args.report_only, args.max_bad_fraction, args.report)
+    metrics.write_report('validate')
+    if not report['ok']:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()